@@ -6,15 +6,23 @@ import os
 import getopt
 import logging
 from xdg.BaseDirectory import xdg_data_home
-from PyQt5.QtWidgets import QApplication
-from qpassword_manager.login_window import LoginWindow
+from qpassword_manager.profiling import Profiler
 
 
-def main() -> None:
-    """Argument parsing and app initialization"""
+def main() -> int:
+    """Argument parsing and app initialization, runs a command from cli
+    instead of the app if one is given"""
+
+    profile_file = None
+    trace_memory = False
+    trace_file = None
 
     try:
-        opts, _ = getopt.getopt(sys.argv[1:], "l:", ["log="])
+        opts, args = getopt.getopt(
+            sys.argv[1:],
+            "l:",
+            ["log=", "profile=", "trace-memory", "trace-file="],
+        )
 
         for option, argument in opts:
             if option in ("-h", "--help"):
@@ -26,22 +34,56 @@ def main() -> None:
                     raise ValueError(f"Invalid log level: {argument}")
                 logging.basicConfig(level=level)
 
+            elif option == "--profile":
+                profile_file = os.path.abspath(argument)
+
+            elif option == "--trace-memory":
+                trace_memory = True
+
+            elif option == "--trace-file":
+                trace_file = os.path.abspath(argument)
+
     except getopt.GetoptError as err:
         print(str(err))
-
-    app = QApplication(["qpassword_manager"])
+        args = []
 
     directory = os.path.join(xdg_data_home, "qpassword_manager")
     if not os.path.exists(directory):
         os.makedirs(directory)
 
+    if args:
+        # pylint: disable=import-outside-toplevel
+        from qpassword_manager import cli
+
+        if args[0] not in (*cli.COMMANDS, "agent"):
+            print(cli.USAGE, file=sys.stderr)
+            return 2
+
+        os.chdir(directory)
+        Profiler.start(profile_file, trace_memory, trace_file)
+        try:
+            return cli.run(args)
+        finally:
+            Profiler.stop()
+
+    # pylint: disable=import-outside-toplevel
+    from PyQt5.QtWidgets import QApplication
+    from qpassword_manager.login_window import LoginWindow
+
+    app = QApplication(["qpassword_manager"])
+
     os.chdir(directory)
 
+    Profiler.start(profile_file, trace_memory, trace_file)
+
     window = LoginWindow()
     window.show()
 
     app.exec()
 
+    Profiler.stop()
+    return 0
+
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,340 @@
+"""Agent that keeps unlocked vaults in memory and serves them over a Unix
+socket, like ssh-agent"""
+
+import ctypes
+import getopt
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from qpassword_manager.conf.connectorconfig import Config
+from qpassword_manager.crypto import VaultCipher
+from qpassword_manager.database.database_handler import DatabaseHandler
+
+# seconds an unlocked vault is kept if the config doesn't say otherwise
+DEFAULT_TIMEOUT = 900
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+PR_SET_DUMPABLE = 4
+
+
+def socket_path() -> str:
+    """Returns path of the agent socket, in a directory only the user can
+    access"""
+
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/{os.getuid()}"
+    return os.path.join(runtime_dir, "qpassword_manager", "agent.sock")
+
+
+def private_directory(directory) -> bool:
+    """Returns True if directory belongs to the user and no one else can
+    access it"""
+
+    stat = os.stat(directory)
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o077
+
+
+def peer_uid(conn) -> int:
+    """Returns the uid of the process at the other end of a Unix socket,
+    None where the platform doesn't tell"""
+
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+
+    _, uid, _ = struct.unpack(
+        "3i",
+        conn.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        ),
+    )
+    return uid
+
+
+def request(command, **args) -> dict:
+    """
+    Sends a request to the agent
+
+    Keys are only sent to an agent of the same user, one whose socket
+    is in a directory others can access or that runs as another user
+    is ignored.
+
+    Parameters:
+        command (str): name of the command
+        args: arguments of the command
+
+    Returns:
+        dict: response of the agent, None if no agent is running
+    """
+
+    path = socket_path()
+    try:
+        if not private_directory(os.path.dirname(path)):
+            logging.warning("%s is accessible by other users", path)
+            return None
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(10)
+            conn.connect(path)
+            if peer_uid(conn) not in (None, os.getuid()):
+                logging.warning("%s belongs to another user", path)
+                return None
+
+            conn.sendall(json.dumps({"command": command, **args}).encode())
+            conn.sendall(b"\n")
+            with conn.makefile("rb") as file:
+                return json.loads(file.readline())
+    except (OSError, ValueError):
+        return None
+
+
+class AgentError(Exception):
+    """Error sent back to the client"""
+
+
+def lock_memory() -> None:
+    """Keeps the agent's memory out of swap and core dumps where the
+    platform allows it"""
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE):
+            logging.warning(
+                "mlockall failed: %s", os.strerror(ctypes.get_errno())
+            )
+        libc.prctl(PR_SET_DUMPABLE, 0, 0, 0, 0)
+    except (OSError, AttributeError) as error:
+        logging.warning("memory isn't locked: %s", error)
+
+
+class Vault:  # pylint: disable=too-few-public-methods
+    """
+    Unlocked vault of a user
+
+    Attributes:
+        auth: username and hashed master key
+        key: derived key
+        cipher: VaultCipher made from key
+        index: id, website and username of every entry or None if it has
+            to be reloaded
+        expires: time.monotonic() value after which the vault is locked
+    """
+
+    def __init__(self, auth, key, timeout) -> None:
+        self.auth = auth
+        self.key = key
+        self.cipher = VaultCipher(key)
+        self.index = None
+        self.expires = time.monotonic() + timeout
+
+
+class Agent(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Agent server
+
+    Every request is a line of json {"command": str, ...} answered with a
+    line of json, {"error": str} if it failed. Only processes of the same
+    user may connect.
+
+    Attributes:
+        handler: DatabaseHandler used to load vaults
+        vaults: Vault objects by username
+        vault_timeout: seconds a vault stays unlocked
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, timeout) -> None:
+        self.handler = DatabaseHandler(Config.config(), report=logging.error)
+        self.vaults = {}
+        self.lock = threading.Lock()
+        self.vault_timeout = timeout
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if not private_directory(directory):
+            raise AgentError(f"{directory} is accessible by other users")
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, AgentRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def verify_request(  # pylint: disable=redefined-outer-name
+        self, request, client_address
+    ) -> bool:
+        """Accepts connections from processes of the same user"""
+
+        uid = peer_uid(request)
+        if uid not in (None, os.getuid()):
+            logging.warning("refused connection from uid %d", uid)
+            return False
+        return True
+
+    def lock_expired(self) -> None:
+        """Drops vaults whose timeout passed, self.lock has to be held"""
+
+        now = time.monotonic()
+        for name in [
+            name for name, vault in self.vaults.items() if vault.expires <= now
+        ]:
+            logging.info("locking %s", name)
+            del self.vaults[name]
+
+    def service_actions(self) -> None:
+        """Locks expired vaults, serve_forever calls this at least every
+        poll interval even when no requests come in"""
+
+        with self.lock:
+            self.lock_expired()
+
+    def vault(self, username) -> Vault:
+        """Returns the unlocked vault of a user, locking expired vaults"""
+
+        with self.lock:
+            self.lock_expired()
+            if username not in self.vaults:
+                raise AgentError(f"{username} is locked")
+            return self.vaults[username]
+
+    def index(self, vault) -> list:
+        """Returns the index of a vault, loading it if needed, it's only
+        kept once every entry was read"""
+
+        if vault.index is None:
+            index = []
+            for batch in self.handler.stream_all(vault.auth, 500, False):
+                index.extend(tuple(entry[:3]) for entry in batch)
+            vault.index = index
+
+        return vault.index
+
+    def run(  # pylint: disable=too-many-return-statements
+        self, command, args
+    ) -> dict:
+        """Runs a command and returns the response"""
+
+        if command == "ping":
+            return {}
+
+        if command == "add":
+            auth = (args["username"], args["auth"])
+            with self.lock:
+                self.vaults[args["username"]] = Vault(
+                    auth, args["key"].encode(), self.vault_timeout
+                )
+            return {}
+
+        if command == "lock":
+            with self.lock:
+                if args.get("username"):
+                    self.vaults.pop(args["username"], None)
+                else:
+                    self.vaults.clear()
+            return {}
+
+        if command == "stop":
+            threading.Thread(target=self.shutdown).start()
+            return {}
+
+        vault = self.vault(args["username"])
+
+        if command == "key":
+            return {"auth": vault.auth[1], "key": vault.key.decode()}
+
+        if command == "invalidate":
+            # the change was made by another process, past the cache
+            vault.index = None
+            self.handler.cache.invalidate(vault.auth[0])
+            return {}
+
+        if command == "ls":
+            return {"entries": self.index(vault)}
+
+        if command == "search":
+            query = args["query"].casefold()
+            return {
+                "entries": [
+                    entry
+                    for entry in self.index(vault)
+                    if query in entry[1].casefold()
+                    or query in entry[2].casefold()
+                ]
+            }
+
+        if command == "get":
+            entry = self.handler.get_entry(args["id"], vault.auth)
+            if not entry:
+                raise AgentError(f"No entry with id {args['id']}")
+            return {"password": vault.cipher.decrypt(entry[2]).decode()}
+
+        raise AgentError(f"Unknown command {command}")
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    """Reads requests from a connection and writes the responses"""
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                args = json.loads(line)
+                response = self.server.run(args.pop("command"), args)
+            except AgentError as error:
+                response = {"error": str(error)}
+            except Exception as error:  # pylint: disable=broad-except
+                logging.exception("request failed")
+                response = {"error": repr(error)}
+
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+def main(args) -> int:
+    """
+    Runs the agent until it's stopped
+
+    Parameters:
+        args (list): options, -t seconds sets how long vaults stay
+            unlocked, --stop stops a running agent
+    """
+
+    timeout = Config.config().get("agent_timeout", DEFAULT_TIMEOUT)
+    try:
+        opts, _ = getopt.getopt(args, "t:", ["timeout=", "stop"])
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        return 2
+
+    for option, argument in opts:
+        if option == "--stop":
+            if request("stop") is None:
+                print("No agent is running", file=sys.stderr)
+                return 1
+            return 0
+
+        timeout = int(argument)
+
+    if request("ping") is not None:
+        print("Agent is already running", file=sys.stderr)
+        return 1
+
+    lock_memory()
+    path = socket_path()
+    with Agent(path, timeout) as agent:
+        logging.info("agent listening on %s", path)
+        try:
+            agent.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+    return 0
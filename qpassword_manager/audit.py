@@ -0,0 +1,391 @@
+"""Finding reused, duplicate and weak passwords without keeping them"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+from collections import OrderedDict
+from cryptography.fernet import InvalidToken
+from qpassword_manager.crypto import decode_token
+
+# passwords with a lower score are reported as weak
+WEAK_SCORE = 2
+
+# bits of entropy needed for the scores 1 to 4
+SCORE_BITS = (28, 36, 60, 80)
+
+# passwords fetched by one step, each is a request to an online vault
+FETCHES_PER_STEP = 10
+
+COMMON_PASSWORDS = frozenset(
+    {
+        "123456",
+        "123456789",
+        "12345678",
+        "1234567890",
+        "111111",
+        "000000",
+        "qwerty",
+        "qwertyuiop",
+        "asdfghjkl",
+        "password",
+        "password1",
+        "iloveyou",
+        "letmein",
+        "welcome",
+        "admin",
+        "abc123",
+        "monkey",
+        "dragon",
+        "football",
+        "sunshine",
+    }
+)
+
+
+def strength(password) -> int:
+    """
+    Returns the strength of a password from 0 (very weak) to 4 (strong)
+
+    The entropy is estimated from the kinds of characters in the password
+    and its length, characters that repeat or continue a sequence of the
+    previous one count as one
+    """
+
+    if not password or password.casefold() in COMMON_PASSWORDS:
+        return 0
+
+    charset = 0
+    for kind in (str.islower, str.isupper, str.isdigit):
+        if any(kind(char) for char in password):
+            charset += 10 if kind is str.isdigit else 26
+    if any(not char.isalnum() for char in password):
+        charset += 33
+
+    length = 1 + sum(
+        abs(ord(char) - ord(previous)) > 1
+        for previous, char in zip(password, password[1:])
+    )
+    bits = length * math.log2(max(charset, 2))
+    return sum(bits >= needed for needed in SCORE_BITS)
+
+
+class EntryAudit:  # pylint: disable=too-few-public-methods
+    """
+    Audit result of one entry
+
+    Attributes:
+        version: what the result was audited at, the modification order
+            of the entry or the digest of its ciphertext, None if neither
+            was known
+        website: website
+        username: username
+        fingerprint: VaultCipher.fingerprint of the password, None if it
+            can't be decrypted
+        score: strength of the password, None if it can't be decrypted
+    """
+
+    __slots__ = ("version", "website", "username", "fingerprint", "score")
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, version, website, username, fingerprint, score
+    ) -> None:
+        self.version = version
+        self.website = website
+        self.username = username
+        self.fingerprint = fingerprint
+        self.score = score
+
+
+class PasswordAudit:
+    """
+    Audit of the passwords of a vault that is updated incrementally
+
+    A pass lists the vault with begin, update and end, which queue the
+    entries that changed since they were audited, step then decrypts the
+    queue in batches. The vault can be listed without passwords, changes
+    are then found by the modification order of the backend and only the
+    passwords of queued entries are fetched. Only the keyed fingerprint
+    and score of a password are kept, reuse is found by counting
+    fingerprints in one pass. The results can be stored encrypted, so
+    the next session starts from them.
+
+    Attributes:
+        cipher: VaultCipher of the vault
+        path: file the results are stored in
+        fetch: function returning the ciphertext of an entry id or None,
+            used for entries listed without their password
+        entries: EntryAudit by entry id
+        pending: (version, website, username, ciphertext or None) left to
+            audit by entry id
+        counts: number of entries by fingerprint
+    """
+
+    def __init__(self, cipher, path=None, fetch=None) -> None:
+        self.cipher = cipher
+        self.path = path
+        self.fetch = fetch
+        self.entries = {}
+        self.pending = OrderedDict()
+        self.counts = {}
+        self._seen = None
+        self._order = {}
+
+    @staticmethod
+    def version(password) -> str:
+        """Returns the digest a ciphertext is recognized by"""
+
+        return hashlib.blake2b(
+            decode_token(password), digest_size=16
+        ).hexdigest()
+
+    def load(self) -> None:
+        """Reads the results stored by save, a file that can't be read is
+        started over"""
+
+        self.entries = {}
+        self.counts = {}
+        try:
+            with open(self.path, "rb") as file:
+                data = json.loads(self.cipher.decrypt(file.read()))
+            for (
+                entry_id,
+                version,
+                website,
+                username,
+                fingerprint,
+                score,
+            ) in data:
+                if fingerprint is not None:
+                    fingerprint = bytes.fromhex(fingerprint)
+                self.store(
+                    entry_id,
+                    EntryAudit(version, website, username, fingerprint, score),
+                )
+        except FileNotFoundError:
+            pass
+        except (InvalidToken, ValueError, TypeError) as error:
+            logging.warning("%s can't be read: %r", self.path, error)
+            self.entries = {}
+            self.counts = {}
+
+    def save(self) -> None:
+        """Writes the results to a temporary file and renames it"""
+
+        data = [
+            [
+                entry_id,
+                result.version,
+                result.website,
+                result.username,
+                None
+                if result.fingerprint is None
+                else result.fingerprint.hex(),
+                result.score,
+            ]
+            for entry_id, result in self.entries.items()
+        ]
+        with open(self.path + ".new", "wb") as file:
+            file.write(self.cipher.encrypt(json.dumps(data).encode()))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".new", self.path)
+
+    def begin(self, order=None) -> None:
+        """Starts listing the vault, order is the modification order of
+        the backend, an empty one if it doesn't keep track"""
+
+        self._seen = set()
+        self._order = order or {}
+
+    def update(self, entries) -> None:
+        """
+        Queues entries (id, website, username, password) that changed
+        since they were audited
+
+        Changes are found by the modification order or, without one, by
+        the ciphertext. password is the ciphertext or, for a vault listed
+        without passwords, the length or None, the passwords of such
+        entries are fetched by step. Without either only entries that
+        weren't audited yet and the ones queued by queue are audited
+        again.
+        """
+
+        for entry_id, website, username, password in entries:
+            if self._seen is not None:
+                self._seen.add(entry_id)
+
+            if isinstance(password, int):
+                password = None
+            version = self._order.get(entry_id)
+            if version is None and password is not None:
+                version = self.version(password)
+
+            result = self.entries.get(entry_id)
+            if entry_id in self.pending:
+                queued = self.pending[entry_id]
+                if password is None and queued[3] is not None:
+                    version, password = queued[0], queued[3]
+                self.pending[entry_id] = (version, website, username, password)
+            elif result is None or (
+                version is not None and result.version != version
+            ):
+                self.pending[entry_id] = (version, website, username, password)
+            else:
+                result.website = website
+                result.username = username
+
+    def queue(self, entry_id, website, username, password) -> None:
+        """Queues an entry that was changed with its new ciphertext"""
+
+        self.pending[entry_id] = (
+            self.version(password),
+            website,
+            username,
+            password,
+        )
+
+    def end(self) -> None:
+        """Ends listing the vault, entries that weren't listed are
+        removed"""
+
+        for entry_id in set(self.entries) - self._seen:
+            self.remove(entry_id)
+        for entry_id in set(self.pending) - self._seen:
+            del self.pending[entry_id]
+        self._seen = None
+
+    def remove(self, entry_id) -> None:
+        """Removes the result of an entry"""
+
+        self.pending.pop(entry_id, None)
+        result = self.entries.pop(entry_id, None)
+        if result is not None and result.fingerprint is not None:
+            self.counts[result.fingerprint] -= 1
+            if not self.counts[result.fingerprint]:
+                del self.counts[result.fingerprint]
+
+    def store(self, entry_id, result) -> None:
+        """Replaces the result of an entry"""
+
+        self.remove(entry_id)
+        self.entries[entry_id] = result
+        if result.fingerprint is not None:
+            self.counts[result.fingerprint] = (
+                self.counts.get(result.fingerprint, 0) + 1
+            )
+
+    def step(self, batch_size) -> bool:
+        """
+        Audits up to batch_size queued entries, fetching at most
+        FETCHES_PER_STEP passwords
+
+        Returns:
+            bool: True if some are left, False once the queue is empty or
+                a password couldn't be fetched, the entry stays queued
+        """
+
+        fetches = 0
+        for _ in range(min(batch_size, len(self.pending))):
+            entry_id, (
+                version,
+                website,
+                username,
+                password,
+            ) = self.pending.popitem(last=False)
+            if password is None:
+                limited = fetches == FETCHES_PER_STEP
+                if not limited and self.fetch is not None:
+                    fetches += 1
+                    password = self.fetch(entry_id)
+                if password is None:
+                    # the rest waits for the next step
+                    self.pending[entry_id] = (version, website, username, None)
+                    self.pending.move_to_end(entry_id, last=False)
+                    return limited
+                if version is None:
+                    version = self.version(password)
+
+            try:
+                plain = self.cipher.decrypt(password)
+                fingerprint = self.cipher.fingerprint(plain)
+                score = strength(plain.decode(errors="replace"))
+            except InvalidToken:
+                fingerprint = score = None
+
+            self.store(
+                entry_id,
+                EntryAudit(version, website, username, fingerprint, score),
+            )
+
+        return bool(self.pending)
+
+    def reused(self, entry_id) -> int:
+        """Returns the number of other entries with the same password"""
+
+        result = self.entries.get(entry_id)
+        if result is None or result.fingerprint is None:
+            return 0
+        return self.counts[result.fingerprint] - 1
+
+    def report(self) -> dict:
+        """
+        Returns the findings
+
+        Returns:
+            dict: "weak" list of (id, website, username, score), "reused"
+                lists of (id, website, username) sharing a password,
+                "duplicates" lists of the same entry stored more than
+                once and "unreadable" entries that can't be decrypted
+        """
+
+        groups = {}
+        weak = []
+        unreadable = []
+        for entry_id, result in sorted(self.entries.items()):
+            entry = (entry_id, result.website, result.username)
+            if result.fingerprint is None:
+                unreadable.append(entry)
+                continue
+
+            if result.score < WEAK_SCORE:
+                weak.append((*entry, result.score))
+            if self.counts[result.fingerprint] > 1:
+                groups.setdefault(result.fingerprint, []).append(entry)
+
+        duplicates = []
+        reused = []
+        for group in groups.values():
+            names = {}
+            for entry in group:
+                names.setdefault(entry[1:], []).append(entry)
+            duplicates.extend(same for same in names.values() if len(same) > 1)
+            if len(names) > 1:
+                reused.append(group)
+
+        return {
+            "weak": weak,
+            "reused": reused,
+            "duplicates": duplicates,
+            "unreadable": unreadable,
+        }
+
+
+def format_report(report) -> str:
+    """Returns a report from PasswordAudit.report as text"""
+
+    def names(entries):
+        return ", ".join(f"{entry[1]} ({entry[2]})" for entry in entries)
+
+    lines = []
+    if report["weak"]:
+        lines.append("Weak passwords: " + names(report["weak"]))
+    for group in report["reused"]:
+        lines.append("Same password: " + names(group))
+    for group in report["duplicates"]:
+        lines.append("Stored more than once: " + names(group[:1]))
+    if report["unreadable"]:
+        lines.append("Can't be decrypted: " + names(report["unreadable"]))
+
+    return "\n".join(lines) or "No problems found"
@@ -0,0 +1,299 @@
+"""Encrypted, deduplicated snapshots of offline vaults"""
+
+import json
+import os
+import shutil
+import sqlite3
+import time
+import zlib
+from cryptography.fernet import InvalidToken
+from qpassword_manager import filelock, usage
+
+# files are split into chunks of this size, a multiple of the sqlite page
+# size, so a changed page only changes the chunk it is in
+CHUNK_SIZE = 64 << 10
+
+# seconds between backups taken by the app if config doesn't say otherwise
+DEFAULT_INTERVAL = 3600
+
+
+class BackupStore:
+    """
+    Snapshots of the files of one user's vault
+
+    Files are split into chunks, every chunk is compressed, encrypted and
+    stored once under its keyed fingerprint in chunks/, so a snapshot only
+    adds the chunks that changed since any earlier one. A snapshot is an
+    encrypted manifest in snapshots/ listing the chunks of every file.
+    Everything is encrypted with the vault key, after the master key is
+    changed older snapshots need the old one.
+
+    Attributes:
+        path: directory of the store
+        cipher: VaultCipher of the vault
+    """
+
+    def __init__(self, path, cipher) -> None:
+        self.path = path
+        self.cipher = cipher
+
+    @staticmethod
+    def write_atomic(path, data) -> None:
+        """Writes data to a temporary file and renames it to path"""
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def chunk_path(self, name) -> str:
+        """Returns path of the chunk with name"""
+
+        return os.path.join(self.path, "chunks", name[:2], name)
+
+    def put_chunk(self, chunk) -> (str, int):
+        """Stores a chunk unless it's there already, returns its name and
+        the number of bytes written"""
+
+        name = self.cipher.fingerprint(chunk).hex()
+        path = self.chunk_path(name)
+        if os.path.exists(path):
+            return name, 0
+
+        data = self.cipher.encrypt(zlib.compress(chunk))
+        self.write_atomic(path, data)
+        return name, len(data)
+
+    def get_chunk(self, name) -> bytes:
+        """
+        Returns the contents of a chunk
+
+        Raises:
+            ValueError: if the chunk is missing or corrupted
+        """
+
+        try:
+            with open(self.chunk_path(name), "rb") as file:
+                chunk = zlib.decompress(self.cipher.decrypt(file.read()))
+        except (OSError, InvalidToken, zlib.error) as error:
+            raise ValueError(f"Chunk {name} can't be read") from error
+
+        if self.cipher.fingerprint(chunk).hex() != name:
+            raise ValueError(f"Chunk {name} is corrupted")
+        return chunk
+
+    def snapshots(self) -> list:
+        """Returns names of the snapshots, oldest first"""
+
+        try:
+            return sorted(os.listdir(os.path.join(self.path, "snapshots")))
+        except FileNotFoundError:
+            return []
+
+    def manifest(self, snapshot) -> dict:
+        """Returns the manifest of a snapshot, {"created": time, "files":
+        {name: {"size": int, "chunks": [name, ...]}}}"""
+
+        with open(os.path.join(self.path, "snapshots", snapshot), "rb") as file:
+            try:
+                return json.loads(self.cipher.decrypt(file.read()))
+            except InvalidToken as error:
+                raise ValueError(
+                    f"Snapshot {snapshot} was taken with another master key"
+                ) from error
+
+    def create(self, files) -> (str, int):
+        """
+        Takes a snapshot
+
+        Parameters:
+            files (dict): path of a consistent copy of every file by the
+                name it is restored as
+
+        Returns:
+            name of the snapshot, the latest one if nothing changed since,
+            and the number of bytes written
+        """
+
+        manifest = {"created": time.time(), "files": {}}
+        written = 0
+        for name, path in files.items():
+            chunks = []
+            with open(path, "rb") as file:
+                while chunk := file.read(CHUNK_SIZE):
+                    chunk_name, size = self.put_chunk(chunk)
+                    chunks.append(chunk_name)
+                    written += size
+
+            manifest["files"][name] = {
+                "size": os.path.getsize(path),
+                "chunks": chunks,
+            }
+
+        snapshots = self.snapshots()
+        if snapshots:
+            try:
+                if self.manifest(snapshots[-1])["files"] == manifest["files"]:
+                    os.utime(
+                        os.path.join(self.path, "snapshots", snapshots[-1])
+                    )
+                    return snapshots[-1], written
+            except ValueError:
+                pass
+
+        snapshot = time.strftime(
+            "%Y%m%dT%H%M%SZ", time.gmtime(manifest["created"])
+        )
+        if snapshot in snapshots:
+            snapshot += f".{len(snapshots)}"
+        data = self.cipher.encrypt(json.dumps(manifest).encode())
+        self.write_atomic(os.path.join(self.path, "snapshots", snapshot), data)
+        return snapshot, written + len(data)
+
+    def restore(self, snapshot, directory) -> list:
+        """
+        Restores the files of a snapshot to directory
+
+        Every file is read and verified before any file is replaced, the
+        write-ahead log of a restored sqlite database is removed
+
+        Returns:
+            list: names of the restored files
+
+        Raises:
+            ValueError: if the snapshot can't be read
+        """
+
+        files = self.manifest(snapshot)["files"]
+        for name, info in files.items():
+            with open(os.path.join(directory, name + ".restore"), "wb") as file:
+                for chunk in info["chunks"]:
+                    file.write(self.get_chunk(chunk))
+                file.flush()
+                os.fsync(file.fileno())
+
+        for name in files:
+            path = os.path.join(directory, name)
+            if name.endswith(".db"):
+                for suffix in ("-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+            os.replace(path + ".restore", path)
+
+        return list(files)
+
+    def prune(self, keep) -> int:
+        """Removes all but the newest keep snapshots and the chunks only
+        they used, returns the number of removed chunks. Chunks are kept
+        while a snapshot taken with another master key is left."""
+
+        snapshots = self.snapshots()
+        for snapshot in snapshots[: max(len(snapshots) - keep, 0)]:
+            os.remove(os.path.join(self.path, "snapshots", snapshot))
+
+        used = set()
+        try:
+            for snapshot in self.snapshots():
+                for info in self.manifest(snapshot)["files"].values():
+                    used.update(info["chunks"])
+        except ValueError:
+            # chunks of snapshots taken with another key are unknown
+            return 0
+
+        removed = 0
+        chunks = os.path.join(self.path, "chunks")
+        for directory in os.listdir(chunks) if os.path.isdir(chunks) else []:
+            for name in os.listdir(os.path.join(chunks, directory)):
+                if name not in used:
+                    os.remove(os.path.join(chunks, directory, name))
+                    removed += 1
+
+        return removed
+
+
+def store_path(username) -> str:
+    """Returns directory of the backups of a user, relative to the data
+    directory like the vaults"""
+
+    return os.path.join("backups", username)
+
+
+def copy_vault(username, config, directory) -> dict:
+    """
+    Makes consistent copies of the files of an offline vault in directory
+
+    The sqlite database is copied with the online backup API, the log
+    while it's locked against appends, stored uncommitted changes and
+    usage scores as they are
+
+    Returns:
+        dict: paths of the copies by file name
+    """
+
+    files = {}
+    if config.get("database_backend", "sqlite") == "log":
+        name = username + ".log"
+        with open(name, "rb") as source:
+            filelock.lock(source, shared=True)
+            with open(os.path.join(directory, name), "wb") as copy:
+                shutil.copyfileobj(source, copy)
+    else:
+        name = username + ".db"
+        source = sqlite3.connect(name)
+        copy = sqlite3.connect(os.path.join(directory, name))
+        with copy:
+            source.backup(copy)
+        copy.close()
+        source.close()
+    files[name] = os.path.join(directory, name)
+
+    for name in ("changes_" + username, usage.store_path(username, config)):
+        if os.path.exists(name):
+            shutil.copyfile(name, os.path.join(directory, name))
+            files[name] = os.path.join(directory, name)
+
+    return files
+
+
+def backup(username, config, cipher) -> (str, int):
+    """
+    Takes a snapshot of an offline vault
+
+    Returns:
+        name of the snapshot and the number of bytes written
+
+    Raises:
+        ValueError: if the vault is online
+    """
+
+    if config["database_online"]:
+        raise ValueError("Only offline vaults are backed up")
+
+    store = BackupStore(store_path(username), cipher)
+    directory = os.path.join(store.path, "tmp")
+    os.makedirs(directory, exist_ok=True)
+    try:
+        return store.create(copy_vault(username, config, directory))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def backup_due(username, config) -> bool:
+    """Returns True if the app should take a snapshot, backup_interval in
+    config is the number of seconds between snapshots, 0 disables them"""
+
+    interval = config.get("backup_interval", DEFAULT_INTERVAL)
+    if not interval or config["database_online"]:
+        return False
+
+    directory = os.path.join(store_path(username), "snapshots")
+    try:
+        last = max(
+            os.path.getmtime(os.path.join(directory, name))
+            for name in os.listdir(directory)
+        )
+    except (FileNotFoundError, ValueError):
+        return True
+    return time.time() - last >= interval
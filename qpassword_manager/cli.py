@@ -0,0 +1,510 @@
+"""Command line interface that works without Qt"""
+
+import getopt
+import getpass
+import hashlib
+import os
+import sqlite3
+import sys
+import pyperclip
+from cryptography.fernet import InvalidToken
+from qpassword_manager import agent
+from qpassword_manager import backup
+from qpassword_manager.audit import PasswordAudit, format_report
+from qpassword_manager.clipboard import Clipboard
+from qpassword_manager.conf.connectorconfig import Config
+from qpassword_manager.crypto import VaultCipher, derive_key, encode_token
+from qpassword_manager.database.database_handler import DatabaseHandler
+from qpassword_manager.database import verify
+from qpassword_manager.database.rekey import rekey_changes
+from qpassword_manager.usage import UsageRanking, store_path
+
+USAGE = """usage: qpassword_manager [-l level] <command> [-u user] [args]
+
+commands:
+    ls                          list entries
+    search <query>              list entries matching query, the most
+                                used first
+    get [-p] <id or query>      copy password, -p prints it instead
+    add <website> <username>    add entry, password is read from stdin
+    rm <id>                     remove entry
+    audit                       list reused, duplicate and weak passwords
+    backup [list | restore <snapshot> | prune <keep>]
+                                snapshot the offline vault, list or
+                                restore snapshots or remove all but the
+                                newest keep
+    passwd [--abort]            change master key, --abort drops a change
+                                that was interrupted
+    sync [--push | --pull] [--prefer local|remote]
+                                merge the offline vault and the server,
+                                entries deleted on one side since the
+                                last sync are deleted on the other one,
+                                --push only writes to the other vault,
+                                --pull only to this one, --prefer resolves
+                                conflicts with the entry from that side
+    verify                      check the vault files and that every
+                                password can be decrypted
+
+    agent [-t seconds]          keep unlocked vaults in memory
+    agent --stop                stop the agent
+
+The user is taken from -u or $QPASSWORD_MANAGER_USER and the master key
+from $QPASSWORD_MANAGER_KEY, both are asked for if they aren't set. While
+the agent runs, the master key is only asked for the first time. passwd
+takes the new master key from $QPASSWORD_MANAGER_NEW_KEY."""
+
+
+class Session:
+    """
+    Logged in user
+
+    Attributes:
+        handler: DatabaseHandler that reports errors to stderr
+        auth: username and hashed master key
+        master_key: plain text master key, None if the key came from the
+            agent
+        key: derived key, derived from master_key when it's first needed
+        use_agent: True if lookups are served by the agent
+        usage: UsageRanking of the vault, loaded when it's first needed
+    """
+
+    def __init__(
+        self, auth, master_key=None, key=None, use_agent=False
+    ) -> None:
+        self.handler = DatabaseHandler(Config.config(), report=report)
+        self.auth = auth
+        self.master_key = master_key
+        self.use_agent = use_agent
+        self._key = key
+        self._cipher = None
+        self._usage = None
+
+    @property
+    def key(self) -> bytes:
+        """Derived key of the user"""
+
+        if self._key is None:
+            self._key = derive_key(self.master_key)
+        return self._key
+
+    @property
+    def cipher(self) -> VaultCipher:
+        """VaultCipher of the user, the key is only derived when a
+        command needs it"""
+
+        if self._cipher is None:
+            self._cipher = VaultCipher(self.key)
+        return self._cipher
+
+    @property
+    def usage(self) -> UsageRanking:
+        """Usage scores of the entries of the user"""
+
+        if self._usage is None:
+            self._usage = UsageRanking(
+                store_path(self.auth[0], self.handler.config), self.cipher
+            )
+            self._usage.load()
+        return self._usage
+
+    def ranked(self, entries) -> list:
+        """Returns entries (id, ...) with the most used first"""
+
+        return sorted(entries, key=lambda entry: -self.usage.key(entry[0]))
+
+    def save_usage(self) -> None:
+        """Stores the usage scores, reporting a failure"""
+
+        try:
+            self.usage.save()
+        except OSError as error:
+            report(f"Usage couldn't be stored: {error}")
+
+    def request(self, command, **args) -> dict:
+        """Sends a request about the user to the agent and returns the
+        response, None if it failed"""
+
+        response = agent.request(command, username=self.auth[0], **args)
+        if response is None:
+            report("Agent stopped")
+            return None
+        if "error" in response:
+            report(response["error"])
+            return None
+        return response
+
+    def password(self, entry_id) -> str:
+        """Returns the decrypted password of an entry or None if it can't
+        be read"""
+
+        if self.use_agent:
+            response = self.request("get", id=entry_id)
+            return response and response["password"]
+
+        entry = self.handler.get_entry(entry_id, self.auth)
+        if not entry:
+            report(f"No entry with id {entry_id}")
+            return None
+
+        try:
+            return self.cipher.decrypt(entry[2]).decode()
+        except InvalidToken:
+            report(f"Entry {entry_id} can't be decrypted")
+            return None
+
+    def entries(self, query=None):
+        """Yields id, website and username of every entry or of the
+        entries matching query"""
+
+        if self.use_agent:
+            if query is None:
+                response = self.request("ls")
+            else:
+                response = self.request("search", query=query)
+            yield from (response or {}).get("entries", [])
+            return
+
+        if query is None:
+            stream = self.handler.stream_all(self.auth, 500, False)
+            while batch := self.handler.next_batch(stream):
+                for entry in batch:
+                    yield entry[:3]
+            return
+
+        offset = 0
+        while batch := self.handler.search(query, self.auth, 500, offset):
+            yield from batch
+            offset += len(batch)
+
+
+def report(message) -> None:
+    """Prints an error message to stderr"""
+
+    print(message, file=sys.stderr)
+
+
+def print_entries(entries) -> None:
+    """Prints entries as tab separated id, website and username"""
+
+    for entry_id, website, username in entries:
+        print(entry_id, website, username, sep="\t")
+
+
+def cmd_ls(session, args, _options) -> int:
+    """Lists entries"""
+
+    if args:
+        raise getopt.GetoptError("ls takes no arguments")
+
+    print_entries(session.entries())
+    return 0
+
+
+def cmd_search(session, args, _options) -> int:
+    """Lists entries matching the query"""
+
+    if len(args) != 1:
+        raise getopt.GetoptError("search takes one query")
+
+    print_entries(session.ranked(session.entries(args[0])))
+    return 0
+
+
+def cmd_get(session, args, options) -> int:
+    """Copies or prints the password of an entry given by id or by a
+    query with exactly one match"""
+
+    if len(args) != 1:
+        raise getopt.GetoptError("get takes one id or query")
+
+    if args[0].isdigit():
+        entry_id = int(args[0])
+    else:
+        matches = session.ranked(session.entries(args[0]))
+        if len(matches) != 1:
+            report(f"{len(matches)} entries match {args[0]!r}")
+            print_entries(matches)
+            return 1
+        entry_id = matches[0][0]
+
+    password = session.password(entry_id)
+    if password is None:
+        return 1
+
+    session.usage.record(entry_id)
+    session.save_usage()
+    if "-p" in options or "--print" in options:
+        print(password)
+        return 0
+
+    try:
+        Clipboard.copy(password)
+    except pyperclip.PyperclipException as error:
+        report(f"{error}, use -p to print the password")
+        return 1
+
+    Clipboard.clear_detached(
+        password, session.handler.config.get("clipboard_timeout", 30)
+    )
+    return 0
+
+
+def cmd_add(session, args, _options) -> int:
+    """Adds an entry with the password read from stdin"""
+
+    if len(args) != 2:
+        raise getopt.GetoptError("add takes website and username")
+
+    if sys.stdin.isatty():
+        password = getpass.getpass("Password: ")
+    else:
+        password = sys.stdin.readline().rstrip("\n")
+
+    ciphertext = encode_token(session.cipher.encrypt(password.encode()))
+    if not session.handler.add_to_database(*args, ciphertext, session.auth):
+        return 1
+
+    if session.use_agent:
+        session.request("invalidate")
+    return 0
+
+
+def cmd_rm(session, args, _options) -> int:
+    """Removes an entry"""
+
+    if len(args) != 1 or not args[0].isdigit():
+        raise getopt.GetoptError("rm takes one id")
+
+    if not session.handler.remove_from_database(int(args[0]), session.auth):
+        return 1
+
+    if int(args[0]) in session.usage.keys:
+        session.usage.remove([int(args[0])])
+        session.save_usage()
+
+    if session.use_agent:
+        session.request("invalidate")
+    return 0
+
+
+def cmd_audit(session, args, _options) -> int:
+    """Prints reused, duplicate and weak passwords"""
+
+    if args:
+        raise getopt.GetoptError("audit takes no arguments")
+
+    audit = PasswordAudit(session.cipher)
+    audit.begin()
+    stream = session.handler.stream_all(session.auth, 500, True)
+    while batch := session.handler.next_batch(stream):
+        audit.update(batch)
+        audit.step(len(batch))
+    audit.end()
+
+    print(format_report(audit.report()))
+    return 0
+
+
+def cmd_backup(session, args, _options) -> int:
+    """Takes, lists, restores or prunes snapshots of the offline vault"""
+
+    store = backup.BackupStore(
+        backup.store_path(session.auth[0]), session.cipher
+    )
+    try:
+        if not args:
+            snapshot, written = backup.backup(
+                session.auth[0], session.handler.config, session.cipher
+            )
+            print(snapshot, f"{written} bytes written", sep="\t")
+        elif args == ["list"]:
+            for snapshot in store.snapshots():
+                print(snapshot)
+        elif len(args) == 2 and args[0] == "restore":
+            store.restore(args[1], ".")
+            session.handler.cache.invalidate(session.auth[0])
+        elif len(args) == 2 and args[0] == "prune" and args[1].isdigit():
+            print(f"{store.prune(int(args[1]))} chunks removed")
+        else:
+            raise getopt.GetoptError("backup takes list, restore or prune")
+    except (OSError, ValueError, sqlite3.Error) as error:
+        report(error)
+        return 1
+
+    return 0
+
+
+def cmd_passwd(session, args, options) -> int:
+    """Changes the master key, re-encrypting every password"""
+
+    if args:
+        raise getopt.GetoptError("passwd takes no arguments")
+
+    if "--abort" in options:
+        return 0 if session.handler.abort_rekey(session.auth) else 1
+
+    master_key = os.environ.get("QPASSWORD_MANAGER_NEW_KEY")
+    if not master_key:
+        master_key = getpass.getpass("New master key: ")
+        if getpass.getpass("Repeat new master key: ") != master_key:
+            report("Master keys don't match")
+            return 1
+
+    auth = (session.auth[0], hashlib.sha256(master_key.encode()).hexdigest())
+    key = derive_key(master_key)
+    cipher = VaultCipher(key)
+    if not session.handler.change_master_key(
+        session.auth, auth[1], session.cipher, cipher
+    ):
+        return 1
+
+    try:
+        rekey_changes("changes_" + auth[0], session.cipher, cipher)
+    except (OSError, ValueError, InvalidToken) as error:
+        report(f"Uncommitted changes couldn't be re-encrypted: {error!r}")
+
+    if os.path.exists(session.usage.path):
+        session.usage.cipher = cipher
+        session.save_usage()
+
+    # fingerprints are keyed with the vault key, the audit starts over
+    try:
+        os.remove(store_path(auth[0], session.handler.config, "audit"))
+    except FileNotFoundError:
+        pass
+
+    if session.use_agent:
+        agent.request("add", username=auth[0], auth=auth[1], key=key.decode())
+    return 0
+
+
+def cmd_sync(session, args, options) -> int:
+    """Merges the vault with the one on the other side, the server if the
+    vault is offline and the offline one otherwise"""
+
+    if args:
+        raise getopt.GetoptError("sync takes no arguments")
+
+    prefer = options.get("--prefer")
+    if prefer not in (None, "local", "remote"):
+        raise getopt.GetoptError("--prefer takes local or remote")
+
+    direction = "both"
+    for option in ("--push", "--pull"):
+        if option in options:
+            direction = option[2:]
+
+    config = session.handler.config
+    other = DatabaseHandler(
+        {**config, "database_online": not config["database_online"]},
+        report=report,
+    )
+    result = session.handler.sync_with(
+        other, session.auth, session.cipher, direction, prefer
+    )
+    if result is None:
+        return 1
+
+    print(
+        f"pushed {result['pushed']}, pulled {result['pulled']}, "
+        f"removed {result['removed_remote']} remote and "
+        f"{result['removed_local']} local, "
+        f"unchanged {result['unchanged']}, resolved {result['resolved']}"
+    )
+    for website, username in result["conflicts"]:
+        print("conflict", website, username, sep="\t")
+
+    if session.use_agent:
+        session.request("invalidate")
+    return 0
+
+
+def cmd_verify(session, args, _options) -> int:
+    """Checks the vault, returns 1 if something is wrong with it"""
+
+    if args:
+        raise getopt.GetoptError("verify takes no arguments")
+
+    result = session.handler.verify(session.auth, session.cipher)
+    if result is None:
+        return 1
+
+    print(verify.format_report(result))
+    return 1 if result["corrupt"] or result["storage"] else 0
+
+
+COMMANDS = {
+    "ls": cmd_ls,
+    "search": cmd_search,
+    "get": cmd_get,
+    "add": cmd_add,
+    "rm": cmd_rm,
+    "audit": cmd_audit,
+    "backup": cmd_backup,
+    "passwd": cmd_passwd,
+    "sync": cmd_sync,
+    "verify": cmd_verify,
+}
+
+
+def run(args) -> int:
+    """
+    Runs a command and returns the exit status
+
+    Parameters:
+        args (list): command followed by its options and arguments
+    """
+
+    command, args = args[0], args[1:]
+    if command == "agent":
+        return agent.main(args)
+
+    try:
+        opts, args = getopt.gnu_getopt(
+            args,
+            "u:p",
+            ["user=", "print", "abort", "push", "pull", "prefer="],
+        )
+    except getopt.GetoptError as err:
+        report(f"{err}\n\n{USAGE}")
+        return 2
+
+    options = dict(opts)
+    username = (
+        options.get("-u")
+        or options.get("--user")
+        or os.environ.get("QPASSWORD_MANAGER_USER")
+        or input("Username: ")
+    )
+
+    unlocked = agent.request("key", username=username)
+    if unlocked is not None and "key" in unlocked:
+        session = Session(
+            (username, unlocked["auth"]),
+            key=unlocked["key"].encode(),
+            use_agent=True,
+        )
+    else:
+        master_key = os.environ.get("QPASSWORD_MANAGER_KEY") or getpass.getpass(
+            "Master key: "
+        )
+        session = Session(
+            (username, hashlib.sha256(master_key.encode()).hexdigest()),
+            master_key,
+        )
+        if not session.handler.check_credentials(*session.auth):
+            return 1
+
+        if unlocked is not None:
+            agent.request(
+                "add",
+                username=username,
+                auth=session.auth[1],
+                key=session.key.decode(),
+            )
+
+    try:
+        return COMMANDS[command](session, args, options)
+    except getopt.GetoptError as err:
+        report(f"{err}\n\n{USAGE}")
+        return 2
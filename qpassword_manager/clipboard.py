@@ -0,0 +1,112 @@
+"""Clipboard that uses Qt in the app and pyperclip without it"""
+
+import os
+import sys
+import time
+import pyperclip
+
+
+class Clipboard:
+    """
+    Copies and pastes text, clearing copied secrets after a timeout
+
+    While a QApplication exists QClipboard is used, which doesn't start a
+    process, pyperclip is only used without one. All secrets share one
+    QTimer, copying a new secret restarts it.
+
+    Attributes:
+        secret: last copied secret that wasn't cleared yet, None if there
+            is none
+    """
+
+    secret = None
+    _timer = None
+
+    @staticmethod
+    def _qt_clipboard():
+        """Returns QClipboard if the app is running, without importing
+        PyQt5 otherwise"""
+
+        if "PyQt5.QtWidgets" not in sys.modules:
+            return None
+
+        app = sys.modules["PyQt5.QtWidgets"].QApplication.instance()
+        return app.clipboard() if app else None
+
+    @staticmethod
+    def copy(text, timeout=None) -> None:
+        """
+        Copies text to the clipboard
+
+        Parameters:
+            text (str): text to copy
+            timeout (float): seconds after which text is cleared from the
+                clipboard if it's still there, None if text isn't a secret
+        """
+
+        clipboard = Clipboard._qt_clipboard()
+        if clipboard is None:
+            pyperclip.copy(text)
+            return
+
+        clipboard.setText(text)
+        if timeout is None:
+            return
+
+        if Clipboard._timer is None:
+            # pylint: disable=import-outside-toplevel
+            from PyQt5.QtCore import QTimer
+
+            Clipboard._timer = QTimer()
+            Clipboard._timer.setSingleShot(True)
+            Clipboard._timer.timeout.connect(Clipboard.clear)
+
+        Clipboard.secret = text
+        Clipboard._timer.start(int(timeout * 1000))
+
+    @staticmethod
+    def paste() -> str:
+        """Returns text in the clipboard"""
+
+        clipboard = Clipboard._qt_clipboard()
+        if clipboard is None:
+            return pyperclip.paste()
+
+        return clipboard.text()
+
+    @staticmethod
+    def clear() -> None:
+        """Clears the clipboard if it still holds the last secret"""
+
+        if (
+            Clipboard.secret is not None
+            and Clipboard.paste() == Clipboard.secret
+        ):
+            Clipboard.copy("")
+        Clipboard.secret = None
+
+    @staticmethod
+    def clear_detached(text, timeout) -> None:
+        """
+        Clears text from the clipboard after timeout from a forked process,
+        so a command can exit right after copying
+
+        Parameters:
+            text (str): copied secret
+            timeout (float): seconds after which it's cleared
+        """
+
+        if not hasattr(os, "fork") or os.fork():
+            return
+
+        try:
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for descriptor in range(3):
+                os.dup2(devnull, descriptor)
+
+            time.sleep(timeout)
+            if pyperclip.paste() == text:
+                pyperclip.copy("")
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
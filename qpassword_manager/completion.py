@@ -0,0 +1,234 @@
+"""Completing websites and usernames from the ones already in a vault"""
+
+import bisect
+import heapq
+
+# suggestions kept for every prefix
+TOP_SIZE = 10
+
+
+class TrieNode:  # pylint: disable=too-few-public-methods
+    """
+    Node of a PrefixTrie
+
+    Attributes:
+        label: case folded text of the edge from the parent
+        children: TrieNode by the first character of its label
+        words: number of entries by word whose key ends here, words that
+            only differ in case end in the same node
+        top: sorted (-count, word) of the most common words below this
+            node, None until it's needed after a word below was removed
+    """
+
+    __slots__ = ("label", "children", "words", "top")
+
+    def __init__(self, label="") -> None:
+        self.label = label
+        self.children = {}
+        self.words = {}
+        self.top = None
+
+
+class PrefixTrie:
+    """
+    Words counted by how many entries use them, looked up by prefix
+
+    The trie is compressed, every edge holds the text up to the next
+    branch, so it has at most two nodes per distinct word. Every node
+    keeps the TOP_SIZE most common words below it, a lookup only walks
+    down the prefix. Adding a word updates the kept words on its path,
+    removing one clears them and they are merged from the children again
+    by the next lookup that reaches the node.
+    """
+
+    def __init__(self) -> None:
+        self.root = TrieNode()
+        self.root.top = []
+
+    def add(self, word) -> None:
+        """Counts an entry using word"""
+
+        if not word:
+            return
+
+        key = word.casefold()
+        node = self.root
+        path = [node]
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                child = TrieNode(key[i:])
+                child.top = []
+                node.children[key[i]] = child
+            else:
+                label = child.label
+                common = 0
+                end = min(len(label), len(key) - i)
+                while common < end and label[common] == key[i + common]:
+                    common += 1
+                if common < len(label):
+                    middle = TrieNode(label[:common])
+                    child.label = label[common:]
+                    middle.children[child.label[0]] = child
+                    middle.top = child.top
+                    node.children[key[i]] = middle
+                    child = middle
+
+            node = child
+            path.append(node)
+            i += len(node.label)
+
+        count = node.words.get(word, 0)
+        node.words[word] = count + 1
+        for node in path:
+            if node.top is not None:
+                node.top = self._ranked(node.top, word, count)
+
+    def remove(self, word) -> None:
+        """Stops counting an entry using word"""
+
+        path = self._path(word.casefold()) if word else None
+        if path is None or word not in path[-1].words:
+            return
+
+        for node in path:
+            node.top = None
+
+        node = path[-1]
+        node.words[word] -= 1
+        if node.words[word]:
+            return
+        del node.words[word]
+
+        # drop the node if nothing ends below it, then merge its parent
+        # into the only child left
+        if not node.words and not node.children and len(path) > 1:
+            del path[-2].children[node.label[0]]
+            node = path[-2]
+            path.pop()
+        if not node.words and len(node.children) == 1 and len(path) > 1:
+            (child,) = node.children.values()
+            child.label = node.label + child.label
+            path[-2].children[node.label[0]] = child
+
+    def complete(self, prefix, limit=TOP_SIZE) -> list:
+        """Returns at most limit words starting with prefix, case
+        insensitive, the most common first"""
+
+        key = prefix.casefold()
+        node = self.root
+        i = 0
+        while i < len(key):
+            node = node.children.get(key[i])
+            if node is None:
+                return []
+            if key.startswith(node.label, i):
+                i += len(node.label)
+            elif node.label.startswith(key[i:]):
+                break
+            else:
+                return []
+
+        return [word for _, word in self._top(node)[:limit]]
+
+    def _path(self, key) -> list:
+        """Returns the nodes from the root to the one key ends in, None if
+        there is none"""
+
+        path = [self.root]
+        i = 0
+        while i < len(key):
+            node = path[-1].children.get(key[i])
+            if node is None or not key.startswith(node.label, i):
+                return None
+            path.append(node)
+            i += len(node.label)
+        return path
+
+    @staticmethod
+    def _ranked(top, word, count) -> list:
+        """Returns top with the count of word raised from count by one"""
+
+        top = list(top)
+        if (-count, word) in top:
+            top.remove((-count, word))
+        bisect.insort(top, (-count - 1, word))
+        return top[:TOP_SIZE]
+
+    def _top(self, node) -> list:
+        """Returns the kept words of node, merging them first if a removal
+        cleared them"""
+
+        if node.top is None:
+            candidates = [(-count, word) for word, count in node.words.items()]
+            for child in node.children.values():
+                candidates.extend(self._top(child))
+            if len(candidates) > TOP_SIZE:
+                node.top = heapq.nsmallest(TOP_SIZE, candidates)
+            else:
+                node.top = sorted(candidates)
+        return node.top
+
+
+class CompletionIndex:
+    """
+    Websites and usernames of a vault for autocompletion
+
+    Like PasswordAudit a pass lists the vault with begin, update and end,
+    which only touch the tries for entries that changed since the last
+    pass. Entries changed before they are committed are set and removed
+    directly.
+
+    Attributes:
+        websites: PrefixTrie of websites
+        usernames: PrefixTrie of usernames
+        entries: (website, username) by entry id
+    """
+
+    def __init__(self) -> None:
+        self.websites = PrefixTrie()
+        self.usernames = PrefixTrie()
+        self.entries = {}
+        self._seen = None
+
+    def begin(self) -> None:
+        """Starts listing the vault"""
+
+        self._seen = set()
+
+    def update(self, entries) -> None:
+        """Sets entries (id, website, username, ...)"""
+
+        for entry_id, website, username, *_ in entries:
+            if self._seen is not None:
+                self._seen.add(entry_id)
+            self.set(entry_id, website, username)
+
+    def end(self) -> None:
+        """Ends listing the vault, entries that weren't listed are
+        removed"""
+
+        for entry_id in set(self.entries) - self._seen:
+            self.remove(entry_id)
+        self._seen = None
+
+    def set(self, entry_id, website, username) -> None:
+        """Sets website and username of an entry"""
+
+        old = self.entries.get(entry_id)
+        if old == (website, username):
+            return
+
+        self.remove(entry_id)
+        self.entries[entry_id] = (website, username)
+        self.websites.add(website)
+        self.usernames.add(username)
+
+    def remove(self, entry_id) -> None:
+        """Removes an entry"""
+
+        old = self.entries.pop(entry_id, None)
+        if old is not None:
+            self.websites.remove(old[0])
+            self.usernames.remove(old[1])
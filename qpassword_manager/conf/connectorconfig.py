@@ -43,6 +43,16 @@ class Config:
                 config = """{
                     \"url\": \"\",
                     \"database_online\": false,
+                    \"database_backend\": \"sqlite\",
+                    \"agent_timeout\": 900,
+                    \"clipboard_timeout\": 30,
+                    \"entry_cache_size\": 10000,
+                    \"connect_timeout\": 3.05,
+                    \"read_timeout\": 10,
+                    \"retries\": 2,
+                    \"failure_threshold\": 5,
+                    \"backup_interval\": 3600,
+                    \"table_order\": \"\",
                     \"vim_mode\": true
                 }"""
                 file.write(config)
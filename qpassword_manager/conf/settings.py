@@ -31,11 +31,15 @@ class Settings(QWidget):
 
         self.radiobutton_offline = QRadioButton("Offline database")
         self.layout_vbox.addWidget(self.radiobutton_offline)
+        self.radiobutton_log = QRadioButton("Offline append-only log")
+        self.layout_vbox.addWidget(self.radiobutton_log)
         self.radiobutton_online = QRadioButton("Online database")
         self.layout_vbox.addWidget(self.radiobutton_online)
 
         if self.config["database_online"]:
             self.radiobutton_online.setChecked(True)
+        elif self.config.get("database_backend") == "log":
+            self.radiobutton_log.setChecked(True)
         else:
             self.radiobutton_offline.setChecked(True)
 
@@ -66,6 +70,10 @@ class Settings(QWidget):
 
         self.config["url"] = self.url_le.text()
         self.config["database_online"] = self.radiobutton_online.isChecked()
+        if not self.config["database_online"]:
+            self.config["database_backend"] = (
+                "log" if self.radiobutton_log.isChecked() else "sqlite"
+            )
         Config.config_update(self.config)
         self.login_window.load_config()
         self.close()
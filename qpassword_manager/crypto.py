@@ -0,0 +1,144 @@
+"""Key derivation and encryption of passwords"""
+
+import base64
+import hashlib
+import hmac
+import os
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+SALT = b"sw\xea\x01\x9d\x109\x0eF\xef/\n\xb0mWK"
+
+# first byte of a ciphertext, Fernet tokens start with 0x80
+VERSION_FERNET = 0x80
+VERSION_AESGCM = 0x01
+
+NONCE_SIZE = 12
+
+
+def derive_key(master_key) -> bytes:
+    """
+    Creates key for Fernet using plain text master key
+
+    Parameters:
+        master_key (str): plain text master key
+    """
+
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=SALT,
+        iterations=10000,
+        backend=default_backend(),
+    )
+    return base64.urlsafe_b64encode(kdf.derive(master_key.encode()))
+
+
+def decode_token(token) -> bytes:
+    """
+    Returns the raw bytes of a ciphertext
+
+    Parameters:
+        token: raw ciphertext or its urlsafe base64 text form (which for
+            Fernet is the usual token), as str or bytes
+    """
+
+    if isinstance(token, bytes) and token[:1] in (
+        bytes([VERSION_FERNET]),
+        bytes([VERSION_AESGCM]),
+    ):
+        return token
+
+    return base64.urlsafe_b64decode(token)
+
+
+def encode_token(token) -> str:
+    """Returns the urlsafe base64 text form of a raw ciphertext, used
+    wherever ciphertexts have to be text (json, clipboard)"""
+
+    return base64.urlsafe_b64encode(decode_token(token)).decode()
+
+
+class VaultCipher:
+    """
+    Encrypts passwords with AES-GCM and decrypts both AES-GCM and Fernet
+    ciphertexts
+
+    A ciphertext is a version byte, a random 12 byte nonce and the
+    AES-GCM output with its 16 byte tag, stored as raw bytes. Fernet
+    tokens from before are recognized by their version byte.
+
+    Attributes:
+        key: vault key, the cipher is built from it again in other
+            processes
+        fernet: Fernet object for old ciphertexts
+    """
+
+    def __init__(self, key) -> None:
+        self.key = key
+        self.fernet = Fernet(key)
+        self._aead = AESGCM(self.subkey(key, b"qpassword_manager aes-gcm"))
+        self._fingerprint_key = self.subkey(
+            key, b"qpassword_manager fingerprint"
+        )
+
+    @staticmethod
+    def subkey(key, info) -> bytes:
+        """Returns a 32 byte key derived from key for the purpose in info"""
+
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=info,
+            backend=default_backend(),
+        ).derive(base64.urlsafe_b64decode(key))
+
+    def fingerprint(self, data) -> bytes:
+        """Returns HMAC-SHA256 of data keyed with a key derived from the
+        vault key, equal plain texts have equal fingerprints"""
+
+        return hmac.new(self._fingerprint_key, data, hashlib.sha256).digest()
+
+    def encrypt(self, data) -> bytes:
+        """Returns the raw ciphertext of data"""
+
+        nonce = os.urandom(NONCE_SIZE)
+        version = bytes([VERSION_AESGCM])
+        return version + nonce + self._aead.encrypt(nonce, data, version)
+
+    def decrypt(self, token) -> bytes:
+        """
+        Returns the plain text of a ciphertext in any of the forms accepted
+        by decode_token
+
+        Raises:
+            InvalidToken: if the ciphertext is corrupted or was encrypted
+                with another key
+        """
+
+        try:
+            token = decode_token(token)
+        except ValueError as error:
+            raise InvalidToken from error
+
+        if not token:
+            raise InvalidToken
+
+        if token[0] == VERSION_FERNET:
+            return self.fernet.decrypt(base64.urlsafe_b64encode(token))
+
+        if token[0] != VERSION_AESGCM or len(token) < 1 + NONCE_SIZE + 16:
+            raise InvalidToken
+
+        try:
+            return self._aead.decrypt(
+                token[1 : 1 + NONCE_SIZE], token[1 + NONCE_SIZE :], token[:1]
+            )
+        except InvalidTag as error:
+            raise InvalidToken from error
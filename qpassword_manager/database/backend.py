@@ -0,0 +1,189 @@
+"""Interface of the storage backends DatabaseHandler dispatches to"""
+
+
+class Backend:
+    """
+    Storage backend
+
+    Entries are (id, website, username, password) with the password as a
+    ciphertext, auth is the username and the hashed master key. Errors are
+    raised, DatabaseHandler reports them.
+
+    Attributes:
+        config: configuration in form of a dictionary
+    """
+
+    def __init__(self, config) -> None:
+        self.config = config
+
+    def remove_from_database(self, row_id, auth) -> None:
+        """Removes the entry with row_id"""
+
+        raise NotImplementedError
+
+    def get_entry(self, row_id, auth) -> list:
+        """Returns website, username and password of the entry with
+        row_id"""
+
+        raise NotImplementedError
+
+    def get_all(self, auth) -> list:
+        """Returns id, website, username and password of every entry"""
+
+        raise NotImplementedError
+
+    def stream_all(self, auth, batch_size, with_password):
+        """
+        Returns a generator that yields lists of at most batch_size
+        entries ordered by id
+
+        Parameters:
+            auth: username and hashed master key
+            batch_size (int): maximum number of entries in a batch
+            with_password (bool): if False the last value of every entry is
+                the length of the password or None instead of the
+                ciphertext
+        """
+
+        raise NotImplementedError
+
+    def get_page(self, auth, cursor, limit, with_password) -> (list, object):
+        """
+        Returns a page of entries ordered by id and the cursor of the next
+        page, which is None after the last page
+
+        Parameters:
+            auth: username and hashed master key
+            cursor: cursor returned with the previous page or None
+            limit (int): maximum number of entries in the page
+            with_password (bool): same as in stream_all
+        """
+
+        raise NotImplementedError
+
+    def search(self, query, auth, limit, offset) -> list:
+        """Returns id, website and username of at most limit entries whose
+        website or username contains query, case insensitive, ordered by
+        id, skipping the first offset. Backends that can search without
+        listing every entry override this."""
+
+        query = query.casefold()
+        data = []
+        stream = self.stream_all(auth, max(limit, 100), False)
+        try:
+            for batch in stream:
+                for entry_id, website, username, _ in batch:
+                    if (
+                        query not in website.casefold()
+                        and query not in username.casefold()
+                    ):
+                        continue
+                    if offset:
+                        offset -= 1
+                        continue
+
+                    data.append((entry_id, website, username))
+                    if len(data) == limit:
+                        return data
+        finally:
+            stream.close()
+
+        return data
+
+    def get_entry_ids(self, auth) -> list:
+        """Returns id value of every entry"""
+
+        raise NotImplementedError
+
+    def add_to_database(self, website, username, password, auth) -> None:
+        """Adds an entry"""
+
+        raise NotImplementedError
+
+    def add_entries(self, entries, auth) -> None:
+        """Adds entries (website, username, password), backends that can
+        write them at once override this"""
+
+        for website, username, password in entries:
+            self.add_to_database(website, username, password, auth)
+
+    def modification_order(  # pylint: disable=unused-argument
+        self, auth
+    ) -> dict:
+        """Returns a number by entry id that is higher for entries added or
+        updated later, empty if the backend doesn't keep track"""
+
+        return {}
+
+    def check_storage(self, auth) -> list:  # pylint: disable=unused-argument
+        """Returns the problems found in the files the vault is kept in,
+        nothing is checked where the storage can't be reached"""
+
+        return []
+
+    def update_entry(  # pylint: disable=too-many-arguments
+        self, row_id, website, username, password, auth
+    ) -> None:
+        """Replaces the values of the entry with row_id"""
+
+        raise NotImplementedError
+
+    def register(self, username, email, master_key) -> str:
+        """Adds a new user and returns the message shown to them"""
+
+        raise NotImplementedError
+
+    def check_credentials(self, username, master_key) -> bool:
+        """Returns True if user-password combination exists"""
+
+        raise NotImplementedError
+
+    def begin_rekey(self, auth, master_key) -> object:
+        """
+        Starts changing the master key or resumes a change to the same key
+        that was interrupted
+
+        Until finish_rekey the vault stays readable with the old key, new
+        ciphertexts are kept aside. An entry added or changed meanwhile has
+        to be re-encrypted again.
+
+        Parameters:
+            auth: username and hashed master key
+            master_key (str): new hashed master key
+
+        Returns:
+            get_page cursor before the first entry that isn't re-encrypted
+
+        Raises:
+            ValueError: if a change to another master key is in progress
+        """
+
+        raise NotImplementedError
+
+    def write_rekey(self, auth, entries) -> None:
+        """
+        Stores new ciphertexts aside in one transaction
+
+        Parameters:
+            auth: username and hashed master key
+            entries (list): (id, password, new password) of entries, where
+                password is the ciphertext new password was made from,
+                entries whose password changed since are skipped
+        """
+
+        raise NotImplementedError
+
+    def finish_rekey(self, auth) -> None:
+        """
+        Replaces every ciphertext and the master key at once
+
+        Raises:
+            ValueError: if some entries aren't re-encrypted
+        """
+
+        raise NotImplementedError
+
+    def abort_rekey(self, auth) -> None:
+        """Drops the new ciphertexts of an unfinished change"""
+
+        raise NotImplementedError
@@ -1,258 +1,353 @@
 """This class handles all http requests"""
 
-import os
-import sqlite3
-import requests
-from qpassword_manager.messagebox import MessageBox
+import functools
+from qpassword_manager.database.entry_cache import (
+    DEFAULT_MAX_BYTES,
+    DEFAULT_MAX_ENTRIES,
+    EntryCache,
+)
+from qpassword_manager.database.log_backend import LogBackend
+from qpassword_manager.database.online_backend import OnlineBackend
+from qpassword_manager.database.rekey import rekey
+from qpassword_manager.database.sync import SyncState, sync
+from qpassword_manager.database.sqlite_backend import SQLiteBackend
+from qpassword_manager.database.verify import verify
+
+# offline backends by the value of database_backend in config
+BACKENDS = {
+    "sqlite": SQLiteBackend,
+    "log": LogBackend,
+}
+
+
+def backend_name(config) -> str:
+    """Returns the name of the backend chosen by config"""
+
+    if config["database_online"]:
+        return "online"
+    return config.get("database_backend", "sqlite")
+
+
+def show_message(message) -> None:
+    """Shows message in a MessageBox, PyQt5 is only imported here so the
+    handler can be used without it"""
+
+    # pylint: disable=import-outside-toplevel
+    from qpassword_manager.messagebox import MessageBox
+
+    messagebox = MessageBox(message)
+    messagebox.show()
 
 
 def check_server(func):
-    """Wrapper that checks for exceptions"""
+    """Wrapper that checks for exceptions and reports them with the
+    handler's report function"""
 
-    def wrapper(*args):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
         try:
-            return func(*args)
+            return func(self, *args, **kwargs)
         except Exception as exception:  # pylint: disable=broad-except
-            messagebox = MessageBox(str(exception))
-            messagebox.show()
+            self.report(str(exception))
             return None
 
     return wrapper
 
 
 class DatabaseHandler:
-    """This class handles all http requests"""
-
-    def __init__(self, config) -> None:
+    """
+    This class handles all http requests
+
+    Every call is passed to the backend chosen by config, the online
+    server or one of BACKENDS offline. Entries read with their password
+    are kept in cache, so get_entry for an entry that was already read
+    doesn't reach the backend. Writes drop the entries they change.
+
+    Attributes:
+        config: configuration in form of a dictionary
+        backend: Backend object the calls are passed to
+        report: function called with the message of every error
+        cache: EntryCache of entries read from backend
+    """
+
+    def __init__(self, config, report=show_message) -> None:
+        self.report = report
+        self.backend = None
+        self.cache = EntryCache()
         self.config = config
 
-    @check_server
-    def remove_from_database(self, row_id, auth) -> None:
-        """Function for working with only one row in database"""
-
-        if self.config["database_online"]:
-            requests.post(
-                url=self.config["url"] + "/remove_from_database",
-                timeout=5,
-                json={"id": row_id},
-                auth=auth,
-            )
-            return
-
-        conn = sqlite3.connect(auth[0] + ".db")
-        cursor = conn.cursor()
-        cursor.execute(
-            f"""delete
-                from passwords
-                where (id = {row_id})"""
+    @property
+    def config(self) -> dict:
+        """Configuration, setting it chooses the backend"""
+
+        return self._config
+
+    @config.setter
+    def config(self, config) -> None:
+        self._config = config
+
+        if config["database_online"]:
+            backend = OnlineBackend
+        else:
+            backend = BACKENDS[config.get("database_backend", "sqlite")]
+
+        if not isinstance(self.backend, backend):
+            self.backend = backend(config)
+            self.cache.invalidate()
+        self.backend.config = config
+
+        self.cache.max_entries = config.get(
+            "entry_cache_size", DEFAULT_MAX_ENTRIES
         )
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return
+        self.cache.max_bytes = config.get(
+            "entry_cache_bytes", DEFAULT_MAX_BYTES
+        )
+
+    @check_server
+    def remove_from_database(self, row_id, auth) -> bool:
+        """Function for working with only one row in database, returns True
+        on success"""
+
+        self.backend.remove_from_database(row_id, auth)
+        self.cache.invalidate(auth[0], row_id)
+        return True
 
     @check_server
     def get_entry(self, row_id, auth) -> list:
-        """Function for working with only one row in database"""
-
-        if self.config["database_online"]:
-            return requests.post(
-                url=self.config["url"] + "/get_entry",
-                timeout=5,
-                json={"id": row_id},
-                auth=auth,
-            ).json()
-
-        conn = sqlite3.connect(auth[0] + ".db")
-        cursor = conn.cursor()
-        cursor.execute(
-            f"""select website, username, password
-               from passwords
-               where (id = {row_id})"""
-        )
-        data = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        """Function for working with only one row in database, answered
+        from cache if the entry is there"""
+
+        data = self.cache.get(auth[0], row_id)
+        if data is None:
+            data = self.backend.get_entry(row_id, auth)
+            if data:
+                self.cache.put(auth[0], [(row_id, *data)])
         return data
 
     @check_server
     def get_all(self, auth) -> list:
-        """Function for working with multiple rows in database"""
-
-        if self.config["database_online"]:
-            return requests.post(
-                url=self.config["url"] + "/get_all",
-                timeout=5,
-                auth=auth,
-            ).json()
-
-        conn = sqlite3.connect(auth[0] + ".db")
-        cursor = conn.cursor()
-        cursor.execute(
-            """select website, username, password
-               from passwords
-               where (id > 1)"""
-        )
-        data = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        """Returns id, website, username and password of every entry"""
+
+        data = self.backend.get_all(auth)
+        self.cache.put(auth[0], data)
         return data
 
+    def stream_all(self, auth, batch_size=100, with_password=True):
+        """
+        Returns a generator that yields lists of at most batch_size
+        entries (id, website, username, password) ordered by id, reading
+        them as they are needed
+
+        Online the entries are streamed from the server as they arrive.
+        Use next_batch to read batches.
+
+        Parameters:
+            auth: username and hashed master key
+            batch_size (int): maximum number of entries in a batch
+            with_password (bool): if False the last value of every entry is
+                the length of the password or None instead of the
+                ciphertext, older servers may still send the ciphertext
+        """
+
+        stream = self.backend.stream_all(auth, batch_size, with_password)
+        if not with_password:
+            return stream
+        return self.cached_stream(auth, stream)
+
+    def cached_stream(self, auth, stream):
+        """Passes batches of stream on, caching their entries"""
+
+        try:
+            for batch in stream:
+                self.cache.put(auth[0], batch)
+                yield batch
+        finally:
+            stream.close()
+
+    @check_server
+    def next_batch(self, stream) -> list:
+        """Returns the next batch from a stream_all generator or None when
+        there is nothing left"""
+
+        return next(stream, None)
+
+    @check_server
+    def get_page(
+        self, auth, cursor=None, limit=100, with_password=True
+    ) -> (list, object):
+        """
+        Returns a page of entries ordered by id and the cursor of the next
+        page, which is None after the last page
+
+        Parameters:
+            auth: username and hashed master key
+            cursor: cursor returned with the previous page or None
+            limit (int): maximum number of entries in the page
+            with_password (bool): if False the last value of every entry is
+                the length of the password or None instead of the
+                ciphertext, older servers may still send the ciphertext
+        """
+
+        page = self.backend.get_page(auth, cursor, limit, with_password)
+        if with_password:
+            self.cache.put(auth[0], page[0])
+        return page
+
+    @check_server
+    def search(self, query, auth, limit=100, offset=0) -> list:
+        """
+        Returns id, website and username of entries whose website or
+        username contains query, ordered by id
+
+        Parameters:
+            query (str): text to search for, case insensitive
+            auth: username and hashed master key
+            limit (int): maximum number of results
+            offset (int): number of results to skip
+        """
+
+        return self.backend.search(query, auth, limit, offset)
+
     @check_server
     def get_entry_ids(self, auth) -> list:
         """Returns id value of every password in table"""
 
-        if self.config["database_online"]:
-            return requests.post(
-                url=self.config["url"] + "/get_entry_ids",
-                timeout=5,
-                auth=auth,
-            ).json()
-
-        conn = sqlite3.connect(auth[0] + ".db")
-        cursor = conn.cursor()
-        cursor.execute(
-            """select id
-               from passwords
-               where (id > 1)"""
-        )
-        data = cursor.fetchall()
-        data = list(map(lambda x: x[0], data))
-        cursor.close()
-        conn.close()
-        return data
+        return self.backend.get_entry_ids(auth)
 
     @check_server
-    def add_to_database(self, website, username, password, auth) -> None:
-        """Function for adding a password to database"""
-
-        if self.config["database_online"]:
-            requests.post(
-                url=self.config["url"] + "/add_to_database",
-                timeout=5,
-                json={
-                    "website": website,
-                    "username": username,
-                    "password": password,
-                },
-                auth=auth,
-            )
-            return
-
-        conn = sqlite3.connect(auth[0] + ".db")
-        cursor = conn.cursor()
-        cursor.execute(
-            f"""insert into passwords
-               (website, username, password)
-               values
-               (\"{website}\",
-               \"{username}\",
-               \"{password}\")"""
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return
+    def modification_order(self, auth) -> dict:
+        """Returns a number by entry id that is higher for entries changed
+        later, empty if the backend doesn't keep track"""
+
+        return self.backend.modification_order(auth)
+
+    @check_server
+    def add_to_database(self, website, username, password, auth) -> bool:
+        """Function for adding a password to database, returns True on
+        success"""
+
+        self.backend.add_to_database(website, username, password, auth)
+        return True
 
     @check_server
     def update_entry(  # pylint: disable=too-many-arguments
         self, row_id, website, username, password, auth
-    ) -> None:
-        """Function for working with only one row in database"""
-
-        if self.config["database_online"]:
-            requests.post(
-                url=self.config["url"] + "/update_entry",
-                timeout=5,
-                json={
-                    "id": row_id,
-                    "website": website,
-                    "username": username,
-                    "password": password,
-                },
-                auth=auth,
-            )
-            return
-
-        conn = sqlite3.connect(auth[0] + ".db")
-        cursor = conn.cursor()
-        cursor.execute(
-            f"""update passwords
-                set website = \"{website}\", username = \"{username}\", password = \"{password}\"
-                where (id = {row_id})"""
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return
+    ) -> bool:
+        """Function for working with only one row in database, returns True
+        on success"""
+
+        self.backend.update_entry(row_id, website, username, password, auth)
+        self.cache.invalidate(auth[0], row_id)
+        return True
 
     @check_server
     def register(self, username, email, master_key) -> str:
         """Function for adding a new user to database"""
 
-        if self.config["database_online"]:
-            return requests.post(
-                url=self.config["url"] + "/register",
-                timeout=5,
-                json={
-                    "username": username,
-                    "email": email,
-                    "password": master_key,
-                },
-            ).text
-
-        if os.path.exists(username + ".db"):
-            return "Username already taken"
-
-        conn = sqlite3.connect(username + ".db")
-        cursor = conn.cursor()
-        cursor.execute(
-            """create table passwords
-               (id integer primary key autoincrement,
-               website varchar(50),
-               username varchar(50),
-               password varchar(64))"""
-        )
-        cursor.execute(
-            f"""insert into passwords
-                (website, username, password)
-                values
-                (\"Master\",
-                \"Key\",
-                \"{master_key}\")"""
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
-
-        return "Registration successfull!"
+        return self.backend.register(username, email, master_key)
 
     @check_server
     def check_credentials(self, username, master_key) -> bool:
         """Function that returns user id if user-password combination exists"""
 
-        if self.config["database_online"]:
-            if requests.post(
-                url=self.config["url"] + "/check_credentials",
-                timeout=5,
-                auth=(
-                    username,
-                    master_key,
-                ),
-            ).text:
-                return True
-
-        elif os.path.exists(username + ".db"):
-            conn = sqlite3.connect(username + ".db")
-            cursor = conn.cursor()
-            cursor.execute("select password from passwords where (id = 1)")
-            master_key_db = cursor.fetchone()[0]
-            cursor.close()
-            conn.close()
-
-            if master_key == master_key_db:
-                return True
-
-        messagebox = MessageBox("Wrong username or password!")
-        messagebox.show()
+        if self.backend.check_credentials(username, master_key):
+            return True
+
+        self.report("Wrong username or password!")
         return False
+
+    @check_server
+    def change_master_key(
+        self, auth, master_key, old_cipher, new_cipher
+    ) -> bool:
+        """Re-encrypts the vault with new_cipher and changes its hashed
+        master key, returns True if it's changed (see rekey.rekey)"""
+
+        try:
+            rekey(self.backend, auth, master_key, old_cipher, new_cipher)
+        finally:
+            self.cache.invalidate(auth[0])
+        return True
+
+    @check_server
+    def abort_rekey(self, auth) -> bool:
+        """Drops an unfinished master key change, returns True on success"""
+
+        self.backend.abort_rekey(auth)
+        return True
+
+    @check_server
+    def sync_with(  # pylint: disable=too-many-arguments
+        self, other, auth, cipher, direction="both", prefer=None
+    ) -> dict:
+        """
+        Merges the vault with the one of another DatabaseHandler, like the
+        server with the offline database (see sync.sync). The state of
+        the last sync of the two vaults is kept in a file, so entries
+        deleted in one of them are deleted in the other one.
+
+        A vault the user doesn't have yet is registered with the same
+        master key first.
+
+        Parameters:
+            other (DatabaseHandler): handler of the other vault, the user
+                has the same master key there
+            auth: username and hashed master key
+            cipher (VaultCipher): cipher of the user
+            direction (str): "push" only writes to other, "pull" only to
+                this vault, "both" to both
+            prefer (str): "local" or "remote" resolves conflicts with the
+                entry from this or the other vault
+
+        Returns:
+            dict: result of sync.sync, None if it failed
+        """
+
+        vaults = sorted(
+            [backend_name(handler.config), handler.config["url"]]
+            if handler.config["database_online"]
+            else [backend_name(handler.config), ""]
+            for handler in (self, other)
+        )
+        state = SyncState(
+            "_".join(["sync", *(name for name, _ in vaults), auth[0]]),
+            cipher,
+            vaults,
+        )
+        state.load()
+
+        for handler in (self, other):
+            if handler.backend.check_credentials(*auth):
+                continue
+            msg = handler.backend.register(auth[0], "", auth[1])
+            if msg == "Username already taken":
+                raise ValueError(
+                    f"Wrong master key for the {backend_name(handler.config)}"
+                    " vault"
+                )
+            if msg != "Registration successfull!":
+                raise ValueError(msg)
+
+        try:
+            result = sync(
+                self.backend,
+                other.backend,
+                auth,
+                cipher,
+                direction=direction,
+                prefer=prefer,
+                state=state,
+            )
+            state.save()
+            return result
+        finally:
+            self.cache.invalidate(auth[0])
+            other.cache.invalidate(auth[0])
+
+    @check_server
+    def verify(self, auth, cipher) -> dict:
+        """Checks the storage of the vault and that every password can be
+        decrypted, returns the result of verify.verify or None if it
+        failed"""
+
+        return verify(self.backend, auth, cipher)
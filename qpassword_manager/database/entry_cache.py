@@ -0,0 +1,146 @@
+"""Least recently used cache of entries read from the database"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+# limits used when config doesn't set entry_cache_size and entry_cache_bytes
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_BYTES = 4 << 20
+
+# rough per entry overhead of the dictionary, tuple and key
+ENTRY_OVERHEAD = 200
+
+
+class EntryCache:
+    """
+    Website, username and ciphertext of entries by username and entry id
+
+    Only ciphertexts are kept, so the cache holds nothing that isn't on
+    disk or on the server already. The least recently used entries are
+    dropped once there are more than max_entries or they take more than
+    max_bytes.
+
+    Only writes through the same DatabaseHandler drop the entries they
+    change, the cache isn't kept consistent with other processes. A
+    long-lived handler like the agent's has to be invalidated when
+    another process changes the vault.
+
+    Attributes:
+        max_entries: maximum number of cached entries
+        max_bytes: maximum estimated size of cached entries
+        size: estimated size of cached entries
+        hits: reads answered from the cache
+        misses: reads passed to the backend
+        evictions: entries dropped to stay within the limits
+        invalidations: entries dropped because they were changed
+    """
+
+    def __init__(
+        self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def entry_size(entry) -> int:
+        """Returns the estimated size of an entry in bytes"""
+
+        return ENTRY_OVERHEAD + sum(
+            len(value) for value in entry if value is not None
+        )
+
+    def get(self, username, entry_id) -> tuple:
+        """Returns website, username and password of an entry or None if
+        it isn't cached"""
+
+        with self._lock:
+            entry = self._entries.get((username, entry_id))
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end((username, entry_id))
+            return entry
+
+    def put(self, username, entries) -> None:
+        """
+        Caches entries of a user
+
+        Parameters:
+            username (str): owner of the entries
+            entries: (id, website, username, password) of every entry,
+                entries without a password aren't cached
+        """
+
+        if not self.max_entries:
+            return
+
+        with self._lock:
+            for entry_id, *entry in entries:
+                if entry[2] is None or isinstance(entry[2], int):
+                    continue
+
+                entry = tuple(entry)
+                old = self._entries.pop((username, entry_id), None)
+                if old is not None:
+                    self.size -= self.entry_size(old)
+                self._entries[username, entry_id] = entry
+                self.size += self.entry_size(entry)
+
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or self.size > self.max_bytes
+            ):
+                _, old = self._entries.popitem(last=False)
+                self.size -= self.entry_size(old)
+                self.evictions += 1
+
+    def invalidate(self, username=None, entry_id=None) -> None:
+        """
+        Drops an entry, every entry of a user or the whole cache
+
+        Parameters:
+            username (str): owner of the entries, None for everyone
+            entry_id (int): entry to drop, None for all entries of the user
+        """
+
+        with self._lock:
+            if entry_id is not None:
+                keys = [(username, entry_id)]
+            elif username is not None:
+                keys = [key for key in self._entries if key[0] == username]
+            else:
+                keys = list(self._entries)
+
+            for key in keys:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self.size -= self.entry_size(old)
+                    self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Returns the metrics of the cache"""
+
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def log_stats(self) -> None:
+        """Logs the metrics at debug level"""
+
+        logging.debug("entry cache: %s", self.stats())
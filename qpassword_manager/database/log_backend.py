@@ -0,0 +1,848 @@
+"""Backend that keeps the vault in a memory-mapped append-only record log"""
+
+import bisect
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from qpassword_manager import filelock
+from qpassword_manager.crypto import decode_token
+from qpassword_manager.database.backend import Backend
+
+MAGIC = b"QPMLOG\x00\x01"
+
+# record: op, entry id, payload length, payload, crc32 of everything before
+RECORD_HEADER = struct.Struct("<BqI")
+RECORD_CRC = struct.Struct("<I")
+# put payload: lengths of website, username and password, then the values
+FIELDS = struct.Struct("<HHI")
+
+OP_PUT = 1
+OP_DELETE = 2
+OP_META = 3
+
+# bytes a record can start with, where a corrupt record is skipped to
+RECORD_START = re.compile(b"[%c-%c]" % (OP_PUT, OP_META))
+
+# a log is compacted once it holds more dead bytes than this and than live
+# bytes
+COMPACT_MIN_DEAD = 1 << 20
+
+FINGERPRINT_SIZE = 16
+
+
+def encode_record(op, entry_id, payload) -> bytes:
+    """Returns a record as it is written to the log"""
+
+    header = RECORD_HEADER.pack(op, entry_id, len(payload))
+    return header + payload + RECORD_CRC.pack(zlib.crc32(header + payload))
+
+
+def read_record(view, offset, end) -> (int, int, int):
+    """Returns op, entry id and size of the record at offset, None if
+    there is no complete record with a valid crc before end"""
+
+    if offset + RECORD_HEADER.size > end:
+        return None
+
+    op, entry_id, length = RECORD_HEADER.unpack_from(view, offset)
+    record_end = offset + RECORD_HEADER.size + length + RECORD_CRC.size
+    if op not in (OP_PUT, OP_DELETE, OP_META) or record_end > end:
+        return None
+
+    crc = RECORD_CRC.unpack_from(view, record_end - RECORD_CRC.size)[0]
+    if zlib.crc32(view[offset : record_end - RECORD_CRC.size]) != crc:
+        return None
+
+    return op, entry_id, record_end - offset
+
+
+def iter_records(view, offset, end):
+    """Yields op, entry id, offset and size of the complete records between
+    offset and end, stopping at the first torn or corrupt one"""
+
+    while (record := read_record(view, offset, end)) is not None:
+        op, entry_id, size = record
+        yield op, entry_id, offset, size
+        offset += size
+
+
+def next_record(view, offset, end) -> int:
+    """Returns the offset of the first valid record after the corrupt one
+    at offset, None if there is none and offset is a torn end"""
+
+    for match in RECORD_START.finditer(view, offset + 1, end):
+        if read_record(view, match.start(), end) is not None:
+            return match.start()
+    return None
+
+
+def check_log(path) -> list:
+    """
+    Reads a log without changing it and returns the problems found
+
+    Every record is read, a corrupt record is reported with the entry id
+    in its header if it's readable and the next valid record is read on,
+    a torn record at the end is reported as well
+
+    Parameters:
+        path (str): path of the log file
+    """
+
+    with open(path, "rb") as file:
+        filelock.lock(file, shared=True)
+        try:
+            data = file.read()
+        finally:
+            filelock.unlock(file)
+
+    if data[: len(MAGIC)] != MAGIC:
+        return [f"{path} is not a vault log"]
+
+    problems = []
+    offset = len(MAGIC)
+    while offset < len(data):
+        for _, _, start, size in iter_records(data, offset, len(data)):
+            offset = start + size
+        if offset == len(data):
+            break
+
+        skip_to = next_record(data, offset, len(data))
+        if skip_to is None:
+            problems.append(
+                f"{path}: {len(data) - offset} bytes at {offset} are a torn "
+                "record"
+            )
+            break
+
+        header = ""
+        if offset + RECORD_HEADER.size <= skip_to:
+            op, entry_id, _ = RECORD_HEADER.unpack_from(data, offset)
+            if op in (OP_PUT, OP_DELETE):
+                header = f" (entry {entry_id})"
+        problems.append(
+            f"{path}: record at {offset}{header} is corrupted, "
+            f"{skip_to - offset} bytes skipped"
+        )
+        offset = skip_to
+
+    return problems
+
+
+def fingerprint(password) -> bytes:
+    """Returns the digest a re-encrypted password is stored with to tell
+    whether the password it was made from is still current"""
+
+    return hashlib.blake2b(password, digest_size=FINGERPRINT_SIZE).digest()
+
+
+def read_rekey(path) -> (str, dict, int):
+    """
+    Reads the file new ciphertexts are written to while the master key is
+    changed, MAGIC followed by a meta record with the new master key hash
+    and a put record per entry holding the fingerprint of the old password
+    and the new password
+
+    Returns:
+        new master key hash, fingerprint and new password by entry id and
+        the offset after the last complete record
+    """
+
+    with open(path, "rb") as file:
+        data = file.read()
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a vault log")
+
+    master_key = None
+    passwords = {}
+    end = len(MAGIC)
+    for op, entry_id, offset, size in iter_records(data, end, len(data)):
+        payload = data[
+            offset + RECORD_HEADER.size : offset + size - RECORD_CRC.size
+        ]
+        if op == OP_META:
+            master_key = payload.decode()
+        else:
+            passwords[entry_id] = (
+                payload[:FINGERPRINT_SIZE],
+                payload[FINGERPRINT_SIZE:],
+            )
+        end = offset + size
+
+    return master_key, passwords, end
+
+
+def encode_entry(website, username, password) -> bytes:
+    """Returns the payload of a put record"""
+
+    website = website.encode()
+    username = username.encode()
+    return (
+        FIELDS.pack(len(website), len(username), len(password))
+        + website
+        + username
+        + password
+    )
+
+
+class VaultLog:
+    """
+    One vault file
+
+    The file is MAGIC followed by records. A put record holds the whole
+    entry, a delete record only the id and the meta record the master key
+    hash, the last record of an id wins. Opening the file maps it and
+    scans the records once to build the index, a torn record at the end
+    left by a crash is cut off. A corrupt record followed by valid ones is
+    skipped and kept in the file, check_log reports it. Records appended
+    by other processes are picked up by refresh, which is called before
+    every operation.
+
+    Dead records are dropped by compact, which rewrites the live records
+    to a new file in a background thread and renames it over the log. A
+    log with corrupt records isn't compacted, so they stay for check_log.
+
+    Attributes:
+        path: path of the log file
+        index: entry id to (offset, size) of its put record
+        ids: sorted entry ids
+        next_id: id given to the next added entry
+        master_key: master key hash from the meta record
+        corrupt: (offset, size) of the corrupt records that were skipped
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.lock = threading.RLock()
+        self.compacting = None
+        self._file = None
+        self._map = None
+        self._inode = None
+        self.size = 0
+        self.dead = 0
+        self.index = {}
+        self.ids = []
+        self.next_id = 1
+        self.master_key = None
+        self.corrupt = []
+        self._meta = None
+
+        self.open(repair=True)
+
+    @staticmethod
+    def create(path, master_key) -> None:
+        """Creates a new log file holding only the master key hash"""
+
+        with open(path, "xb") as file:
+            file.write(MAGIC + encode_record(OP_META, 0, master_key.encode()))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def open(self, repair=False) -> None:
+        """Maps the file and builds the index, repair cuts off a torn record
+        at the end"""
+
+        self.close()
+        try:
+            descriptor = os.open(
+                self.path,
+                os.O_RDWR | os.O_APPEND | getattr(os, "O_BINARY", 0),
+            )
+        except FileNotFoundError as exception:
+            raise ValueError(f"There is no vault at {self.path}") from exception
+        self._file = os.fdopen(descriptor, "ab+")
+        stat = os.fstat(self._file.fileno())
+        self._inode = stat.st_ino
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not a vault log")
+
+        self.size = len(MAGIC)
+        self.dead = 0
+        self.index = {}
+        self.ids = []
+        self.next_id = 1
+        self.master_key = None
+        self.corrupt = []
+        self._meta = None
+
+        if self.scan(stat.st_size) < stat.st_size and repair:
+            filelock.lock(self._file)
+            try:
+                # another process may have finished the record meanwhile
+                file_size = os.fstat(self._file.fileno()).st_size
+                if self.scan(file_size) < file_size:
+                    logging.warning(
+                        "%s: dropping %d bytes of torn record",
+                        self.path,
+                        file_size - self.size,
+                    )
+                    self._map.close()
+                    self._file.truncate(self.size)
+                    self._map = mmap.mmap(
+                        self._file.fileno(), 0, access=mmap.ACCESS_READ
+                    )
+            finally:
+                filelock.unlock(self._file)
+
+    def close(self) -> None:
+        """Unmaps and closes the file"""
+
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def scan(self, file_size) -> int:
+        """Applies the records between self.size and file_size to the index,
+        skipping corrupt ones, and returns the offset after the last
+        complete record"""
+
+        if len(self._map) < file_size:
+            self._map.close()
+            self._map = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+        while True:
+            for op, entry_id, offset, size in iter_records(
+                self._map, self.size, file_size
+            ):
+                self.apply(op, entry_id, offset, size)
+                self.size = offset + size
+
+            if self.size == file_size:
+                return self.size
+            skip_to = next_record(self._map, self.size, file_size)
+            if skip_to is None:
+                return self.size
+
+            logging.warning(
+                "%s: skipping corrupt record at %d", self.path, self.size
+            )
+            self.corrupt.append((self.size, skip_to - self.size))
+            self.dead += skip_to - self.size
+            self.size = skip_to
+
+    def apply(self, op, entry_id, offset, size) -> None:
+        """Applies one record to the index"""
+
+        if op == OP_META:
+            if self._meta is not None:
+                self.dead += self._meta[1]
+            self._meta = (offset, size)
+            start = offset + RECORD_HEADER.size
+            self.master_key = self._map[
+                start : start + size - RECORD_HEADER.size - RECORD_CRC.size
+            ].decode()
+            return
+
+        self.next_id = max(self.next_id, entry_id + 1)
+        old = self.index.pop(entry_id, None)
+        if old is not None:
+            self.dead += old[1]
+        elif op == OP_PUT:
+            if self.ids and entry_id < self.ids[-1]:
+                bisect.insort(self.ids, entry_id)
+            else:
+                self.ids.append(entry_id)
+
+        if op == OP_PUT:
+            self.index[entry_id] = (offset, size)
+        else:
+            self.dead += size
+            if old is not None:
+                del self.ids[bisect.bisect_left(self.ids, entry_id)]
+
+    def refresh(self) -> None:
+        """Picks up records appended by other processes and a log replaced
+        by compaction"""
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+
+        if stat.st_ino != self._inode:
+            self.open()
+        elif stat.st_size > self.size:
+            self.scan(stat.st_size)
+
+    def refresh_locked(self) -> None:
+        """refresh for callers that don't hold the file lock, a shared lock
+        is held so no process appends or compacts meanwhile"""
+
+        while True:
+            filelock.lock(self._file, shared=True)
+            try:
+                try:
+                    stat = os.stat(self.path)
+                except FileNotFoundError:
+                    return
+                if stat.st_ino == self._inode:
+                    self.refresh()
+                    return
+            finally:
+                if self._file is not None:
+                    filelock.unlock(self._file)
+
+            # replaced by compaction, the new file is locked next
+            self.open()
+
+    def written_order(self) -> list:
+        """Returns the ids of live entries in the order their records were
+        written, rewrites keep it so offsets order entries by when they
+        were last changed"""
+
+        return sorted(self.ids, key=lambda entry_id: self.index[entry_id][0])
+
+    def entry(self, entry_id, with_password=True) -> tuple:
+        """Returns website, username and password of an entry"""
+
+        offset = self.index[entry_id][0] + RECORD_HEADER.size
+        website_len, username_len, password_len = FIELDS.unpack_from(
+            self._map, offset
+        )
+        offset += FIELDS.size
+        website = self._map[offset : offset + website_len].decode()
+        offset += website_len
+        username = self._map[offset : offset + username_len].decode()
+        offset += username_len
+        password = (
+            self._map[offset : offset + password_len] if with_password else None
+        )
+        return website, username, password
+
+    def append(self, op, entry_id, payload) -> int:
+        """Appends a record and returns its entry id, entry_id None takes
+        the next free one"""
+
+        return self.append_all([(op, entry_id, payload)])[0]
+
+    def append_all(self, records) -> list:
+        """
+        Appends records (op, entry id, payload) with one write and returns
+        their entry ids
+
+        The file is locked while the records are written so processes
+        sharing the vault don't hand out the same id, entry id None takes
+        the next free one
+        """
+
+        while True:
+            filelock.lock(self._file)
+            try:
+                if os.stat(self.path).st_ino == self._inode:
+                    self.refresh()
+                    next_id = self.next_id
+                    entry_ids = []
+                    data = []
+                    for op, entry_id, payload in records:
+                        if entry_id is None:
+                            entry_id = next_id
+                            next_id += 1
+                        entry_ids.append(entry_id)
+                        data.append(encode_record(op, entry_id, payload))
+
+                    data = b"".join(data)
+                    offset = self.size
+                    self._file.write(data)
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    self.scan(offset + len(data))
+                    break
+            finally:
+                if self._file is not None:
+                    filelock.unlock(self._file)
+
+            self.open()
+
+        if (
+            self.dead > COMPACT_MIN_DEAD
+            and self.dead > self.size - self.dead
+            and self.compacting is None
+            and not self.corrupt
+        ):
+            self.compacting = threading.Thread(target=self.compact, daemon=True)
+            self.compacting.start()
+
+        return entry_ids
+
+    def tombstone(self) -> bytes:
+        """Returns a delete record for the last id handed out if its entry
+        is deleted, which keeps the id from being given out again once the
+        dead records are dropped"""
+
+        last_id = self.next_id - 1
+        if last_id in self.index or not last_id:
+            return b""
+        return encode_record(OP_DELETE, last_id, b"")
+
+    def rewrite(self, master_key, new_password) -> None:
+        """
+        Replaces the log by one with another master key hash and new
+        ciphertexts, the file is locked while it's written so no entry
+        changes meanwhile
+
+        Parameters:
+            master_key (str): new master key hash
+            new_password (callable): takes entry id and password and
+                returns the new password, None if there is none
+
+        Raises:
+            ValueError: if an entry has no new password
+        """
+
+        path = self.path + ".new"
+        while True:
+            filelock.lock(self._file)
+            try:
+                if os.stat(self.path).st_ino == self._inode:
+                    self.refresh()
+                    with open(path, "wb") as file:
+                        file.write(
+                            MAGIC
+                            + encode_record(OP_META, 0, master_key.encode())
+                        )
+                        for entry_id in self.written_order():
+                            website, username, password = self.entry(entry_id)
+                            password = new_password(entry_id, password)
+                            if password is None:
+                                raise ValueError(
+                                    "Some entries aren't re-encrypted"
+                                )
+                            file.write(
+                                encode_record(
+                                    OP_PUT,
+                                    entry_id,
+                                    encode_entry(website, username, password),
+                                )
+                            )
+                        file.write(self.tombstone())
+                        file.flush()
+                        os.fsync(file.fileno())
+
+                    os.replace(path, self.path)
+                    break
+            finally:
+                if os.path.exists(path):
+                    os.remove(path)
+                filelock.unlock(self._file)
+
+            self.open()
+
+        self.open()
+
+    def compact(self) -> None:
+        """
+        Rewrites the log without dead records
+
+        Live records are copied from a snapshot of the index without
+        holding the lock, records appended meanwhile are copied after them
+        while the file is locked, then the new file replaces the log
+        """
+
+        # other processes may be compacting the same log at once
+        path = f"{self.path}.compact.{os.getpid()}"
+        try:
+            with self.lock:
+                records = [
+                    self.index[entry_id] for entry_id in self.written_order()
+                ]
+                if self._meta is not None:
+                    records.insert(0, self._meta)
+                tombstone = self.tombstone()
+                end = self.size
+                source = os.dup(self._file.fileno())
+
+            try:
+                with open(path, "wb") as file:
+                    file.write(MAGIC)
+                    for offset, size in records:
+                        file.write(os.pread(source, size, offset))
+                    file.write(tombstone)
+
+                    with self.lock:
+                        filelock.lock(self._file)
+                        try:
+                            if (
+                                os.stat(self.path).st_ino
+                                != os.fstat(source).st_ino
+                            ):
+                                # compacted by another process
+                                return
+
+                            self.refresh()
+                            file.write(os.pread(source, self.size - end, end))
+                            file.flush()
+                            os.fsync(file.fileno())
+                            os.replace(path, self.path)
+                        finally:
+                            filelock.unlock(self._file)
+
+                        before = self.size
+                        self.open()
+                        logging.debug(
+                            "compacted %s from %d to %d bytes",
+                            self.path,
+                            before,
+                            self.size,
+                        )
+            finally:
+                os.close(source)
+                if os.path.exists(path):
+                    os.remove(path)
+
+        except OSError as error:
+            logging.warning("compacting %s failed: %s", self.path, error)
+
+        finally:
+            self.compacting = None
+
+
+class LogBackend(Backend):
+    """
+    Backend that keeps every user's vault in <username>.log
+
+    Attributes:
+        vaults: open VaultLog objects by path
+    """
+
+    def __init__(self, config) -> None:
+        super().__init__(config)
+        self.vaults = {}
+
+    def vault(self, username) -> VaultLog:
+        """Returns the open log of a user, opening it if needed"""
+
+        path = os.path.abspath(username + ".log")
+        if path not in self.vaults:
+            self.vaults[path] = VaultLog(path)
+
+        vault = self.vaults[path]
+        with vault.lock:
+            vault.refresh_locked()
+        return vault
+
+    def remove_from_database(self, row_id, auth) -> None:
+        vault = self.vault(auth[0])
+        with vault.lock:
+            if row_id in vault.index:
+                vault.append(OP_DELETE, row_id, b"")
+
+    def get_entry(self, row_id, auth) -> list:
+        vault = self.vault(auth[0])
+        with vault.lock:
+            if row_id not in vault.index:
+                return None
+            return vault.entry(row_id)
+
+    def get_all(self, auth) -> list:
+        vault = self.vault(auth[0])
+        with vault.lock:
+            return [
+                (entry_id, *vault.entry(entry_id)) for entry_id in vault.ids
+            ]
+
+    def stream_all(self, auth, batch_size, with_password):
+        cursor = None
+        while True:
+            batch, cursor = self.get_page(
+                auth, cursor, batch_size, with_password
+            )
+            if batch:
+                yield batch
+            if cursor is None:
+                return
+
+    def get_page(self, auth, cursor, limit, with_password) -> (list, object):
+        """The cursor is the last id of the previous page"""
+
+        vault = self.vault(auth[0])
+        with vault.lock:
+            start = bisect.bisect_right(vault.ids, cursor or 0)
+            data = [
+                (entry_id, *vault.entry(entry_id, with_password))
+                for entry_id in vault.ids[start : start + limit]
+            ]
+
+        return data, data[-1][0] if len(data) == limit else None
+
+    def search(self, query, auth, limit, offset) -> list:
+        """Scans every entry, matching case insensitively"""
+
+        query = query.casefold()
+        vault = self.vault(auth[0])
+        data = []
+        with vault.lock:
+            for entry_id in vault.ids:
+                website, username, _ = vault.entry(entry_id, False)
+                if query in website.casefold() or query in username.casefold():
+                    if offset:
+                        offset -= 1
+                        continue
+
+                    data.append((entry_id, website, username))
+                    if len(data) == limit:
+                        break
+
+        return data
+
+    def get_entry_ids(self, auth) -> list:
+        vault = self.vault(auth[0])
+        with vault.lock:
+            return list(vault.ids)
+
+    def add_to_database(self, website, username, password, auth) -> None:
+        vault = self.vault(auth[0])
+        with vault.lock:
+            vault.append(
+                OP_PUT,
+                None,
+                encode_entry(website, username, decode_token(password)),
+            )
+
+    def add_entries(self, entries, auth) -> None:
+        """All entries are appended with one write"""
+
+        vault = self.vault(auth[0])
+        with vault.lock:
+            vault.append_all(
+                [
+                    (
+                        OP_PUT,
+                        None,
+                        encode_entry(website, username, decode_token(password)),
+                    )
+                    for website, username, password in entries
+                ]
+            )
+
+    def modification_order(self, auth) -> dict:
+        """Later records are at higher offsets"""
+
+        vault = self.vault(auth[0])
+        with vault.lock:
+            return {
+                entry_id: offset
+                for entry_id, (offset, _) in vault.index.items()
+            }
+
+    def check_storage(self, auth) -> list:
+        """The file is read again without opening the vault, which would
+        cut off a torn record"""
+
+        return check_log(os.path.abspath(auth[0] + ".log"))
+
+    def update_entry(  # pylint: disable=too-many-arguments
+        self, row_id, website, username, password, auth
+    ) -> None:
+        vault = self.vault(auth[0])
+        with vault.lock:
+            if row_id in vault.index:
+                vault.append(
+                    OP_PUT,
+                    row_id,
+                    encode_entry(website, username, decode_token(password)),
+                )
+
+    def register(self, username, email, master_key) -> str:
+        try:
+            VaultLog.create(username + ".log", master_key)
+        except FileExistsError:
+            return "Username already taken"
+
+        return "Registration successfull!"
+
+    def check_credentials(self, username, master_key) -> bool:
+        if not os.path.exists(username + ".log"):
+            return False
+
+        return self.vault(username).master_key == master_key
+
+    def begin_rekey(self, auth, master_key) -> object:
+        """New ciphertexts are appended to <username>.log.rekey"""
+
+        vault = self.vault(auth[0])
+        path = vault.path + ".rekey"
+        with vault.lock:
+            try:
+                pending, passwords, end = read_rekey(path)
+            except FileNotFoundError:
+                pending = None
+
+            if pending == vault.master_key:
+                # left behind by a change that was finished
+                os.remove(path)
+                pending = None
+
+            if pending is None:
+                VaultLog.create(path, master_key)
+                return None
+
+            if pending != master_key:
+                raise ValueError("Another master key change is in progress")
+
+            os.truncate(path, end)
+            previous = None
+            for entry_id in vault.ids:
+                old = fingerprint(vault.entry(entry_id)[2])
+                if passwords.get(entry_id, (None,))[0] != old:
+                    return previous
+                previous = entry_id
+            return previous
+
+    def write_rekey(self, auth, entries) -> None:
+        vault = self.vault(auth[0])
+        path = vault.path + ".rekey"
+        if not os.path.exists(path):
+            raise ValueError("No master key change in progress")
+
+        with vault.lock:
+            records = []
+            for entry_id, password, password_next in entries:
+                password = decode_token(password)
+                if (
+                    entry_id in vault.index
+                    and vault.entry(entry_id)[2] == password
+                ):
+                    records.append(
+                        encode_record(
+                            OP_PUT,
+                            entry_id,
+                            fingerprint(password) + decode_token(password_next),
+                        )
+                    )
+
+            with open(path, "ab") as file:
+                file.write(b"".join(records))
+                file.flush()
+                os.fsync(file.fileno())
+
+    def finish_rekey(self, auth) -> None:
+        vault = self.vault(auth[0])
+        path = vault.path + ".rekey"
+        with vault.lock:
+            try:
+                master_key, passwords, _ = read_rekey(path)
+            except FileNotFoundError as error:
+                raise ValueError("No master key change in progress") from error
+
+            def new_password(entry_id, password):
+                old, new = passwords.get(entry_id, (None, None))
+                return new if old == fingerprint(password) else None
+
+            vault.rewrite(master_key, new_password)
+            os.remove(path)
+
+    def abort_rekey(self, auth) -> None:
+        vault = self.vault(auth[0])
+        with vault.lock:
+            if os.path.exists(vault.path + ".rekey"):
+                os.remove(vault.path + ".rekey")
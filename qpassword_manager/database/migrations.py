@@ -0,0 +1,215 @@
+"""Versioned schema of offline databases and migrations between versions"""
+
+import logging
+import sqlite3
+
+
+def create_search_index(cursor) -> None:
+    """
+    Creates the full text search index over website and username and the
+    triggers that keep it in sync with the passwords table
+
+    The trigram tokenizer allows substring matches, older sqlite versions
+    fall back to the default tokenizer which only matches whole words
+    """
+
+    try:
+        cursor.execute(
+            """create virtual table if not exists passwords_search
+               using fts5(website, username, content='passwords',
+               content_rowid='id', tokenize='trigram')"""
+        )
+    except sqlite3.OperationalError:
+        cursor.execute(
+            """create virtual table if not exists passwords_search
+               using fts5(website, username, content='passwords',
+               content_rowid='id')"""
+        )
+
+    cursor.execute(
+        """create trigger if not exists passwords_search_insert
+           after insert on passwords begin
+               insert into passwords_search (rowid, website, username)
+               values (new.id, new.website, new.username);
+           end"""
+    )
+    cursor.execute(
+        """create trigger if not exists passwords_search_delete
+           after delete on passwords begin
+               insert into passwords_search
+               (passwords_search, rowid, website, username)
+               values ('delete', old.id, old.website, old.username);
+           end"""
+    )
+    cursor.execute(
+        """create trigger if not exists passwords_search_update
+           after update of website, username on passwords begin
+               insert into passwords_search
+               (passwords_search, rowid, website, username)
+               values ('delete', old.id, old.website, old.username);
+               insert into passwords_search (rowid, website, username)
+               values (new.id, new.website, new.username);
+           end"""
+    )
+
+
+def create_tables(cursor) -> None:
+    """Creates the passwords table the way it was before schema versions"""
+
+    cursor.execute(
+        """create table if not exists passwords
+           (id integer primary key autoincrement,
+           website varchar(50),
+           username varchar(50),
+           password blob)"""
+    )
+
+
+def move_master_key(cursor) -> None:
+    """Moves the master key hash from the first row of passwords to the
+    metadata table"""
+
+    cursor.execute(
+        """create table metadata
+           (key text primary key,
+           value)"""
+    )
+    cursor.execute(
+        """insert into metadata (key, value)
+           select 'master_key', password
+           from passwords
+           where (id = 1)"""
+    )
+    cursor.execute("delete from passwords where (id = 1)")
+
+
+def add_search_index(cursor) -> None:
+    """Adds the full text search index, replacing one created before it
+    was part of the schema"""
+
+    cursor.execute("drop table if exists passwords_search")
+    for trigger in ("insert", "delete", "update"):
+        cursor.execute(f"drop trigger if exists passwords_search_{trigger}")
+
+    create_search_index(cursor)
+    cursor.execute(
+        """insert into passwords_search (passwords_search)
+           values ('rebuild')"""
+    )
+
+
+def add_indexes(cursor) -> None:
+    """Adds indexes on website and username"""
+
+    cursor.execute(
+        "create index if not exists passwords_website on passwords (website)"
+    )
+    cursor.execute(
+        "create index if not exists passwords_username on passwords (username)"
+    )
+
+
+def add_rekey_column(cursor) -> None:
+    """Adds the column ciphertexts are written to while the master key is
+    changed, the search index is only updated when website or username
+    change so re-encrypting doesn't touch it"""
+
+    cursor.execute("alter table passwords add column password_next blob")
+    cursor.execute("drop trigger if exists passwords_search_update")
+    create_search_index(cursor)
+
+
+def add_modified_column(cursor) -> None:
+    """Adds the column that orders entries by when they were last added or
+    updated, entries from before get their id"""
+
+    cursor.execute("alter table passwords add column modified integer")
+    cursor.execute("update passwords set modified = id")
+    cursor.execute(
+        "create index if not exists passwords_modified on passwords (modified)"
+    )
+
+
+# MIGRATIONS[i] upgrades a database from version i to version i + 1
+MIGRATIONS = [
+    move_master_key,
+    add_search_index,
+    add_indexes,
+    add_rekey_column,
+    add_modified_column,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(cursor) -> int:
+    """Returns schema version of a database, 0 if it has none"""
+
+    cursor.execute(
+        """select count(*)
+           from sqlite_master
+           where (type = 'table' and name = 'schema_version')"""
+    )
+    if not cursor.fetchone()[0]:
+        return 0
+
+    cursor.execute("select version from schema_version")
+    return cursor.fetchone()[0]
+
+
+def migrate(path, backup=True) -> None:
+    """
+    Upgrades the database in path to SCHEMA_VERSION
+
+    All migrations run in one transaction, so a failed migration leaves
+    the database as it was, and a process migrating the database at the
+    same time waits for it and finds it upgraded. The database is copied
+    to <path>.v<version>.bak before it's changed and switched to WAL mode
+    afterwards.
+
+    Parameters:
+        path (str): database file
+        backup (bool): copy the database before upgrading it
+    """
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    cursor = conn.cursor()
+
+    try:
+        version = schema_version(cursor)
+        if version >= SCHEMA_VERSION:
+            return
+
+        if backup:
+            with sqlite3.connect(f"{path}.v{version}.bak") as backup_conn:
+                conn.backup(backup_conn)
+            backup_conn.close()
+
+        cursor.execute("begin immediate")
+        try:
+            # another process may have migrated since the version was read
+            version = schema_version(cursor)
+            if version >= SCHEMA_VERSION:
+                cursor.execute("rollback")
+                return
+
+            logging.debug("migrating %s from %d", path, version)
+            for migration in MIGRATIONS[version:]:
+                migration(cursor)
+
+            cursor.execute("drop table if exists schema_version")
+            cursor.execute("create table schema_version (version integer)")
+            cursor.execute(
+                "insert into schema_version (version) values (?)",
+                (SCHEMA_VERSION,),
+            )
+            cursor.execute("commit")
+        except Exception:
+            cursor.execute("rollback")
+            raise
+
+        cursor.execute("pragma journal_mode = wal")
+
+    finally:
+        cursor.close()
+        conn.close()
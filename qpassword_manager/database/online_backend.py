@@ -0,0 +1,467 @@
+"""Backend that keeps the vault on the server"""
+
+import base64
+import json
+import time
+import requests
+from urllib3.util import make_headers
+from qpassword_manager.crypto import encode_token
+from qpassword_manager.database.backend import Backend
+from qpassword_manager.database.transport import (
+    CONNECT_TIMEOUT,
+    FAILURE_THRESHOLD,
+    READ_TIMEOUT,
+    RETRIES,
+    CircuitBreaker,
+    send,
+)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class OnlineBackend(Backend):  # pylint: disable=too-many-public-methods
+    """
+    Backend that sends every call to the server as a http request
+
+    Attributes:
+        headers: headers sent with every request
+        breaker: CircuitBreaker of the server
+        search_cursors: cursors of the last search query by offset
+        has_search: False once the server answered /search with 404
+        sessions: session token and its expiry time by auth, the token is
+            None for servers that only take basic auth
+    """
+
+    # seconds before expiry at which a session token is refreshed
+    SESSION_MARGIN = 30
+
+    def __init__(self, config) -> None:
+        super().__init__(config)
+        self.search_cursors = {}
+        self.has_search = True
+        self.breaker = self.new_breaker()
+        self.sessions = {}
+
+        self.headers = {
+            "Accept": "application/json",
+            # lists zstd and br as well when urllib3 can decode them
+            "Accept-Encoding": make_headers(accept_encoding=True)[
+                "accept-encoding"
+            ],
+        }
+        if msgpack:
+            self.headers[
+                "Accept"
+            ] = "application/msgpack, application/json;q=0.5"
+
+    def post(self, endpoint, idempotent=False, **kwargs) -> requests.Response:
+        """
+        Sends a POST request to endpoint on the server
+
+        The server may answer in MessagePack instead of json and compress
+        large responses with gzip or zstd, servers that ignore the Accept
+        headers keep answering in json. Requests go through transport.send,
+        so they fail fast while the server is down.
+
+        auth is sent as the session token of the user, a request rejected
+        with 401 is sent once more with a new token
+
+        Parameters:
+            endpoint (str): path of the endpoint, starting with /
+            idempotent (bool): request can be retried safely
+            kwargs: arguments passed to requests.post
+        """
+
+        if self.breaker.url != self.config["url"]:
+            self.breaker = self.new_breaker()
+            self.sessions.clear()
+            self.has_search = True
+
+        extra_headers = kwargs.pop("headers", {})
+        auth = kwargs.pop("auth", None)
+
+        for attempt in range(2):
+            headers = {**self.headers, **extra_headers}
+            token = self.session(auth) if auth else None
+            if token:
+                headers["Authorization"] = "Bearer " + token
+
+            response = self.send(
+                endpoint,
+                idempotent,
+                headers=headers,
+                auth=None if token else auth,
+                **kwargs,
+            )
+            if not token or response.status_code != 401 or attempt:
+                return response
+
+            response.close()
+            self.sessions.pop(auth, None)
+
+        return response
+
+    def timeout(self) -> (float, float):
+        """Returns the connect and read timeout set in config"""
+
+        return (
+            self.config.get("connect_timeout", CONNECT_TIMEOUT),
+            self.config.get("read_timeout", READ_TIMEOUT),
+        )
+
+    def new_breaker(self) -> CircuitBreaker:
+        """Returns a CircuitBreaker of the server with the limits set in
+        config"""
+
+        return CircuitBreaker(
+            self.config["url"],
+            self.config.get("failure_threshold", FAILURE_THRESHOLD),
+            timeout=self.timeout(),
+        )
+
+    def send(self, endpoint, idempotent, **kwargs) -> requests.Response:
+        """Sends a request to endpoint through transport.send with the
+        timeouts and retries set in config"""
+
+        return send(
+            self.breaker,
+            self.config["url"] + endpoint,
+            idempotent,
+            timeout=self.timeout(),
+            retries=self.config.get("retries", RETRIES),
+            **kwargs,
+        )
+
+    def session(self, auth) -> str:
+        """
+        Returns the session token of auth, logging in if there is none or
+        it's about to expire
+
+        The server is asked with a POST to /check_credentials with basic
+        auth and json {"session": true} and answers with {"token": str,
+        "expires_in": seconds}. Servers that accept the credentials with
+        anything else don't have sessions and get basic auth on every
+        request.
+
+        Returns:
+            str: session token or None if credentials are wrong or the
+                server doesn't have sessions
+        """
+
+        token, expires = self.sessions.get(auth, (None, 0))
+        if time.monotonic() < expires:
+            return token
+
+        response = self.send(
+            "/check_credentials",
+            True,
+            headers=self.headers,
+            auth=auth,
+            json={"session": True},
+        )
+        if not response.ok:
+            return None
+
+        try:
+            data = self.decode(response)
+        except ValueError:
+            data = None
+
+        if isinstance(data, dict) and "token" in data:
+            self.sessions[auth] = (
+                data["token"],
+                time.monotonic() + data["expires_in"] - self.SESSION_MARGIN,
+            )
+            return data["token"]
+
+        if response.text:
+            self.sessions[auth] = (None, float("inf"))
+        return None
+
+    @staticmethod
+    def decode(response) -> object:
+        """
+        Decodes a json or MessagePack response body
+
+        MessagePack responses carry ciphertexts as raw bytes, they are
+        turned back into the base64 tokens that Fernet expects
+        """
+
+        if not response.headers.get("Content-Type", "").startswith(
+            "application/msgpack"
+        ):
+            return response.json()
+
+        def tokens(value):
+            if isinstance(value, bytes):
+                return base64.urlsafe_b64encode(value).decode()
+            if isinstance(value, list):
+                return [tokens(item) for item in value]
+            if isinstance(value, dict):
+                return {key: tokens(item) for key, item in value.items()}
+            return value
+
+        return tokens(msgpack.unpackb(response.content, raw=False))
+
+    def remove_from_database(self, row_id, auth) -> None:
+        self.post(
+            "/remove_from_database",
+            idempotent=True,
+            json={"id": row_id},
+            auth=auth,
+        ).raise_for_status()
+
+    def get_entry(self, row_id, auth) -> list:
+        return self.decode(
+            self.post(
+                "/get_entry", idempotent=True, json={"id": row_id}, auth=auth
+            )
+        )
+
+    def get_all(self, auth) -> list:
+        data = self.decode(self.post("/get_all", idempotent=True, auth=auth))
+        entry_ids = self.decode(
+            self.post("/get_entry_ids", idempotent=True, auth=auth)
+        )
+        return [[entry_id, *row] for entry_id, row in zip(entry_ids, data)]
+
+    def stream_all(self, auth, batch_size, with_password):
+        """
+        Requests the entries from /get_all as application/x-ndjson, one
+        json list per line, and parses the lines as they arrive. Servers
+        that answer with a single json array are read as one response.
+        """
+
+        response = self.post(
+            "/get_all",
+            idempotent=True,
+            json={"with_password": with_password},
+            auth=auth,
+            stream=True,
+            headers={"Accept": "application/x-ndjson, application/json;q=0.5"},
+        )
+
+        try:
+            if not response.headers.get("Content-Type", "").startswith(
+                "application/x-ndjson"
+            ):
+                data = self.decode(response)
+                entry_ids = self.decode(
+                    self.post("/get_entry_ids", idempotent=True, auth=auth)
+                )
+                data = [
+                    [entry_id, *row] for entry_id, row in zip(entry_ids, data)
+                ]
+                for i in range(0, len(data), batch_size):
+                    yield data[i : i + batch_size]
+                return
+
+            batch = []
+            for line in response.iter_lines():
+                if not line:
+                    continue
+
+                batch.append(json.loads(line))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+
+            if batch:
+                yield batch
+
+        finally:
+            response.close()
+
+    def get_page(self, auth, cursor, limit, with_password) -> (list, object):
+        """
+        Posts {"cursor": str or null, "limit": int, "with_password": bool}
+        to /get_page, the server answers with {"entries": [[id, website,
+        username, password], ...], "cursor": str or null}. Servers without
+        /get_page return the whole vault as one page.
+        """
+
+        response = self.post(
+            "/get_page",
+            idempotent=True,
+            json={
+                "cursor": cursor,
+                "limit": limit,
+                "with_password": with_password,
+            },
+            auth=auth,
+        )
+        if response.status_code == 404:
+            return self.get_all(auth), None
+
+        response = self.decode(response)
+        return response["entries"], response["cursor"]
+
+    def search(self, query, auth, limit, offset) -> list:
+        """
+        Posts {"query": str, "limit": int, "cursor": str or null} to
+        /search, the server answers with {"entries": [[id, website,
+        username], ...], "cursor": str or null}, the cursor continuing
+        after the last returned entry. Cursors of the last query are
+        remembered by offset, an offset without one is reached by paging
+        from the closest offset before it. Servers without /search are
+        searched by listing the vault.
+        """
+
+        if not self.has_search:
+            return super().search(query, auth, limit, offset)
+
+        if query not in self.search_cursors:
+            self.search_cursors = {query: {0: None}}
+        cursors = self.search_cursors[query]
+
+        position = max(known for known in cursors if known <= offset)
+        data = []
+        while position < offset + limit:
+            response = self.post(
+                "/search",
+                idempotent=True,
+                json={
+                    "query": query,
+                    "limit": offset + limit - position,
+                    "cursor": cursors[position],
+                },
+                auth=auth,
+            )
+            if response.status_code == 404:
+                self.has_search = False
+                return super().search(query, auth, limit, offset)
+
+            response = self.decode(response)
+            entries = response["entries"]
+            data.extend(entries[max(offset - position, 0) :])
+            position += len(entries)
+            if response["cursor"] is None or not entries:
+                break
+            cursors[position] = response["cursor"]
+
+        return data[:limit]
+
+    def get_entry_ids(self, auth) -> list:
+        return self.decode(
+            self.post("/get_entry_ids", idempotent=True, auth=auth)
+        )
+
+    def modification_order(self, auth) -> dict:
+        """Posts to /modification_order, the server answers with {id:
+        number}. Servers without it don't keep track."""
+
+        response = self.post("/modification_order", idempotent=True, auth=auth)
+        if response.status_code == 404:
+            return {}
+        return {
+            int(entry_id): order
+            for entry_id, order in self.decode(response).items()
+        }
+
+    def add_to_database(self, website, username, password, auth) -> None:
+        self.post(
+            "/add_to_database",
+            json={
+                "website": website,
+                "username": username,
+                "password": password,
+            },
+            auth=auth,
+        ).raise_for_status()
+
+    def add_entries(self, entries, auth) -> None:
+        """
+        Posts {"entries": [[website, username, password], ...]} to
+        /add_entries, servers without it get one /add_to_database request
+        per entry
+        """
+
+        entries = [
+            [website, username, encode_token(password)]
+            for website, username, password in entries
+        ]
+        response = self.post(
+            "/add_entries", json={"entries": entries}, auth=auth
+        )
+        if response.status_code == 404:
+            super().add_entries(entries, auth)
+        else:
+            response.raise_for_status()
+
+    def update_entry(  # pylint: disable=too-many-arguments
+        self, row_id, website, username, password, auth
+    ) -> None:
+        self.post(
+            "/update_entry",
+            idempotent=True,
+            json={
+                "id": row_id,
+                "website": website,
+                "username": username,
+                "password": password,
+            },
+            auth=auth,
+        ).raise_for_status()
+
+    def register(self, username, email, master_key) -> str:
+        return self.post(
+            "/register",
+            json={
+                "username": username,
+                "email": email,
+                "password": master_key,
+            },
+        ).text
+
+    def check_credentials(self, username, master_key) -> bool:
+        """Logs in, the session token is kept for the following calls"""
+
+        auth = (username, master_key)
+        self.sessions.pop(auth, None)
+        self.session(auth)
+        return auth in self.sessions
+
+    def rekey_request(self, endpoint, auth, idempotent=True, **body) -> dict:
+        """Posts body to a /rekey endpoint, the server answers 409 with
+        {"error": str} if the change can't be made"""
+
+        response = self.post(
+            endpoint, idempotent=idempotent, json=body, auth=auth
+        )
+        if response.status_code == 409:
+            raise ValueError(self.decode(response)["error"])
+        response.raise_for_status()
+        return self.decode(response) if response.content else None
+
+    def begin_rekey(self, auth, master_key) -> object:
+        """
+        Posts {"master_key": str} to /rekey/begin, the server answers with
+        {"cursor": str or null}. /rekey/write takes {"entries": [[id,
+        password, new password], ...]}, /rekey/finish and /rekey/abort
+        take nothing, the server keeps new ciphertexts aside the way the
+        offline backends do.
+        """
+
+        return self.rekey_request("/rekey/begin", auth, master_key=master_key)[
+            "cursor"
+        ]
+
+    def write_rekey(self, auth, entries) -> None:
+        self.rekey_request(
+            "/rekey/write",
+            auth,
+            entries=[
+                [entry_id, encode_token(password), encode_token(password_next)]
+                for entry_id, password, password_next in entries
+            ],
+        )
+
+    def finish_rekey(self, auth) -> None:
+        self.rekey_request("/rekey/finish", auth, idempotent=False)
+        self.sessions.pop(auth, None)
+
+    def abort_rekey(self, auth) -> None:
+        self.rekey_request("/rekey/abort", auth)
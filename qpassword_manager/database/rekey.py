@@ -0,0 +1,151 @@
+"""Changing the master key, re-encrypting every password of a vault"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import InvalidToken
+from qpassword_manager.crypto import encode_token
+
+# entries read, re-encrypted and written at once
+BATCH_SIZE = 1000
+
+# times the vault is gone through again for entries changed meanwhile
+ROUNDS = 3
+
+
+def reencrypt(old_cipher, new_cipher, entries) -> list:
+    """Returns (id, password, new password) of entries (id, website,
+    username, password) as write_rekey takes them"""
+
+    try:
+        return [
+            (
+                entry_id,
+                password,
+                encode_token(new_cipher.encrypt(old_cipher.decrypt(password))),
+            )
+            for entry_id, _, _, password in entries
+        ]
+    except InvalidToken as error:
+        raise ValueError(
+            "An entry can't be decrypted, the master key isn't changed"
+        ) from error
+
+
+def rekey(  # pylint: disable=too-many-arguments
+    backend, auth, master_key, old_cipher, new_cipher, *, batch_size=BATCH_SIZE
+) -> None:
+    """
+    Re-encrypts every password of a vault and changes its master key
+
+    Pages are read, re-encrypted and written in a pipeline: the next page
+    is fetched and the previous one written while one is re-encrypted.
+    Every write is a checkpoint, an interrupted change resumes after the
+    last written entry when it's started again with the same master key.
+    The vault keeps the old key until finish_rekey swaps all ciphertexts
+    at once, entries changed meanwhile are re-encrypted in another round.
+    A change that can't be made is aborted and the vault stays with the
+    old key, one interrupted by a connection or file error keeps its
+    checkpoints.
+
+    Parameters:
+        backend (Backend): backend of the vault
+        auth: username and hashed master key
+        master_key (str): new hashed master key
+        old_cipher (VaultCipher): cipher of the current key
+        new_cipher (VaultCipher): cipher of the new key
+        batch_size (int): entries per page
+
+    Raises:
+        ValueError: if a change to another key is in progress, an entry
+            can't be decrypted or entries kept changing
+        OSError: if the change was interrupted and can be resumed
+    """
+
+    cursor = backend.begin_rekey(auth, master_key)
+    try:
+        for round_ in range(ROUNDS):
+            if round_:
+                cursor = backend.begin_rekey(auth, master_key)
+            rekey_round(
+                backend,
+                auth,
+                cursor,
+                old_cipher,
+                new_cipher,
+                batch_size=batch_size,
+            )
+
+            try:
+                backend.finish_rekey(auth)
+                return
+            except ValueError:
+                if round_ == ROUNDS - 1:
+                    raise
+
+    except OSError:
+        # requests errors are OSErrors, some of them ValueErrors as well
+        raise
+    except ValueError:
+        try:
+            backend.abort_rekey(auth)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("master key change couldn't be aborted")
+        raise
+
+
+def rekey_round(  # pylint: disable=too-many-arguments
+    backend, auth, cursor, old_cipher, new_cipher, *, batch_size
+) -> None:
+    """Re-encrypts the entries after cursor, see rekey"""
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        page = pool.submit(backend.get_page, auth, cursor, batch_size, True)
+        written = None
+        while page is not None:
+            entries, cursor = page.result()
+            page = (
+                pool.submit(backend.get_page, auth, cursor, batch_size, True)
+                if cursor is not None
+                else None
+            )
+
+            entries = reencrypt(old_cipher, new_cipher, entries)
+            if written is not None:
+                written.result()
+            if entries:
+                written = pool.submit(backend.write_rekey, auth, entries)
+
+        if written is not None:
+            written.result()
+
+
+def rekey_changes(path, old_cipher, new_cipher) -> None:
+    """
+    Re-encrypts a file of changes stored by MainWindow.store_changes and
+    the passwords in it, the file is replaced atomically
+
+    Parameters:
+        path (str): path of the file, nothing is done if it doesn't exist
+        old_cipher (VaultCipher): cipher of the current key
+        new_cipher (VaultCipher): cipher of the new key
+    """
+
+    if not os.path.exists(path):
+        return
+
+    with open(path, "rb") as file:
+        changes = json.loads(old_cipher.decrypt(file.read()))
+
+    for change in changes:
+        if change[0] in (1, 2):
+            change[1][2] = encode_token(
+                new_cipher.encrypt(old_cipher.decrypt(change[1][2]))
+            )
+
+    with open(path + ".new", "wb") as file:
+        file.write(new_cipher.encrypt(json.dumps(changes).encode()))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".new", path)
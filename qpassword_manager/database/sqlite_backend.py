@@ -0,0 +1,383 @@
+"""Backend that keeps the vault in an offline sqlite database"""
+
+import os
+import sqlite3
+from qpassword_manager.crypto import decode_token
+from qpassword_manager.database.backend import Backend
+from qpassword_manager.database.migrations import create_tables, migrate
+
+# value of the modified column of an entry that is added or updated
+NEXT_MODIFIED = "(select coalesce(max(modified), 0) + 1 from passwords)"
+
+
+class SQLiteBackend(Backend):
+    """
+    Backend that keeps every user's vault in <username>.db
+
+    Attributes:
+        migrated: paths of the databases already upgraded by migrate
+    """
+
+    def __init__(self, config) -> None:
+        super().__init__(config)
+        self.migrated = set()
+
+    def connect(self, username) -> sqlite3.Connection:
+        """Opens the offline database of a user, upgrading its schema the
+        first time it's opened, raises ValueError if the user has none"""
+
+        path = username + ".db"
+        if not os.path.exists(path):
+            raise ValueError(f"There is no vault of {username}")
+        if path not in self.migrated:
+            migrate(path)
+            self.migrated.add(path)
+
+        return sqlite3.connect(path)
+
+    def remove_from_database(self, row_id, auth) -> None:
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        cursor.execute(
+            """delete
+               from passwords
+               where (id = ?)""",
+            (row_id,),
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def get_entry(self, row_id, auth) -> list:
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        cursor.execute(
+            """select website, username, password
+               from passwords
+               where (id = ?)""",
+            (row_id,),
+        )
+        data = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        return data
+
+    def get_all(self, auth) -> list:
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        cursor.execute(
+            """select id, website, username, password
+               from passwords"""
+        )
+        data = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return data
+
+    def stream_all(self, auth, batch_size, with_password):
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                f"""select id, website, username,
+                   {"password" if with_password else "null"}
+                   from passwords
+                   order by id"""
+            )
+            while batch := cursor.fetchmany(batch_size):
+                yield batch
+
+        finally:
+            cursor.close()
+            conn.close()
+
+    def get_page(self, auth, cursor, limit, with_password) -> (list, object):
+        """The cursor is the last id of the previous page"""
+
+        conn = self.connect(auth[0])
+        cursor_db = conn.cursor()
+        cursor_db.execute(
+            f"""select id, website, username,
+               {"password" if with_password else "null"}
+               from passwords
+               where (id > ?)
+               order by id
+               limit ?""",
+            (cursor or 0, limit),
+        )
+        data = cursor_db.fetchmany(limit)
+        cursor_db.close()
+        conn.close()
+        return data, data[-1][0] if len(data) == limit else None
+
+    def search(self, query, auth, limit, offset) -> list:
+        """Queries of three or more characters use the full text search
+        index, shorter ones fall back to like"""
+
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        if len(query) >= 3:
+            cursor.execute(
+                """select rowid, website, username
+                   from passwords_search
+                   where (passwords_search match ?)
+                   order by rowid
+                   limit ? offset ?""",
+                ('"' + query.replace('"', '""') + '"', limit, offset),
+            )
+        else:
+            pattern = (
+                "%"
+                + query.replace("\\", "\\\\")
+                .replace("%", "\\%")
+                .replace("_", "\\_")
+                + "%"
+            )
+            cursor.execute(
+                """select id, website, username
+                   from passwords
+                   where (website like ? escape '\\'
+                          or username like ? escape '\\')
+                   order by id
+                   limit ? offset ?""",
+                (pattern, pattern, limit, offset),
+            )
+
+        data = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return data
+
+    def get_entry_ids(self, auth) -> list:
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        cursor.execute(
+            """select id
+               from passwords"""
+        )
+        data = cursor.fetchall()
+        data = list(map(lambda x: x[0], data))
+        cursor.close()
+        conn.close()
+        return data
+
+    def add_to_database(self, website, username, password, auth) -> None:
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""insert into passwords
+               (website, username, password, modified)
+               values
+               (?, ?, ?, {NEXT_MODIFIED})""",
+            (website, username, decode_token(password)),
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def add_entries(self, entries, auth) -> None:
+        """All entries are inserted in one transaction"""
+
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        cursor.executemany(
+            f"""insert into passwords
+               (website, username, password, modified)
+               values
+               (?, ?, ?, {NEXT_MODIFIED})""",
+            [
+                (website, username, decode_token(password))
+                for website, username, password in entries
+            ],
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def modification_order(self, auth) -> dict:
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        cursor.execute("select id, modified from passwords")
+        order = dict(cursor.fetchall())
+        cursor.close()
+        conn.close()
+        return order
+
+    def check_storage(self, auth) -> list:
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        cursor.execute("pragma integrity_check")
+        problems = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        conn.close()
+        return [] if problems == ["ok"] else problems
+
+    def update_entry(  # pylint: disable=too-many-arguments
+        self, row_id, website, username, password, auth
+    ) -> None:
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""update passwords
+                set website = ?, username = ?, password = ?,
+                    password_next = null, modified = {NEXT_MODIFIED}
+                where (id = ?)""",
+            (website, username, decode_token(password), row_id),
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def register(self, username, email, master_key) -> str:
+        if os.path.exists(username + ".db"):
+            return "Username already taken"
+
+        conn = sqlite3.connect(username + ".db")
+        cursor = conn.cursor()
+        create_tables(cursor)
+        cursor.execute(
+            """insert into passwords
+               (website, username, password)
+               values
+               ('Master', 'Key', ?)""",
+            (master_key,),
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        migrate(username + ".db", backup=False)
+        self.migrated.add(username + ".db")
+
+        return "Registration successfull!"
+
+    def check_credentials(self, username, master_key) -> bool:
+        if not os.path.exists(username + ".db"):
+            return False
+
+        conn = self.connect(username)
+        cursor = conn.cursor()
+        cursor.execute("select value from metadata where (key = 'master_key')")
+        master_key_db = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+
+        return master_key == master_key_db
+
+    def begin_rekey(self, auth, master_key) -> object:
+        """The new master key hash is kept in metadata and new ciphertexts
+        in password_next, entries without one are the ones left"""
+
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """select value
+                   from metadata
+                   where (key = 'rekey_master_key')"""
+            )
+            pending = cursor.fetchone()
+            if pending is None:
+                cursor.execute("update passwords set password_next = null")
+                cursor.execute(
+                    """insert into metadata (key, value)
+                       values ('rekey_master_key', ?)""",
+                    (master_key,),
+                )
+                conn.commit()
+                return None
+
+            if pending[0] != master_key:
+                raise ValueError("Another master key change is in progress")
+
+            cursor.execute(
+                """select coalesce((select min(id) - 1
+                                    from passwords
+                                    where (password_next is null)),
+                                   (select max(id) from passwords))"""
+            )
+            return cursor.fetchone()[0] or None
+
+        finally:
+            cursor.close()
+            conn.close()
+
+    def write_rekey(self, auth, entries) -> None:
+        """Old ciphertexts are compared once decoded, vaults from before
+        AES-GCM keep Fernet tokens as text"""
+
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        try:
+            cursor.execute("begin immediate")
+            cursor.execute(
+                """select id, password
+                   from passwords
+                   where (id between ? and ?)""",
+                (
+                    min(entry[0] for entry in entries),
+                    max(entry[0] for entry in entries),
+                ),
+            )
+            stored = dict(cursor.fetchall())
+            cursor.executemany(
+                """update passwords
+                   set password_next = ?
+                   where (id = ?)""",
+                [
+                    (decode_token(password_next), entry_id)
+                    for entry_id, password, password_next in entries
+                    if stored.get(entry_id) is not None
+                    and decode_token(stored[entry_id]) == decode_token(password)
+                ],
+            )
+            conn.commit()
+
+        finally:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+
+    def finish_rekey(self, auth) -> None:
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        try:
+            cursor.execute("begin immediate")
+            cursor.execute(
+                """select count(*)
+                   from passwords
+                   where (password_next is null)"""
+            )
+            if cursor.fetchone()[0]:
+                raise ValueError("Some entries aren't re-encrypted")
+
+            cursor.execute(
+                """update passwords
+                   set password = password_next, password_next = null"""
+            )
+            cursor.execute(
+                """update metadata
+                   set value = (select value
+                                from metadata
+                                where (key = 'rekey_master_key'))
+                   where (key = 'master_key')"""
+            )
+            cursor.execute(
+                "delete from metadata where (key = 'rekey_master_key')"
+            )
+            conn.commit()
+
+        finally:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+
+    def abort_rekey(self, auth) -> None:
+        conn = self.connect(auth[0])
+        cursor = conn.cursor()
+        cursor.execute("update passwords set password_next = null")
+        cursor.execute("delete from metadata where (key = 'rekey_master_key')")
+        conn.commit()
+        cursor.close()
+        conn.close()
@@ -0,0 +1,358 @@
+"""Merging two vaults of a user, like the offline database and the server"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+from collections import Counter
+from cryptography.fernet import InvalidToken
+from qpassword_manager.crypto import decode_token, encode_token
+
+# entries read and written at once
+BATCH_SIZE = 1000
+
+# which vaults sync writes to
+DIRECTIONS = ("both", "push", "pull")
+
+
+def fingerprint(key, cipher, password) -> bytes:
+    """
+    Returns HMAC-SHA256 of the plain text of a password
+
+    Ciphertexts of the same password differ, so they are compared by
+    fingerprint. key is random and only kept in the encrypted SyncState
+    of the two vaults, so fingerprints can't be compared with anything
+    else. A password that can't be decrypted gets the fingerprint of its
+    ciphertext.
+    """
+
+    try:
+        return hmac.new(key, cipher.decrypt(password), hashlib.sha256).digest()
+    except InvalidToken:
+        return hmac.new(
+            key, b"\0" + decode_token(password), hashlib.sha256
+        ).digest()
+
+
+def hash_table(backend, auth, cipher, key, batch_size) -> dict:
+    """Returns entries of a vault by website, username and fingerprint of
+    the password"""
+
+    table = {}
+    for batch in backend.stream_all(auth, batch_size, True):
+        for entry in batch:
+            table.setdefault(
+                (entry[1], entry[2], fingerprint(key, cipher, entry[3])), []
+            ).append(entry)
+    return table
+
+
+def diff(  # pylint: disable=too-many-arguments
+    local, remote, auth, cipher, batch_size=BATCH_SIZE, *, key=None
+) -> dict:
+    """
+    Compares two vaults with a hash join, every entry is read once
+
+    The entries of local are hashed by website, username and fingerprint
+    of the password, the entries of remote are looked up in that table as
+    they are streamed. Entries left on both sides with the same website
+    and username are conflicts, the rest is only in one vault.
+
+    Parameters:
+        local (Backend): first vault
+        remote (Backend): second vault
+        auth: username and hashed master key, the same in both vaults
+        cipher (VaultCipher): cipher of the user
+        batch_size (int): entries read at once
+        key (bytes): key of the fingerprints, random if None
+
+    Returns:
+        dict: "local" and "remote" lists of entries (id, website,
+            username, password) only in that vault, "conflicts" list of
+            (local entry, remote entry), "unchanged" number of entries
+            in both and "both" Counter of their website, username and
+            fingerprint
+    """
+
+    key = os.urandom(32) if key is None else key
+    table = hash_table(local, auth, cipher, key, batch_size)
+
+    both = Counter()
+    unmatched = []
+    for batch in remote.stream_all(auth, batch_size, True):
+        for entry in batch:
+            name = (entry[1], entry[2], fingerprint(key, cipher, entry[3]))
+            matches = table.get(name)
+            if matches:
+                matches.pop()
+                both[name] += 1
+            else:
+                unmatched.append(entry)
+
+    return {
+        **pair_conflicts(table, unmatched),
+        "unchanged": sum(both.values()),
+        "both": both,
+    }
+
+
+def pair_conflicts(table, unmatched) -> dict:
+    """Pairs entries left in the hash table with unmatched remote entries
+    of the same website and username, returns them like diff does"""
+
+    local_only = {}
+    for key, entries in table.items():
+        if entries:
+            local_only.setdefault(key[:2], []).extend(entries)
+
+    remote_only = []
+    conflicts = []
+    for entry in unmatched:
+        same_name = local_only.get((entry[1], entry[2]))
+        if same_name:
+            conflicts.append((same_name.pop(), entry))
+        else:
+            remote_only.append(entry)
+
+    return {
+        "local": [
+            entry for entries in local_only.values() for entry in entries
+        ],
+        "remote": remote_only,
+        "conflicts": conflicts,
+    }
+
+
+class SyncState:
+    """
+    Entries that were in both vaults after the last sync, stored encrypted
+
+    An entry that is only in one vault but was in both is one the other
+    vault deleted, an entry that differs from its last synced version in
+    only one vault was changed there. Entries are kept by website,
+    username and fingerprint, the state of another pair of vaults or of
+    another server is started over.
+
+    Attributes:
+        path: file the state is stored in
+        cipher: VaultCipher the file is encrypted with
+        vaults: identifies the two vaults, like the url of the server
+        key: key of the fingerprints
+        entries: Counter of (website, username, fingerprint)
+    """
+
+    def __init__(self, path, cipher, vaults) -> None:
+        self.path = path
+        self.cipher = cipher
+        self.vaults = vaults
+        self.key = os.urandom(32)
+        self.entries = Counter()
+
+    def load(self) -> None:
+        """Reads the state, a file that can't be read or belongs to other
+        vaults is started over"""
+
+        try:
+            with open(self.path, "rb") as file:
+                data = json.loads(self.cipher.decrypt(file.read()))
+            if data["vaults"] == self.vaults:
+                self.key = bytes.fromhex(data["key"])
+                self.entries = Counter(
+                    {
+                        (website, username, bytes.fromhex(fingerprint_)): count
+                        for website, username, fingerprint_, count in data[
+                            "entries"
+                        ]
+                    }
+                )
+        except FileNotFoundError:
+            pass
+        except (InvalidToken, ValueError, KeyError, TypeError) as error:
+            logging.warning("%s can't be read: %r", self.path, error)
+
+    def save(self) -> None:
+        """Writes the state to a temporary file and renames it"""
+
+        data = {
+            "vaults": self.vaults,
+            "key": self.key.hex(),
+            "entries": [
+                [website, username, fingerprint_.hex(), count]
+                for (website, username, fingerprint_), count in (
+                    self.entries.items()
+                )
+            ],
+        }
+        with open(self.path + ".new", "wb") as file:
+            file.write(self.cipher.encrypt(json.dumps(data).encode()))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".new", self.path)
+
+
+def sync(  # pylint: disable=too-many-arguments, too-many-locals
+    local,
+    remote,
+    auth,
+    cipher,
+    *,
+    direction="both",
+    prefer=None,
+    batch_size=BATCH_SIZE,
+    state=None,
+) -> dict:
+    """
+    Copies entries that are only in one vault to the other one
+
+    Ciphertexts are copied as they are, both vaults have to belong to the
+    same user with the same master key. Entries are written in batches of
+    batch_size with Backend.add_entries.
+
+    With a SyncState, entries that were synced before and are only left
+    in one vault are removed from it, and conflicts where only one vault
+    changed the entry since the last sync take that change. state is
+    updated to the entries in both vaults afterwards, writes skipped
+    because of direction are left for a later sync. Without one nothing
+    is removed, deleting an entry in one vault only sticks when the
+    other one doesn't have it.
+
+    Parameters:
+        local (Backend): first vault
+        remote (Backend): second vault
+        auth: username and hashed master key
+        cipher (VaultCipher): cipher of the user
+        direction (str): "push" only writes to remote, "pull" only to
+            local, "both" to both
+        prefer (str): "local" or "remote" overwrites entries changed in
+            both vaults with the ones from this one, None leaves them as
+            they are
+        batch_size (int): entries read and written at once
+        state (SyncState): state of the last sync of the two vaults
+
+    Returns:
+        dict: numbers of "pushed", "pulled", "unchanged" and "resolved"
+            entries, of entries "removed_remote" and "removed_local" and
+            "conflicts" list of (website, username) of the conflicts that
+            weren't resolved
+    """
+
+    if direction not in DIRECTIONS:
+        raise ValueError(f"Unknown direction {direction}")
+
+    key = os.urandom(32) if state is None else state.key
+    changes = diff(local, remote, auth, cipher, batch_size, key=key)
+    synced = changes["both"]
+    base = Counter() if state is None else state.entries - synced
+    result = {
+        "pushed": 0,
+        "pulled": 0,
+        "removed_remote": 0,
+        "removed_local": 0,
+        "unchanged": changes["unchanged"],
+    }
+
+    def name(entry):
+        return (entry[1], entry[2], fingerprint(key, cipher, entry[3]))
+
+    for source, target, entries, count, skipped_by, removed, kept_by in (
+        (
+            local,
+            remote,
+            changes["local"],
+            "pushed",
+            "pull",
+            "removed_local",
+            "push",
+        ),
+        (
+            remote,
+            local,
+            changes["remote"],
+            "pulled",
+            "push",
+            "removed_remote",
+            "pull",
+        ),
+    ):
+        added = []
+        for entry in entries:
+            entry_name = name(entry)
+            if base[entry_name]:
+                # deleted in target since the last sync
+                base[entry_name] -= 1
+                if direction == kept_by:
+                    synced[entry_name] += 1
+                else:
+                    source.remove_from_database(entry[0], auth)
+                    result[removed] += 1
+            elif direction != skipped_by:
+                added.append(entry)
+                synced[entry_name] += 1
+
+        for i in range(0, len(added), batch_size):
+            target.add_entries(
+                [entry[1:] for entry in added[i : i + batch_size]], auth
+            )
+            result[count] += len(added[i : i + batch_size])
+
+    result["resolved"], result["conflicts"] = resolve(
+        local,
+        remote,
+        auth,
+        [
+            (local_entry, remote_entry, name(local_entry), name(remote_entry))
+            for local_entry, remote_entry in changes["conflicts"]
+        ],
+        direction=direction,
+        prefer=prefer,
+        base=base,
+        synced=synced,
+    )
+
+    if state is not None:
+        state.entries = +synced
+    return result
+
+
+def resolve(  # pylint: disable=too-many-arguments, too-many-locals
+    local, remote, auth, conflicts, *, direction, prefer, base, synced
+) -> (int, list):
+    """Overwrites conflicting entries (local entry, remote entry, local
+    name, remote name) as sync does, adding the entries left in both
+    vaults to synced, and returns the number of resolved conflicts and
+    (website, username) of the others"""
+
+    resolved = 0
+    left = []
+    for local_entry, remote_entry, local_name, remote_name in conflicts:
+        # the vault that still has the last synced version didn't change
+        unchanged_name = None
+        if base[local_name] and not base[remote_name]:
+            winner, unchanged_name = "remote", local_name
+        elif base[remote_name] and not base[local_name]:
+            winner, unchanged_name = "local", remote_name
+        else:
+            winner = prefer
+        if unchanged_name is not None:
+            base[unchanged_name] -= 1
+
+        if winner == "local" and direction != "pull":
+            target, row_id, entry = remote, remote_entry[0], local_entry
+            synced[local_name] += 1
+        elif winner == "remote" and direction != "push":
+            target, row_id, entry = local, local_entry[0], remote_entry
+            synced[remote_name] += 1
+        else:
+            if unchanged_name is not None:
+                # left for a sync that writes to the vault that didn't change
+                synced[unchanged_name] += 1
+            left.append(local_entry[1:3])
+            continue
+
+        target.update_entry(
+            row_id, entry[1], entry[2], encode_token(entry[3]), auth
+        )
+        resolved += 1
+
+    return resolved, left
@@ -0,0 +1,182 @@
+"""Timeouts, retries and circuit breaker for requests to the server"""
+
+import logging
+import random
+import threading
+import time
+import requests
+
+# limits used when config doesn't set connect_timeout, read_timeout,
+# retries and failure_threshold
+
+# seconds to wait for a connection and for the response once connected,
+# a connection attempt that loses its first SYN is retried after 3s
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+
+# retries of an idempotent request and the backoff before the nth retry,
+# a random time up to RETRY_BACKOFF * 2 ** n
+RETRIES = 2
+RETRY_BACKOFF = 0.05
+
+# attempts in a row that fail before the circuit opens, retries count
+# as attempts so a server that doesn't answer opens it within two calls
+FAILURE_THRESHOLD = 5
+
+# responses that are worth retrying
+RETRY_STATUS = (502, 503, 504)
+
+
+class ServerUnavailable(Exception):
+    """Raised without sending the request while the circuit is open"""
+
+    def __init__(self) -> None:
+        super().__init__("Server is unreachable")
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a server that is down
+
+    After failure_threshold attempts in a row fail the circuit opens and
+    requests fail immediately. A background thread probes the server with
+    growing intervals and half opens the circuit once it answers:
+    requests are let through again, the first one that reaches the server
+    closes the circuit and one that fails opens it again right away.
+
+    Attributes:
+        url: url of the server, probed while the circuit is open
+        failures: number of attempts that failed in a row
+        is_open: True while requests are refused
+        half_open: True after a probe answered until the next request
+            succeeds or fails
+        timeout: connect and read timeout of the probes
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        url,
+        failure_threshold=FAILURE_THRESHOLD,
+        probe_interval=1,
+        max_interval=30,
+        *,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    ) -> None:
+        self.url = url
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.failures = 0
+        self.is_open = False
+        self.half_open = False
+        self.lock = threading.Lock()
+
+    def check(self) -> None:
+        """Raises ServerUnavailable if the circuit is open"""
+
+        if self.is_open:
+            raise ServerUnavailable
+
+    def success(self) -> None:
+        """Records a request that reached the server"""
+
+        with self.lock:
+            self.failures = 0
+            if self.half_open:
+                self.half_open = False
+                logging.info("%s is reachable, closing circuit", self.url)
+
+    def failure(self) -> None:
+        """Records an attempt that didn't reach the server or got a
+        RETRY_STATUS, opening the circuit after too many of them or after
+        a failed trial request"""
+
+        with self.lock:
+            self.failures += 1
+            if self.is_open or (
+                self.failures < self.failure_threshold and not self.half_open
+            ):
+                return
+
+            self.is_open = True
+            self.half_open = False
+
+        logging.warning("%s is unreachable, opening circuit", self.url)
+        threading.Thread(target=self.probe, daemon=True).start()
+
+    def probe(self) -> None:
+        """Probes the server until it answers, then half opens the
+        circuit"""
+
+        interval = self.probe_interval
+        while True:
+            time.sleep(interval)
+            try:
+                requests.head(self.url, timeout=self.timeout)
+            except requests.RequestException:
+                interval = min(interval * 2, self.max_interval)
+                continue
+
+            with self.lock:
+                self.is_open = False
+                self.half_open = True
+
+            logging.info("%s answered, trying a request", self.url)
+            return
+
+
+def send(  # pylint: disable=too-many-arguments
+    breaker,
+    url,
+    idempotent=False,
+    *,
+    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    retries=RETRIES,
+    **kwargs,
+) -> requests.Response:
+    """
+    Sends a POST request through breaker
+
+    Connection errors, timeouts and RETRY_STATUS responses of idempotent
+    requests are retried with jittered backoff, other requests are sent
+    once since the server may have applied them. Every attempt that
+    fails that way counts as a failure of breaker, a RETRY_STATUS
+    response of the last attempt is returned.
+
+    Parameters:
+        breaker (CircuitBreaker): circuit breaker of the server
+        url (str): url of the endpoint
+        idempotent (bool): request can be repeated safely
+        timeout: connect and read timeout in seconds
+        retries (int): retries of an idempotent request
+        kwargs: arguments passed to requests.post
+
+    Raises:
+        ServerUnavailable: if the circuit is open
+        requests.RequestException: if the last attempt failed
+    """
+
+    attempts = retries + 1 if idempotent else 1
+    attempt = 0
+    while True:
+        breaker.check()
+        try:
+            response = requests.post(url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            attempt += 1
+            breaker.failure()
+            if attempt == attempts:
+                raise
+        else:
+            attempt += 1
+            if response.status_code not in RETRY_STATUS:
+                breaker.success()
+                return response
+
+            breaker.failure()
+            if attempt == attempts:
+                return response
+            response.close()
+
+        time.sleep(random.uniform(0, RETRY_BACKOFF * 2**attempt))
@@ -0,0 +1,124 @@
+"""Checking that every password of a vault can still be decrypted"""
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.fernet import InvalidToken
+from qpassword_manager.crypto import VaultCipher
+
+# entries read and checked at once
+BATCH_SIZE = 5000
+
+# VaultCipher of a worker process, built once by init_worker
+WORKER_CIPHER = {}
+
+
+def corrupt_ids(cipher, tokens) -> list:
+    """Returns the ids of (id, password) pairs whose password can't be
+    authenticated"""
+
+    corrupt = []
+    for entry_id, password in tokens:
+        try:
+            cipher.decrypt(password)
+        except (InvalidToken, ValueError, TypeError):
+            corrupt.append(entry_id)
+    return corrupt
+
+
+def init_worker(key) -> None:
+    """Builds the cipher of a worker process"""
+
+    WORKER_CIPHER["cipher"] = VaultCipher(key)
+
+
+def check_tokens(tokens) -> list:
+    """corrupt_ids with the cipher of the worker process"""
+
+    return corrupt_ids(WORKER_CIPHER["cipher"], tokens)
+
+
+def verify(backend, auth, cipher, *, batch_size=BATCH_SIZE, workers=None):
+    """
+    Checks the storage of a vault and authenticates every ciphertext
+
+    Entries are streamed in batches of batch_size and checked by a pool of
+    worker processes, one per core, while the next batch is read. The pool
+    is only started once there is more than one batch.
+
+    Parameters:
+        backend (Backend): backend of the vault
+        auth: username and hashed master key
+        cipher (VaultCipher): cipher of the user
+        batch_size (int): entries read and checked at once
+        workers (int): number of processes, the number of cores if None
+
+    Returns:
+        dict: "entries" number of checked entries, "corrupt" ids of the
+            entries that can't be decrypted and "storage" problems found
+            by Backend.check_storage
+    """
+
+    workers = workers or os.cpu_count() or 1
+    result = {
+        "entries": 0,
+        "corrupt": [],
+        "storage": backend.check_storage(auth),
+    }
+
+    pool = None
+    first = None
+    pending = deque()
+    try:
+        for batch in backend.stream_all(auth, batch_size, True):
+            tokens = [(entry[0], entry[3]) for entry in batch]
+            result["entries"] += len(tokens)
+            if workers == 1:
+                result["corrupt"].extend(corrupt_ids(cipher, tokens))
+                continue
+
+            if first is None:
+                first = tokens
+                continue
+
+            if pool is None:
+                pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_worker,
+                    initargs=(cipher.key,),
+                )
+                pending.append(pool.submit(check_tokens, first))
+
+            if len(pending) >= 2 * workers:
+                result["corrupt"].extend(pending.popleft().result())
+            pending.append(pool.submit(check_tokens, tokens))
+
+        if pool is None and first is not None:
+            result["corrupt"].extend(corrupt_ids(cipher, first))
+        while pending:
+            result["corrupt"].extend(pending.popleft().result())
+    finally:
+        for future in pending:
+            future.cancel()
+        if pool is not None:
+            pool.shutdown()
+
+    result["corrupt"].sort()
+    return result
+
+
+def format_report(result) -> str:
+    """Returns a result of verify as text"""
+
+    lines = [f"Checked {result['entries']} entries"]
+    lines.extend(result["storage"])
+    if result["corrupt"]:
+        lines.append(
+            "Can't be decrypted: "
+            + ", ".join(str(entry_id) for entry_id in result["corrupt"])
+        )
+    else:
+        lines.append("Every password can be decrypted")
+    return "\n".join(lines)
@@ -1,7 +1,7 @@
 """QLineEdits in entry_input in password_table"""
 
-from PyQt5.QtCore import QEvent, Qt
-from PyQt5.QtWidgets import QLineEdit
+from PyQt5.QtCore import QEvent, QStringListModel, Qt
+from PyQt5.QtWidgets import QCompleter, QLineEdit
 
 
 class NewPasswordInput(QLineEdit):
@@ -44,3 +44,36 @@ class NewWebsiteInput(QLineEdit):
             return True
 
         return QLineEdit.event(self, event)
+
+
+class TrieCompleter(QCompleter):
+    """
+    QCompleter suggesting the most common words of a PrefixTrie that start
+    with the text of a QLineEdit
+
+    The model only holds the suggestions for the current text, it's
+    replaced on every edit instead of being filtered by QCompleter.
+
+    Attributes:
+        trie: PrefixTrie suggestions are looked up in
+    """
+
+    def __init__(self, trie, line_edit) -> None:
+        super().__init__(line_edit)
+        self.trie = trie
+        self.setModel(QStringListModel(self))
+        self.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.setCaseSensitivity(Qt.CaseInsensitive)
+        line_edit.setCompleter(self)
+        line_edit.textEdited.connect(self.suggest)
+
+    def suggest(self, text) -> None:
+        """Shows the suggestions for text, the line edit already asked for
+        the old ones before textEdited was emitted"""
+
+        words = self.trie.complete(text) if text else []
+        self.model().setStringList(words)
+        if words and words != [text]:
+            self.complete()
+        else:
+            self.popup().hide()
@@ -0,0 +1,178 @@
+"""Compact in-memory store for the entries shown in password_table"""
+
+import bisect
+import sys
+from qpassword_manager.crypto import decode_token, encode_token
+
+
+class Entry:  # pylint: disable=too-few-public-methods
+    """
+    One password entry
+
+    Website and username are interned because the same values repeat a
+    lot in a vault, the ciphertext is kept as raw bytes and is only loaded
+    when it's needed
+
+    Attributes:
+        entry_id: id in database, negative for entries that are only in
+            MainWindow.changes
+        website: website
+        username: username
+        password: encrypted password or None if it isn't loaded yet
+        password_length: length of the password if it's known
+        website_key: case folded website entries are sorted by
+        username_key: case folded username entries are sorted by
+    """
+
+    __slots__ = (
+        "entry_id",
+        "website",
+        "username",
+        "password",
+        "password_length",
+        "website_key",
+        "username_key",
+    )
+
+    def __init__(self, entry_id, website, username, password=None) -> None:
+        self.entry_id = entry_id
+        self.website = sys.intern(website)
+        self.username = sys.intern(username)
+        self.website_key = sys.intern(website.casefold())
+        self.username_key = sys.intern(username.casefold())
+        self.password = None
+        self.password_length = None
+
+        if isinstance(password, int):
+            self.password_length = password
+        else:
+            self.set_password(password)
+
+    def set_password(self, password) -> None:
+        """Sets the encrypted password, passed in any form accepted by
+        decode_token"""
+
+        self.password = None if password is None else decode_token(password)
+
+    def to_list(self) -> [str, str, str]:
+        """Returns website, username and password the way they are stored
+        in MainWindow.changes"""
+
+        return [self.website, self.username, encode_token(self.password)]
+
+
+class EntryStore:
+    """
+    Entries in the order they are shown in the table
+
+    Once sorted, the sort key of every entry is kept in a list next to the
+    entries, so the row of an inserted entry is found by binary search
+    instead of sorting again.
+
+    Attributes:
+        entries: list of Entry objects, one for every row in the table
+        sort_key: function of an entry the entries are sorted by, None if
+            they aren't sorted
+    """
+
+    __slots__ = ("entries", "sort_key", "_rows", "_keys")
+
+    def __init__(self) -> None:
+        self.entries = []
+        self.sort_key = None
+        self._rows = None
+        self._keys = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, row) -> Entry:
+        return self.entries[row]
+
+    def __setitem__(self, row, entry) -> None:
+        self.entries[row] = entry
+        if self._keys is not None:
+            self._keys[row] = self.sort_key(entry)
+        self._rows = None
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def load(self, rows) -> None:
+        """
+        Replaces all entries
+
+        Parameters:
+            rows: iterable of (id, website, username, password)
+        """
+
+        self.entries = [Entry(*row) for row in rows]
+        self.sort(self.sort_key)
+        self._rows = None
+
+    def sort(self, key) -> None:
+        """
+        Sorts entries and keeps them sorted
+
+        Parameters:
+            key: function of an entry returning a value unique to it, None
+                leaves the order as it is from now on
+        """
+
+        self.sort_key = key
+        self._rows = None
+        if key is None:
+            self._keys = None
+            return
+
+        self._keys = [key(entry) for entry in self.entries]
+        order = sorted(range(len(self.entries)), key=self._keys.__getitem__)
+        self.entries = [self.entries[row] for row in order]
+        self._keys = [self._keys[row] for row in order]
+
+    def position(self, entry) -> int:
+        """Returns the row entry belongs in, the end if entries aren't
+        sorted"""
+
+        if self._keys is None:
+            return len(self.entries)
+        return bisect.bisect_left(self._keys, self.sort_key(entry))
+
+    def id_position(self, entry_id, low, high) -> int:
+        """Returns the row between low and high an entry with entry_id
+        belongs in, for rows that are ordered by id there"""
+
+        while low < high:
+            middle = (low + high) // 2
+            if self.entries[middle].entry_id < entry_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def insert(self, row, entry) -> None:
+        """Inserts entry before row, which has to be position(entry) if
+        entries are sorted"""
+
+        self.entries.insert(row, entry)
+        if self._keys is not None:
+            self._keys.insert(row, self.sort_key(entry))
+        self._rows = None
+
+    def pop(self, row) -> Entry:
+        """Removes and returns entry in row"""
+
+        self._rows = None
+        if self._keys is not None:
+            self._keys.pop(row)
+        return self.entries.pop(row)
+
+    def row_of(self, entry_id) -> int:
+        """Returns row of the entry with entry_id or -1 if there is none"""
+
+        if self._rows is None:
+            self._rows = {
+                entry.entry_id: row for row, entry in enumerate(self.entries)
+            }
+
+        return self._rows.get(entry_id, -1)
@@ -0,0 +1,42 @@
+"""Advisory locks on whole files shared between processes"""
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+def lock(file, shared=False) -> None:
+    """
+    Waits for a lock on an open file
+
+    On Windows the lock is always exclusive, elsewhere without fcntl
+    nothing is locked
+
+    Parameters:
+        file: file object
+        shared (bool): take a shared lock instead of an exclusive one
+    """
+
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    elif msvcrt is not None:
+        # msvcrt locks bytes from the current position, writes to files
+        # opened for appending go to the end anyway
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def unlock(file) -> None:
+    """Releases a lock taken by lock"""
+
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
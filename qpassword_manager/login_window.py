@@ -2,20 +2,19 @@
 
 import os
 import logging
-import base64
 import json
 from xdg.BaseDirectory import xdg_config_home
 from Crypto.Hash import SHA256
 from PyQt5.QtWidgets import QWidget, QGridLayout, QLineEdit, QPushButton
 from PyQt5.Qt import Qt
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from qpassword_manager.main_window import MainWindow
 from qpassword_manager.setup_window import SetupWindow
 from qpassword_manager.database.database_handler import DatabaseHandler
 from qpassword_manager.conf.settings import Settings
 from qpassword_manager.conf.connectorconfig import Config
+from qpassword_manager.profiling import Profiler
+from qpassword_manager.crypto import derive_key
+from qpassword_manager import agent
 
 
 class LoginWindow(QWidget):
@@ -24,11 +23,14 @@ class LoginWindow(QWidget):
 
     Attributes:
         key_input_hashed: hashed master key used for authentication
+        agent_key: derived key held by the agent for this user, None if
+            there is no agent or it doesn't have the user unlocked
     """
 
     def __init__(self) -> None:
         super().__init__()
         self.key_input_hashed = None
+        self.agent_key = None
 
         self.setWindowTitle("qpassword_manager")
         self.setFixedHeight(250)
@@ -118,12 +120,24 @@ class LoginWindow(QWidget):
             self.login_btn.setEnabled(True)
 
     def check_key(self) -> bool:
-        """Checks if name and master key pair is correct"""
+        """Checks if name and master key pair is correct, a user unlocked in
+        the agent is checked against the agent instead of the database"""
 
-        self.key_input_hashed = SHA256.new(self.key_input.text().encode())
-        credentials_match = self.database_handler.check_credentials(
-            self.name_input.text(), self.key_input_hashed.hexdigest()
-        )
+        with Profiler.span("credential_check"):
+            self.key_input_hashed = SHA256.new(self.key_input.text().encode())
+
+            unlocked = agent.request("key", username=self.name_input.text())
+            if (
+                unlocked
+                and unlocked.get("auth") == self.key_input_hashed.hexdigest()
+            ):
+                self.agent_key = unlocked["key"].encode()
+                return True
+
+            self.agent_key = None
+            credentials_match = self.database_handler.check_credentials(
+                self.name_input.text(), self.key_input_hashed.hexdigest()
+            )
 
         logging.debug(self.name_input.text())
         logging.debug(self.key_input_hashed.hexdigest())
@@ -134,13 +148,17 @@ class LoginWindow(QWidget):
     def login(self) -> None:
         """opens MainWindow if check_key returns True"""
 
-        if self.check_key():
+        Profiler.snapshot("login")
+        with Profiler.span("login"):
+            if not self.check_key():
+                return
+
             self.w_main = MainWindow(self)
             self.w_main.show()
 
-            self.key_input.setText("")
-            self.key_input.setFocus()
-            self.hide()
+        self.key_input.setText("")
+        self.key_input.setFocus()
+        self.hide()
 
     def new_user(self) -> None:
         """Opens SetupWindow"""
@@ -149,15 +167,19 @@ class LoginWindow(QWidget):
         self.w_setup.show()
 
     def get_key(self) -> bytes:
-        """Creates key for Fernet using plain text master key"""
-
-        password = self.key_input.text().encode()
-        salt = b"sw\xea\x01\x9d\x109\x0eF\xef/\n\xb0mWK"
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=10000,
-            backend=default_backend(),
+        """Creates key for Fernet using plain text master key and hands it
+        to the agent if one is running"""
+
+        if self.agent_key is not None:
+            return self.agent_key
+
+        with Profiler.span("key_derivation"):
+            key = derive_key(self.key_input.text())
+
+        agent.request(
+            "add",
+            username=self.name_input.text(),
+            auth=self.key_input_hashed.hexdigest(),
+            key=key.decode(),
         )
-        return base64.urlsafe_b64encode(kdf.derive(password))
+        return key
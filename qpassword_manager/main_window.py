@@ -5,32 +5,65 @@ import os
 import time
 import threading
 import json
+import sqlite3
 from PyQt5.QtWidgets import (
     QWidget,
     QGridLayout,
     QLineEdit,
 )
 from PyQt5.Qt import Qt
-from PyQt5 import QtCore
-from cryptography.fernet import Fernet
-import pyperclip
+from PyQt5.QtCore import QTimer
 from qpassword_manager.password_table import PasswordTable
+from qpassword_manager.entry_store import Entry
 from qpassword_manager.messagebox import MessageBox
-
-
-class MainWindow(QWidget):
+from qpassword_manager.profiling import Profiler
+from qpassword_manager.clipboard import Clipboard
+from qpassword_manager.crypto import VaultCipher
+from qpassword_manager.audit import PasswordAudit, format_report
+from qpassword_manager.completion import CompletionIndex
+from qpassword_manager import backup
+from qpassword_manager.database import verify
+from qpassword_manager.database.database_handler import DatabaseHandler
+from qpassword_manager import agent
+from qpassword_manager import usage
+
+
+class MainWindow(QWidget):  # pylint: disable=too-many-public-methods
     """
     The window used for copying passwords from database
 
     Attributes:
-        fernet: Fernet object used for decryption
+        cipher: VaultCipher object used for encryption and decryption
         login_window: LoginWindow
+        audit: PasswordAudit of the vault, stored between sessions and
+            updated in the background after login and with every commit
+        completion: CompletionIndex entry_input is completed from, updated
+            with the audit and with every change
     """
 
+    # entries listed and audited per tick of audit_timer
+    audit_batch_size = 100
+
+    # milliseconds after a use until the usage scores are stored, uses
+    # in between are stored together
+    usage_save_delay = 5000
+
     def __init__(self, login_window) -> None:
         super().__init__()
 
-        self.fernet = None
+        self.cipher = None
+        self.audit = None
+        self.usage = None
+        self.completion = CompletionIndex()
+        self.audit_stream = None
+        self.audit_timer = QTimer()
+        self.audit_timer.setInterval(10)
+        self.audit_timer.timeout.connect(self.audit_step)
+        self.usage_timer = QTimer()
+        self.usage_timer.setSingleShot(True)
+        self.usage_timer.setInterval(self.usage_save_delay)
+        self.usage_timer.timeout.connect(self.save_usage)
+        self.search_limit = 1000
         self.login_window = login_window
         self.database_handler = login_window.database_handler
 
@@ -59,12 +92,22 @@ class MainWindow(QWidget):
         )
 
         self.set_key(self.login_window.get_key())
-        self.table.fill_table()
 
         self.changes = []
         self.load_changes()
+        if self.database_handler.config.get("table_order") in (
+            self.table.sort_orders
+        ):
+            self.table.sort_column = self.database_handler.config["table_order"]
+        self.table.fill_table()
+        self.start_audit()
+        self.backup_thread = None
+        self.start_backup()
 
         self.messagebox = MessageBox("Save changes?", self)
+        self.sync_message = None
+        self.audit_message = None
+        self.verify_message = None
 
         self.last_event_time = 0
         self.checking_inactivity = threading.Thread(
@@ -74,28 +117,89 @@ class MainWindow(QWidget):
 
     def set_key(self, key) -> None:
         """
-        Creates Fernet object using a key
+        Creates VaultCipher object using a key
 
         Parameters:
-            key: key used for creating a Fernet object
+            key: key used for creating a VaultCipher object
         """
 
-        self.fernet = Fernet(key)
+        config = self.database_handler.config
+        self.cipher = VaultCipher(key)
+        self.audit = PasswordAudit(
+            self.cipher,
+            usage.store_path(self.auth[0], config, "audit"),
+            self.audit_password,
+        )
+        self.audit.load()
+        self.usage = usage.UsageRanking(
+            usage.store_path(self.auth[0], config), self.cipher
+        )
+        self.usage.load()
 
     def search(self) -> list:
-        """Searches trough the table and returns a list of results"""
+        """
+        Searches trough the table and returns a list of results
+
+        A table that has every entry is searched in memory, otherwise the
+        database is and results that aren't loaded yet are inserted
+        where they belong without loading the rows before them
+        """
 
         search_string = self.search_input.text()
 
         if not search_string:
             return []
 
-        items = self.table.findItems(
-            ".*" + search_string + ".*", QtCore.Qt.MatchRegExp
+        query = search_string.casefold()
+        if self.table.all_loaded:
+            rows = [
+                row
+                for row, entry in enumerate(self.table.entries)
+                if query in entry.website_key or query in entry.username_key
+            ]
+        else:
+            rows = self.search_database(search_string)
+
+        # the most used entries first, the rest in the order of the table
+        rows = sorted(
+            (row for row in sorted(rows) if row != -1),
+            key=lambda row: -self.usage.key(self.table.entries[row].entry_id),
         )
-        items.sort(key=lambda x: x.row())
+
+        items = []
+        for row in rows:
+            entry = self.table.entries[row]
+            if query in entry.website.casefold():
+                items.append(self.table.item(row, 0))
+            if query in entry.username.casefold():
+                items.append(self.table.item(row, 1))
+
         return items
 
+    def search_database(self, search_string) -> list:
+        """Returns rows of the entries matching search_string in database
+        and of the changed ones, inserting results that aren't loaded"""
+
+        changed = {change[2] for change in self.changes if change[0] == 2}
+        results = self.database_handler.search(
+            search_string, self.auth, self.search_limit
+        )
+        if not self.table.insert_mode()[0]:
+            self.table.insert_rows(results or [])
+
+        rows = [
+            self.table.entries.row_of(entry_id)
+            for entry_id, _, _ in results or []
+            if entry_id not in changed
+        ]
+        for i, change in enumerate(self.changes):
+            if change[0] == 1:
+                rows.append(self.table.entries.row_of(-i - 1))
+            elif change[0] == 2:
+                rows.append(self.table.entries.row_of(change[2]))
+
+        return rows
+
     def select(self) -> None:
         """Selects search results"""
 
@@ -109,33 +213,267 @@ class MainWindow(QWidget):
         """Appends to self.changes"""
 
         self.changes.append(change)
-        if change[0]:
-            self.table.entry_ids.append(len(self.changes) * -1)
 
-    def commit_changes(self) -> None:
-        """Commits changes to database"""
+    def save_entry_input(self) -> None:
+        """Adds values from entry_input to changes and to the table"""
+
+        row = self.table.entry_row_index
+        entry_input = self.table.get_entry_input(self.cipher)
+
+        if self.table.entry_input_mode == 1:
+            self.add_to_changes([1, entry_input, 0])
+            entry = Entry(-len(self.changes), *entry_input)
+
+        else:
+            entry = Entry(self.table.entries[row].entry_id, *entry_input)
+            if entry.entry_id < 0:
+                self.changes[-entry.entry_id - 1][1] = entry_input
+            else:
+                self.add_to_changes([2, entry_input, entry.entry_id])
+            self.table.entries.pop(row)
+
+        self.completion.set(entry.entry_id, entry.website, entry.username)
+        self.table.removeRow(row)
+        self.table.touch(entry.entry_id)
+        self.table.insert_entry(entry, row)
+        self.table.setFocus()
+
+    def commit_changes(self) -> bool:
+        """
+        Commits changes to database
+
+        Stops at the first change that fails, it and the changes after it
+        stay in self.changes
+
+        Returns:
+            bool: True if all changes were committed
+        """
 
         current_cell = (self.table.currentRow(), self.table.currentColumn())
 
+        committed = 0
+        removed = []
         for change in self.changes:
-            if change[0] == -1:
-                continue
-
             if change[0] == 1:
-                self.database_handler.add_to_database(*change[1], self.auth)
-                continue
-
-            if change[0] == 2:
-                self.database_handler.update_entry(
+                done = self.database_handler.add_to_database(
+                    *change[1], self.auth
+                )
+            elif change[0] == 2:
+                done = self.database_handler.update_entry(
                     change[2], *change[1], self.auth
                 )
-                continue
-
-            self.database_handler.remove_from_database(change[2], self.auth)
+            elif change[0] == 0:
+                done = self.database_handler.remove_from_database(
+                    change[2], self.auth
+                )
+            else:
+                done = True
 
+            if not done:
+                break
+            committed += 1
+            if change[0] == 0:
+                removed.append(change[2])
+
+        if self.changes and not committed:
+            return False
+
+        self.audit_changes(self.changes[:committed])
+        del self.changes[:committed]
+        if removed:
+            self.usage.remove(removed)
+            self.save_usage()
         self.table.fill_table()
+        while (
+            self.table.rowCount() <= current_cell[0] and self.table.fetch_more()
+        ):
+            pass
         self.table.setCurrentCell(*current_cell)
-        self.changes.clear()
+        agent.request("invalidate", username=self.auth[0])
+        self.start_backup()
+        Profiler.snapshot("commit")
+
+        return not self.changes
+
+    def sync(self) -> None:
+        """Commits changes and merges the vault with the one on the other
+        side, the server if the vault is offline and the offline one
+        otherwise"""
+
+        if not self.commit_changes():
+            return
+
+        config = self.database_handler.config
+        other = DatabaseHandler(
+            {**config, "database_online": not config["database_online"]}
+        )
+        result = self.database_handler.sync_with(other, self.auth, self.cipher)
+        if result is None:
+            return
+
+        self.table.fill_table()
+        self.start_audit()
+        message = (
+            f"Added {result['pushed']} entries to the other vault and "
+            f"{result['pulled']} to this one."
+        )
+        if result["removed_remote"] or result["removed_local"]:
+            message += (
+                f" Removed {result['removed_remote']} entries from the other "
+                f"vault and {result['removed_local']} from this one."
+            )
+        if result["conflicts"]:
+            message += " Entries that differ: " + ", ".join(
+                f"{website} ({username})"
+                for website, username in result["conflicts"]
+            )
+        self.sync_message = MessageBox(message)
+        self.sync_message.show()
+
+    def verify(self) -> None:
+        """Checks the vault, flags the rows of entries that can't be
+        decrypted and shows what was found"""
+
+        result = self.database_handler.verify(self.auth, self.cipher)
+        if result is None:
+            return
+
+        self.table.flag_corrupt(result["corrupt"])
+        self.verify_message = MessageBox(verify.format_report(result))
+        self.verify_message.show()
+
+    def start_backup(self) -> None:
+        """Takes a snapshot of an offline vault in a background thread if
+        the last one is older than backup_interval"""
+
+        config = self.database_handler.config
+        if (
+            self.backup_thread is not None and self.backup_thread.is_alive()
+        ) or not backup.backup_due(self.auth[0], config):
+            return
+
+        def run():
+            try:
+                snapshot, written = backup.backup(
+                    self.auth[0], config, self.cipher
+                )
+                logging.info("backup %s, %d bytes written", snapshot, written)
+            except (OSError, ValueError, sqlite3.Error) as error:
+                logging.warning("backup failed: %s", error)
+
+        self.backup_thread = threading.Thread(target=run, daemon=True)
+        self.backup_thread.start()
+
+    def start_audit(self) -> None:
+        """Starts a pass updating the audit and completion. The vault is
+        listed without passwords unless it was never audited, only the
+        passwords of entries changed since their audit are fetched."""
+
+        if self.audit_stream is not None:
+            self.audit_stream.close()
+
+        self.audit.begin(self.database_handler.modification_order(self.auth))
+        self.completion.begin()
+        self.audit_stream = self.database_handler.stream_all(
+            self.auth, self.audit_batch_size, not self.audit.entries
+        )
+        self.audit_timer.start()
+
+    def audit_password(self, entry_id) -> str:
+        """Returns the ciphertext of an entry for the audit, None if it
+        can't be read"""
+
+        data = self.database_handler.get_entry(entry_id, self.auth)
+        return data[2] if data else None
+
+    def audit_changes(self, changes) -> None:
+        """Applies committed changes to the audit and completion, the
+        vault is only listed again to find the ids of added entries"""
+
+        for change in changes:
+            if change[0] == 2:
+                self.audit.queue(change[2], *change[1])
+            elif change[0] == 0:
+                self.audit.remove(change[2])
+
+        # ids of uncommitted additions moved down with the committed ones
+        for entry_id in [i for i in self.completion.entries if i < 0]:
+            self.completion.remove(entry_id)
+        self.complete_changes()
+
+        if any(change[0] == 1 for change in changes):
+            self.start_audit()
+        elif self.audit.pending:
+            self.audit_timer.start()
+
+    def audit_step(self) -> None:
+        """Lists and audits the next batch of entries, stops audit_timer
+        once everything is audited"""
+
+        with Profiler.span("audit"):
+            if self.audit_stream is not None:
+                batch = self.database_handler.next_batch(self.audit_stream)
+                if batch:
+                    self.audit.update(batch)
+                    self.completion.update(batch)
+                else:
+                    self.audit_stream = None
+                    self.audit.end()
+                    self.completion.end()
+                    self.complete_changes()
+
+            if not self.audit.step(self.audit_batch_size) and (
+                self.audit_stream is None
+            ):
+                self.audit_timer.stop()
+                self.save_audit()
+
+    def complete_changes(self) -> None:
+        """Applies changes that aren't committed to completion"""
+
+        for i, change in enumerate(self.changes):
+            if change[0] == 1:
+                self.completion.set(-i - 1, *change[1][:2])
+            elif change[0] == 2:
+                self.completion.set(change[2], *change[1][:2])
+            elif change[0] == 0:
+                self.completion.remove(change[2])
+
+    def show_audit(self) -> None:
+        """Shows reused, duplicate and weak passwords found so far"""
+
+        message = format_report(self.audit.report())
+        if self.audit_timer.isActive():
+            message = "Audit isn't finished yet\n" + message
+        self.audit_message = MessageBox(message)
+        self.audit_message.show()
+
+    def record_use(self, row) -> None:
+        """Counts a use of the entry in row for ranking"""
+
+        entry = self.table.entries[row]
+        self.usage.record(entry.entry_id)
+        if not self.usage_timer.isActive():
+            self.usage_timer.start()
+        if self.table.sort_column == "used":
+            self.table.reposition(row)
+
+    def save_audit(self) -> None:
+        """Stores the audit results"""
+
+        try:
+            self.audit.save()
+        except OSError as error:
+            logging.warning("audit couldn't be stored: %s", error)
+
+    def save_usage(self) -> None:
+        """Stores the usage scores"""
+
+        self.usage_timer.stop()
+        try:
+            self.usage.save()
+        except OSError as error:
+            logging.warning("usage couldn't be stored: %s", error)
 
     def store_changes(self) -> None:
         """Stores changes to a file and clears the array"""
@@ -143,29 +481,27 @@ class MainWindow(QWidget):
         if self.changes:
             with open("changes_" + self.auth[0], "wb+") as changes_file:
                 changes_file.write(
-                    self.fernet.encrypt(json.dumps(self.changes).encode())
+                    self.cipher.encrypt(json.dumps(self.changes).encode())
                 )
 
             self.changes.clear()
 
     def load_changes(self) -> None:
-        """Loads changes stored in a file"""
+        """Loads changes stored in a file, PasswordTable.fill_table applies
+        them to the entries. Older versions stored a removed pending entry
+        as -1 instead of [-1]."""
 
         if os.path.exists("changes_" + self.auth[0]):
             with open("changes_" + self.auth[0], "rb") as changes_file:
-                self.changes = json.loads(
-                    self.fernet.decrypt(changes_file.read())
-                )
+                self.changes = [
+                    [change] if isinstance(change, int) else change
+                    for change in json.loads(
+                        self.cipher.decrypt(changes_file.read())
+                    )
+                ]
 
             os.remove("changes_" + self.auth[0])
 
-            for change in self.changes:
-                if change[0]:
-                    self.table.fill_row(change[1])
-
-                else:
-                    self.table.removeRow(change[1])
-
     def run_cmd(self) -> None:
         """Runs the command in cmd_input"""
 
@@ -179,9 +515,24 @@ class MainWindow(QWidget):
             self.close()
 
         elif cmd == "wq":
-            self.commit_changes()
+            if not self.commit_changes():
+                self.store_changes()
             self.close()
 
+        elif cmd == "audit":
+            self.show_audit()
+
+        elif cmd == "sync":
+            self.sync()
+
+        elif cmd == "verify":
+            self.verify()
+
+        elif cmd == "sort" or (
+            cmd.startswith("sort ") and cmd[5:] in self.table.sort_orders
+        ):
+            self.table.sort_by(cmd[5:] or None)
+
         elif cmd == "q!":
             self.changes.clear()
             self.close()
@@ -195,46 +546,29 @@ class MainWindow(QWidget):
             if self.table.hasFocus():
                 if self.table.selectedIndexes()[0].column() != 2:
                     logging.debug(self.table.selectedItems()[0].text())
-                    pyperclip.copy(self.table.selectedItems()[0].text())
+                    Clipboard.copy(self.table.selectedItems()[0].text())
+                    self.record_use(self.table.selectedIndexes()[0].row())
 
                 else:
-                    pyperclip.copy(
-                        self.fernet.decrypt(
-                            self.table.data[
-                                self.table.selectedIndexes()[0].row()
-                            ][2].encode()
-                        ).decode()
+                    password = self.table.decrypt_password(
+                        self.table.selectedIndexes()[0].row()
                     )
+                    if password is not None:
+                        Clipboard.copy(
+                            password,
+                            self.database_handler.config.get(
+                                "clipboard_timeout", 30
+                            ),
+                        )
+                        self.record_use(self.table.selectedIndexes()[0].row())
 
             elif all(self.table.insert_mode()):
                 if self.table.check_entry_input():
-                    self.add_to_changes(
-                        [
-                            self.table.entry_input_mode,
-                            self.table.get_entry_input(self.fernet),
-                            self.table.entry_ids[self.table.currentRow()]
-                            if self.table.entry_input_mode == 2
-                            else 0,
-                        ]
-                    )
-                    self.table.fill_row(
-                        self.table.get_entry_input(self.fernet),
-                        self.table.currentRow() + 1,
-                    )
-                    self.table.removeRow(self.table.entry_row_index)
-                    self.table.setFocus()
-                    if self.table.entry_input_mode == 1:
-                        self.table.data.append(
-                            self.table.get_entry_input(self.fernet)
-                        )
-                    else:
-                        self.table.data[
-                            self.table.currentRow()
-                        ] = self.table.get_entry_input(self.fernet)
+                    self.save_entry_input()
 
             else:
                 self.search_input.hide()
-                self.table.search_next_prev('n', self.search())
+                self.table.search_next_prev("n", self.search())
                 self.run_cmd()
                 self.cmd_input.hide()
 
@@ -266,7 +600,8 @@ class MainWindow(QWidget):
         """
 
         if choice:
-            self.commit_changes()
+            if not self.commit_changes():
+                self.store_changes()
             self.close()
         else:
             self.changes.clear()
@@ -298,6 +633,8 @@ class MainWindow(QWidget):
         empty, otherwise open messagebox"""
 
         if not self.changes:
+            if self.usage_timer.isActive():
+                self.save_usage()
             event.accept()
             self.login_window.show()
         else:
@@ -3,9 +3,9 @@
 import json
 import logging
 
-import pyperclip
-from PyQt5.QtCore import QEvent, Qt
-from PyQt5.QtGui import QKeyEvent
+from cryptography.fernet import InvalidToken
+from PyQt5.QtCore import QEvent, Qt, QTimer
+from PyQt5.QtGui import QBrush, QKeyEvent
 from PyQt5.QtWidgets import (
     QTableWidget,
     QLineEdit,
@@ -14,18 +14,41 @@ from PyQt5.QtWidgets import (
     QAbstractItemView,
     QApplication,
 )
-from qpassword_manager.entry_input import NewPasswordInput, NewWebsiteInput
+from qpassword_manager.entry_input import (
+    NewPasswordInput,
+    NewWebsiteInput,
+    TrieCompleter,
+)
+from qpassword_manager.entry_store import Entry, EntryStore
+from qpassword_manager.profiling import Profiler
+from qpassword_manager.crypto import encode_token
+from qpassword_manager.clipboard import Clipboard
+
+
+# shown for passwords whose length isn't known, like ones stored before
+# lengths were kept, without looking like a length itself
+UNKNOWN_LENGTH = "\u2022\u2022\u2022"
 
 
-class PasswordTable(QTableWidget):
+class PasswordTable(QTableWidget):  # pylint: disable=too-many-public-methods
     """
     Reimplementation of QTableWidget class
 
     Attributes:
         keybinds: dictionary for keybind translations
-        keyboard: controller that sends keys
+        entries: EntryStore with an entry for every row
+        corrupt: ids of entries whose password can't be decrypted, found
+            while filling the table or by MainWindow.verify
+        sort_column: one of sort_orders the rows are sorted by, None for
+            the order of the database
+        modified_order: number by entry id that is higher for entries
+            changed later, loaded when rows are sorted by modified
     """
 
+    # what the first two columns sort by
+    sort_columns = ("website", "username")
+    sort_orders = ("website", "username", "modified", "used")
+
     def __init__(self, window) -> None:
         super().__init__()
         self.window = window
@@ -42,11 +65,31 @@ class PasswordTable(QTableWidget):
         self.current_index = 0
         self.setTabKeyNavigation(False)
 
-        self.entry_ids = []
+        self.entries = EntryStore()
+        self.corrupt = set()
+        self.page_size = 100
+        self.load_size = 1000
+        self.page_cursor = None
+        self.all_loaded = False
+        self.loading = False
+        self.fetch_timer = QTimer()
+        self.fetch_timer.setSingleShot(True)
+        self.fetch_timer.timeout.connect(self.fetch_more)
+        self.stream = None
+        self.stream_timer = QTimer()
+        self.stream_timer.setInterval(10)
+        self.stream_timer.timeout.connect(self.drain_stream)
+        self.verticalScrollBar().valueChanged.connect(self.scrolled)
+        self.horizontalHeader().setSectionsClickable(True)
+        self.horizontalHeader().sectionClicked.connect(self.header_clicked)
+
+        self.sort_column = None
+        self.modified_order = {}
+        self.next_modified = 1
+
         self.entry_row_index = 0
         self.entry_input = None
         self.entry_input_mode = 0
-        self.data = None
 
     def event(self, event) -> bool:
         """Handles keys for navigation"""
@@ -63,7 +106,7 @@ class PasswordTable(QTableWidget):
 
         return QTableWidget.event(self, event)
 
-    def keyboardSearch(  # pylint: disable=invalid-name, too-many-branches
+    def keyboardSearch(  # pylint: disable=invalid-name, too-many-branches, too-many-statements
         self, key
     ) -> None:
         """Handles keys based on keybinds"""
@@ -78,6 +121,10 @@ class PasswordTable(QTableWidget):
             self.window.select()
 
         elif key in ["g", "G"]:
+            if key == "G":
+                while self.fetch_more():
+                    pass
+
             self.setCurrentCell(
                 0 if key == "g" else self.rowCount() - 1, self.currentColumn()
             )
@@ -96,47 +143,42 @@ class PasswordTable(QTableWidget):
 
         elif key in ["c", "C"]:
             row = self.currentRow()
-            current_entry = self.window.database_handler.get_entry(
-                self.entry_ids[row], self.window.auth
-            )
 
-            if current_entry is not None:
+            if 0 <= row < len(self.entries) and (
+                (password := self.decrypt_password(row)) is not None
+            ):
+                current_entry = self.entries[row]
                 self.removeRow(row)
                 self.add_row(row)
 
-                for i in range(2):
-                    self.entry_input[i].setText(current_entry[i])
-
-                self.entry_input[2].setText(
-                    self.window.fernet.decrypt(
-                        current_entry[2].encode()
-                    ).decode()
-                )
+                self.entry_input[0].setText(current_entry.website)
+                self.entry_input[1].setText(current_entry.username)
+                self.entry_input[2].setText(password)
                 self.entry_input_mode = 2
 
         elif key in ["y", "Y"]:
-            entry_id = self.entry_ids[self.currentRow()]
-            pyperclip.copy(
-                json.dumps(
-                    self.window.database_handler.get_entry(
-                        entry_id, self.window.auth
-                    )
-                    if entry_id >= 0
-                    else self.window.changes[-entry_id - 1][1]
+            if 0 <= self.currentRow() < len(self.entries) and (
+                self.entry_password(self.currentRow())
+            ):
+                Clipboard.copy(
+                    json.dumps(self.entries[self.currentRow()].to_list())
                 )
-            )
 
         elif key in ["p", "P"]:
-            self.fill_row(json.loads(pyperclip.paste()))
-            self.window.add_to_changes([1, json.loads(pyperclip.paste())])
+            row = json.loads(Clipboard.paste())
+            self.window.add_to_changes([1, row, 0])
+            self.window.completion.set(-len(self.window.changes), *row[:2])
+            self.touch(-len(self.window.changes))
+            self.insert_entry(Entry(-len(self.window.changes), *row))
 
         elif key in ["d", "D"]:
-            if self.entry_ids:
-                entry_id = self.entry_ids[self.currentRow()]
+            if self.entries:
+                entry_id = self.entries[self.currentRow()].entry_id
+                self.window.completion.remove(entry_id)
                 if entry_id < 0:
-                    self.window.changes[-entry_id - 1] = -1
+                    self.window.changes[-entry_id - 1] = [-1]
 
-                    while self.window.changes[-1] == -1:
+                    while self.window.changes[-1][0] == -1:
                         self.window.changes.pop()
                         if not self.window.changes:
                             break
@@ -144,7 +186,7 @@ class PasswordTable(QTableWidget):
                 else:
                     self.window.add_to_changes([0, self.currentRow(), entry_id])
 
-                self.entry_ids.pop(self.currentRow())
+                self.entries.pop(self.currentRow())
                 self.removeRow(self.currentRow())
 
     def stop_change(self) -> None:
@@ -153,14 +195,12 @@ class PasswordTable(QTableWidget):
         row_index = self.currentRow()
         column_index = self.currentColumn()
         self.removeRow(row_index)
-        row = self.window.database_handler.get_entry(
-            self.entry_ids[row_index], self.window.auth
-        )
-        self.fill_row(row, row_index)
+        self.fill_row(self.entries[row_index], row_index)
         self.setCurrentCell(row_index, column_index)
 
     def add_row(self, row) -> None:
-        """Adds a row with input entries"""
+        """Adds a row with input entries, website and username are
+        completed from MainWindow.completion"""
 
         if not self.insert_mode()[0]:
             self.entry_row_index = row
@@ -172,26 +212,350 @@ class PasswordTable(QTableWidget):
                 NewPasswordInput(),
             ]
 
+            TrieCompleter(self.window.completion.websites, self.entry_input[0])
+            TrieCompleter(self.window.completion.usernames, self.entry_input[1])
+
             for i in range(3):
                 self.setCellWidget(row, i, self.entry_input[i])
         self.focus_entry_input()
 
-    def fill_row(self, row, index=None) -> None:
-        """Fills table row with values from the list passed to it"""
+    def fill_row(self, entry, index=None, select=True) -> None:
+        """Fills table row with values from the entry passed to it"""
 
         if index is None:
             index = self.rowCount()
         self.insertRow(index)
-        for j in range(2):
-            self.setItem(index, j, (QTableWidgetItem(row[j])))
+        self.set_row(index, entry)
+        if select:
+            self.setCurrentCell(index, self.currentColumn())
+
+    def set_row(self, index, entry) -> None:
+        """Sets the items of an existing row to the values of entry"""
+
+        self.setItem(index, 0, QTableWidgetItem(entry.website))
+        self.setItem(index, 1, QTableWidgetItem(entry.username))
+        self.setItem(index, 2, self.password_item(entry))
+
+    def password_item(self, entry) -> QTableWidgetItem:
+        """Returns the item shown in the password column of an entry, a
+        password that can't be decrypted is flagged instead of shown and
+        one whose length isn't known gets a placeholder in grey"""
+
+        length = entry.password_length
+        if entry.password is not None:
+            try:
+                length = len(self.window.cipher.decrypt(entry.password))
+                self.corrupt.discard(entry.entry_id)
+            except InvalidToken:
+                self.corrupt.add(entry.entry_id)
+
+        if entry.entry_id not in self.corrupt:
+            if length is not None:
+                return QTableWidgetItem("*" * length)
+
+            item = QTableWidgetItem(UNKNOWN_LENGTH)
+            item.setForeground(QBrush(Qt.gray))
+            return item
+
+        item = QTableWidgetItem("can't be decrypted")
+        item.setForeground(QBrush(Qt.red))
+        return item
+
+    def flag_corrupt(self, entry_ids) -> None:
+        """Flags the rows of entries whose password can't be decrypted"""
+
+        for entry_id in entry_ids:
+            self.corrupt.add(entry_id)
+            row = self.entries.row_of(entry_id)
+            if row >= 0 and not self.cellWidget(row, 2):
+                self.setItem(row, 2, self.password_item(self.entries[row]))
+
+    def decrypt_password(self, row) -> str:
+        """Returns the decrypted password of the entry in row, None if it
+        can't be loaded or decrypted, in which case the row is flagged"""
+
+        password = self.entry_password(row)
+        if password is None:
+            return None
+
+        try:
+            return self.window.cipher.decrypt(password).decode()
+        except InvalidToken:
+            self.flag_corrupt([self.entries[row].entry_id])
+            return None
+
+    def entry_password(self, row) -> bytes:
+        """
+        Returns the encrypted password of the entry in row, getting it from
+        database if it wasn't loaded with the entry
 
-        row = "*" * len(self.window.fernet.decrypt(row[2].encode()))
-        self.setItem(index, 2, (QTableWidgetItem(row)))
-        self.setCurrentCell(index, self.currentColumn())
+        Returns:
+            bytes: encrypted password or None if it couldn't be loaded
+        """
+
+        entry = self.entries[row]
+        if entry.password is None:
+            data = self.window.database_handler.get_entry(
+                entry.entry_id, self.window.auth
+            )
+            if data is None:
+                return None
+            entry.set_password(data[2])
+
+        return entry.password
+
+    def insert_entry(self, entry, index=None, select=True) -> None:
+        """Adds entry to entries and fills a table row with it, at index
+        or where it belongs if rows are sorted"""
+
+        if index is None or self.entries.sort_key is not None:
+            index = self.entries.position(entry)
+        self.entries.insert(index, entry)
+        self.fill_row(entry, index, select)
+
+    def reposition(self, row) -> None:
+        """Moves the entry in row to where it belongs after its sort key
+        changed"""
+
+        entry = self.entries.pop(row)
+        self.removeRow(row)
+        self.insert_entry(entry, row)
+
+    def touch(self, entry_id) -> None:
+        """Marks an entry as the one changed last"""
+
+        self.modified_order[entry_id] = self.next_modified
+        self.next_modified += 1
+
+    def sort_key(self, column):
+        """Returns the function sorting entries by column, every key is
+        unique so an entry is found by binary search"""
+
+        if column == "website":
+            return lambda entry: (
+                entry.website_key,
+                entry.username_key,
+                entry.entry_id,
+            )
+        if column == "username":
+            return lambda entry: (
+                entry.username_key,
+                entry.website_key,
+                entry.entry_id,
+            )
+
+        if column == "used":
+            # see MainWindow.usage, unused entries come last by id
+            return lambda entry: (
+                -self.window.usage.key(entry.entry_id),
+                entry.entry_id,
+            )
+
+        # the entry changed last comes first
+        return lambda entry: (
+            -self.modified_order.get(entry.entry_id, 0),
+            -entry.entry_id,
+        )
+
+    def load_modification_order(self) -> None:
+        """Loads modified_order, uncommitted changes come after everything
+        in the database. Without an order from the database entries are
+        ordered by id, which is the order they were added in."""
+
+        order = self.window.database_handler.modification_order(
+            self.window.auth
+        )
+        if not order:
+            order = {
+                entry.entry_id: entry.entry_id
+                for entry in self.entries
+                if entry.entry_id > 0
+            }
+
+        self.modified_order = order
+        self.next_modified = max(order.values(), default=0) + 1
+        for i, change in enumerate(self.window.changes):
+            if change[0] == 1:
+                self.touch(-i - 1)
+            elif change[0] == 2:
+                self.touch(change[2])
+
+    def sort_by(self, column) -> bool:
+        """
+        Sorts rows by one of sort_orders, loading every entry first, None
+        goes back to the order of the database. Rows stay sorted as
+        entries are added and changed.
+
+        Returns:
+            bool: False if rows can't be sorted while an entry is edited
+        """
+
+        if self.insert_mode()[0]:
+            return False
+
+        self.sort_column = column
+        if column is None:
+            self.horizontalHeader().setSortIndicatorShown(False)
+            self.fill_table()
+            return True
+
+        with Profiler.span("table_sort", rows=len(self.entries)):
+            self.entries.sort(None)
+            while self.fetch_more(fill=False):
+                pass
+            if column == "modified":
+                self.load_modification_order()
+
+            row = self.currentRow()
+            current = (
+                self.entries[row] if 0 <= row < len(self.entries) else None
+            )
+            self.entries.sort(self.sort_key(column))
+
+            self.setRowCount(0)
+            self.setRowCount(len(self.entries))
+            for index, entry in enumerate(self.entries):
+                self.set_row(index, entry)
+
+        if column in self.sort_columns:
+            self.horizontalHeader().setSortIndicator(
+                self.sort_columns.index(column), Qt.AscendingOrder
+            )
+        self.horizontalHeader().setSortIndicatorShown(
+            column in self.sort_columns
+        )
+
+        if current is not None:
+            self.setCurrentCell(
+                self.entries.row_of(current.entry_id),
+                max(self.currentColumn(), 0),
+            )
+        return True
+
+    def header_clicked(self, column) -> None:
+        """Sorts rows by the clicked website or username column, clicking
+        the sorted column again goes back to the order of the database"""
+
+        if column < len(self.sort_columns):
+            name = self.sort_columns[column]
+            self.sort_by(None if self.sort_column == name else name)
+
+    def fetch_more(self, fill=True) -> bool:
+        """
+        Loads the next page of entries from database into the table, in
+        front of entries that are only in changes
+
+        Parameters:
+            fill (bool): if False entries are only added to entries, pages
+                of load_size entries are read and the caller fills the rows
+
+        Returns:
+            bool: False if nothing was loaded
+        """
+
+        if self.all_loaded or self.loading or self.insert_mode()[0]:
+            return False
+
+        self.loading = True
+        with Profiler.span("vault_load"):
+            if self.stream is not None:
+                rows = self.window.database_handler.next_batch(self.stream)
+            else:
+                page = self.window.database_handler.get_page(
+                    self.window.auth,
+                    self.page_cursor,
+                    self.page_size if fill else self.load_size,
+                    False,
+                )
+                rows = None
+                if page is not None:
+                    rows, self.page_cursor = page
+                    self.all_loaded = self.page_cursor is None
+
+        if rows is None:
+            self.all_loaded = True
+            self.loading = False
+            return False
+
+        with Profiler.span("table_fill", rows=len(rows)):
+            self.insert_rows(rows, fill)
+
+        self.loading = False
+        logging.debug(len(self.entries))
+        return True
+
+    def insert_rows(self, rows, fill=True) -> None:
+        """
+        Inserts entries from database where they belong by id, in front of
+        entries that are only in changes. Entries that are already in the
+        table, like search results shown before their page was loaded,
+        are skipped.
+
+        Parameters:
+            rows: (id, website, username, ...) ordered by id
+            fill (bool): if False entries are only added to entries
+        """
+
+        added, updated, removed = self.pending_changes()
+        end = len(self.entries) - added
+        index = 0
+        for row in rows:
+            if row[0] in removed:
+                continue
+
+            # rows that aren't sorted are in the order of ids
+            index = self.entries.id_position(row[0], index, end)
+            if index < end and self.entries[index].entry_id == row[0]:
+                continue
+
+            entry = Entry(row[0], *updated.get(row[0], row[1:]))
+            if fill:
+                self.insert_entry(entry, index, False)
+            else:
+                self.entries.insert(index, entry)
+            end += 1
+
+    def pending_changes(self) -> (int, dict, set):
+        """Returns the number of added entries, the values of updated
+        entries by id and the ids of removed entries in changes"""
+
+        updated = {}
+        removed = set()
+        added = 0
+        for change in self.window.changes:
+            if change[0] == 1:
+                added += 1
+            elif change[0] == 2:
+                updated[change[2]] = change[1]
+            elif change[0] == 0:
+                removed.add(change[2])
+
+        return added, updated, removed
+
+    def drain_stream(self) -> None:
+        """Adds the next streamed batch to the table, stops stream_timer
+        once the stream is exhausted"""
+
+        if not self.fetch_more() and self.all_loaded:
+            self.stream_timer.stop()
+
+    def scrolled(self, value) -> None:
+        """Loads the next page after the table is scrolled to the bottom,
+        once control is back in the event loop so rows aren't inserted
+        while another row is being filled"""
+
+        if value >= self.verticalScrollBar().maximum():
+            self.fetch_timer.start(0)
 
     def fill_table(self) -> None:
         """Updates data in the table"""
 
+        self.all_loaded = True
+        self.stream_timer.stop()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
         self.clear()
         self.setColumnCount(3)
         self.setRowCount(0)
@@ -199,8 +563,6 @@ class PasswordTable(QTableWidget):
         self.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
         self.setHorizontalHeaderLabels(["Website", "Username", "Password"])
-        self.data = self.window.database_handler.get_all(self.window.auth)
-        logging.debug(self.data)
 
         for i in range(3):
             self.setColumnWidth(i, 190)
@@ -209,15 +571,31 @@ class PasswordTable(QTableWidget):
         self.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.setSelectionMode(QTableWidget.SingleSelection)
 
-        for i, row in enumerate(self.data):
-            self.fill_row(row, i)
+        self.entries = EntryStore()
+        self.corrupt = set()
+        self.page_cursor = None
+
+        for i, change in enumerate(self.window.changes):
+            if change[0] == 1:
+                self.insert_entry(Entry(-i - 1, *change[1]), select=False)
+
+        self.all_loaded = False
+        if self.window.database_handler.config["database_online"]:
+            self.stream = self.window.database_handler.stream_all(
+                self.window.auth, self.page_size, False
+            )
+            self.stream_timer.start()
+
+        self.fetch_more()
 
         if self.rowCount():
             self.setCurrentCell(0, 0)
 
-        self.entry_ids = self.window.database_handler.get_entry_ids(
-            self.window.auth
-        )
+        if self.sort_column is not None:
+            self.sort_by(self.sort_column)
+
+        Profiler.snapshot("fill_table")
+        self.window.database_handler.cache.log_stats()
 
     def search_next_prev(self, key, items) -> None:
         """
@@ -267,13 +645,13 @@ class PasswordTable(QTableWidget):
             and self.entry_input[2].text() == self.entry_input[2].other_text
         )
 
-    def get_entry_input(self, fernet) -> [str, str, str]:
+    def get_entry_input(self, cipher) -> [str, str, str]:
         """Returns values from entry_input"""
 
         return [
             self.entry_input[0].text(),
             self.entry_input[1].text(),
-            fernet.encrypt(self.entry_input[2].text().encode()).decode(),
+            encode_token(cipher.encrypt(self.entry_input[2].text().encode())),
         ]
 
     def focus_entry_input(self) -> None:
@@ -0,0 +1,143 @@
+"""Profiling and tracing helpers enabled from the entry point"""
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profiler:
+    """
+    Collects cProfile stats, tracemalloc snapshots and Chrome trace spans
+
+    Attributes:
+        profile_file: file cProfile stats are dumped to, None if disabled
+        trace_memory: True if tracemalloc snapshots are taken
+        trace_file: file Chrome trace events are written to, None if disabled
+    """
+
+    profile_file = None
+    trace_memory = False
+    trace_file = None
+
+    _profile = None
+    _snapshot = None
+    _snapshot_count = 0
+    _events = []
+    _lock = threading.Lock()
+
+    @staticmethod
+    def start(profile_file=None, trace_memory=False, trace_file=None) -> None:
+        """
+        Enables the requested profilers
+
+        Parameters:
+            profile_file (str): file cProfile stats are dumped to
+            trace_memory (bool): take tracemalloc snapshots if True
+            trace_file (str): file Chrome trace events are written to
+        """
+
+        Profiler.profile_file = profile_file
+        Profiler.trace_memory = trace_memory
+        Profiler.trace_file = trace_file
+
+        if trace_memory:
+            tracemalloc.start(25)
+
+        if profile_file:
+            Profiler._profile = cProfile.Profile()
+            Profiler._profile.enable()
+
+    @staticmethod
+    def stop() -> None:
+        """Disables profilers and writes their output"""
+
+        if Profiler._profile is not None:
+            Profiler._profile.disable()
+            Profiler._profile.dump_stats(Profiler.profile_file)
+            stats = pstats.Stats(Profiler._profile, stream=sys.stderr)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(25)
+            Profiler._profile = None
+
+        if Profiler.trace_file:
+            with Profiler._lock:
+                events = list(Profiler._events)
+            with open(Profiler.trace_file, "w", encoding="utf8") as file:
+                file.write(
+                    json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+                )
+
+        if Profiler.trace_memory:
+            tracemalloc.stop()
+
+    @staticmethod
+    @contextmanager
+    def span(name, **args):
+        """
+        Records the time spent inside the with block as a Chrome trace
+        complete event
+
+        Parameters:
+            name (str): name of the span
+            args: extra values shown with the span in the trace viewer
+        """
+
+        if not Profiler.trace_file:
+            yield
+            return
+
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            event = {
+                "name": name,
+                "cat": "qpassword_manager",
+                "ph": "X",
+                "ts": start // 1000,
+                "dur": (end - start) // 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+            with Profiler._lock:
+                Profiler._events.append(event)
+
+    @staticmethod
+    def snapshot(label) -> None:
+        """
+        Dumps a tracemalloc snapshot and logs the biggest changes since
+        the previous one
+
+        Parameters:
+            label (str): name used in the snapshot file name
+        """
+
+        if not Profiler.trace_memory:
+            return
+
+        snapshot = tracemalloc.take_snapshot()
+        Profiler._snapshot_count += 1
+        snapshot.dump(
+            f"tracemalloc_{Profiler._snapshot_count:03d}_{label}.snapshot"
+        )
+
+        current, peak = tracemalloc.get_traced_memory()
+        logging.info("tracemalloc %s: current=%d peak=%d", label, current, peak)
+
+        if Profiler._snapshot is None:
+            statistics = snapshot.statistics("lineno")
+        else:
+            statistics = snapshot.compare_to(Profiler._snapshot, "lineno")
+
+        for statistic in statistics[:10]:
+            logging.info("tracemalloc %s: %s", label, statistic)
+
+        Profiler._snapshot = snapshot
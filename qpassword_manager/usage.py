@@ -0,0 +1,91 @@
+"""Ranking entries by how often and how recently they are used"""
+
+import json
+import logging
+import math
+import os
+import time
+from cryptography.fernet import InvalidToken
+from qpassword_manager.database.database_handler import backend_name
+
+# seconds after which a use counts half as much
+HALF_LIFE = 14 * 24 * 3600
+
+
+def store_path(username, config, name="usage") -> str:
+    """Returns path of the usage file of a user, or of another file kept
+    by entry id like it, relative to the data directory like the vaults.
+    Entry ids differ between vaults, so every backend has its own file."""
+
+    return f"{name}_{backend_name(config)}_{username}"
+
+
+class UsageRanking:
+    """
+    Scores of used entries, stored encrypted
+
+    A use at time t adds 2 ** (t / HALF_LIFE) to the score of an entry, so
+    older uses count less. Every score decays at the same rate, which
+    keeps their order the same as time passes: a score only changes when
+    its entry is used and two scores compare without knowing the current
+    time. Scores are kept as their log2 so they don't overflow.
+
+    Attributes:
+        path: file the scores are stored in
+        cipher: VaultCipher the file is encrypted with
+        keys: log2 of the score by entry id
+    """
+
+    def __init__(self, path, cipher) -> None:
+        self.path = path
+        self.cipher = cipher
+        self.keys = {}
+
+    def load(self) -> None:
+        """Reads the scores, a file that can't be read is started over"""
+
+        try:
+            with open(self.path, "rb") as file:
+                data = json.loads(self.cipher.decrypt(file.read()))
+            self.keys = {int(entry_id): key for entry_id, key in data.items()}
+        except FileNotFoundError:
+            self.keys = {}
+        except (InvalidToken, ValueError) as error:
+            logging.warning("%s can't be read: %r", self.path, error)
+            self.keys = {}
+
+    def save(self) -> None:
+        """Writes the scores to a temporary file and renames it"""
+
+        with open(self.path + ".new", "wb") as file:
+            file.write(self.cipher.encrypt(json.dumps(self.keys).encode()))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".new", self.path)
+
+    def record(self, entry_id, now=None) -> None:
+        """Adds a use of an entry at now, the current time if None"""
+
+        if entry_id < 0:
+            # only in MainWindow.changes, the id changes once committed
+            return
+
+        use = (time.time() if now is None else now) / HALF_LIFE
+        old = self.keys.get(entry_id)
+        if old is None:
+            self.keys[entry_id] = use
+        else:
+            high, low = max(old, use), min(old, use)
+            self.keys[entry_id] = high + math.log2(1 + 2 ** (low - high))
+
+    def key(self, entry_id) -> float:
+        """Returns the key an entry ranks by, higher for entries used more
+        and more recently, -inf for entries never used"""
+
+        return self.keys.get(entry_id, -math.inf)
+
+    def remove(self, entry_ids) -> None:
+        """Drops the scores of removed entries"""
+
+        for entry_id in entry_ids:
+            self.keys.pop(entry_id, None)
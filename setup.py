@@ -18,9 +18,14 @@ if __name__ == "__main__":
             "requests",
             "pyxdg",
         ],
+        extras_require={"wire": ["msgpack", "urllib3[zstd]"]},
         entry_points={
             "gui_scripts": [
                 "qpassword_manager = qpassword_manager.__main__:main"
-            ]
+            ],
+            # gui_scripts have no console on Windows
+            "console_scripts": [
+                "qpassword_manager-cli = qpassword_manager.__main__:main"
+            ],
         },
     )
@@ -0,0 +1 @@
+"""Tests of qpassword_manager, run with python -m unittest"""
@@ -0,0 +1,73 @@
+"""A local http server standing in for the qpassword_manager server"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeServer:  # pylint: disable=too-few-public-methods
+    """
+    Serves POST requests from routes in a background thread
+
+    Attributes:
+        url: url of the server
+        routes: function by path taking the json body and returning the
+            status code and the json answer
+        requests: paths of the requests received
+    """
+
+    def __init__(self, routes) -> None:
+        self.routes = routes
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answers from server.routes"""
+
+            def do_POST(self) -> None:  # pylint: disable=invalid-name
+                """Answers a POST request"""
+
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"null")
+                server.requests.append(self.path)
+                route = server.routes.get(self.path)
+                status, answer = route(body) if route else (404, None)
+
+                data = b"" if answer is None else json.dumps(answer).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client stopped waiting for a slow answer
+                    pass
+
+            def do_HEAD(self) -> None:  # pylint: disable=invalid-name
+                """Answers the probes of CircuitBreaker"""
+
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args) -> None:
+                """Keeps the test output quiet"""
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True
+        )
+        self.thread.start()
+
+    def close(self) -> None:
+        """Stops the server"""
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def online_config(url) -> dict:
+    """Returns configuration of the online backend"""
+
+    return {"url": url, "database_online": True}
@@ -0,0 +1,120 @@
+"""Tests of the agent keeping unlocked vaults"""
+
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+from qpassword_manager import agent
+from qpassword_manager.agent import Agent
+from qpassword_manager.conf.connectorconfig import Config
+from qpassword_manager.crypto import derive_key, encode_token
+from qpassword_manager.database.database_handler import DatabaseHandler
+from tests.vault import VaultTestCase, credentials, offline_config
+
+
+class AgentTest(VaultTestCase):
+    """Locking vaults whose timeout passed and serving changed entries"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        with mock.patch.object(Config, "config", return_value=offline_config()):
+            self.agent = Agent(
+                os.path.join(os.getcwd(), "agent", "agent.sock"), 900
+            )
+        self.addCleanup(self.agent.server_close)
+        self.key, self.cipher = credentials("key")
+        self.agent.run(
+            "add",
+            {
+                "username": "bob",
+                "auth": self.key,
+                "key": derive_key("key").decode(),
+            },
+        )
+
+    def test_lock_without_requests(self) -> None:
+        """A vault is locked once its timeout passed even if nothing asks
+        for it"""
+
+        self.agent.vaults["bob"].expires = time.monotonic() + 0.05
+        thread = threading.Thread(
+            target=self.agent.serve_forever, args=(0.01,), daemon=True
+        )
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.agent.shutdown)
+
+        deadline = time.monotonic() + 5
+        while self.agent.vaults and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.agent.vaults, {})
+
+    def test_invalidate(self) -> None:
+        """An entry changed by another process is read again after
+        invalidate"""
+
+        auth = ("bob", self.key)
+        other = DatabaseHandler(offline_config())
+        other.register("bob", "", self.key)
+        other.add_to_database(
+            "site", "user", encode_token(self.cipher.encrypt(b"old")), auth
+        )
+        entry_id = other.get_entry_ids(auth)[0]
+        self.assertEqual(
+            self.agent.run("get", {"username": "bob", "id": entry_id}),
+            {"password": "old"},
+        )
+
+        other.update_entry(
+            entry_id,
+            "site",
+            "user",
+            encode_token(self.cipher.encrypt(b"new")),
+            auth,
+        )
+        self.agent.run("invalidate", {"username": "bob"})
+        self.assertEqual(
+            self.agent.run("get", {"username": "bob", "id": entry_id}),
+            {"password": "new"},
+        )
+
+    def test_partial_index(self) -> None:
+        """A listing that fails part way isn't kept as the index"""
+
+        def stream(*_):
+            yield [(1, "site", "user", None)]
+            raise OSError("connection lost")
+
+        self.agent.handler.register("bob", "", self.key)
+        with mock.patch.object(self.agent.handler, "stream_all", stream):
+            with self.assertRaises(OSError):
+                self.agent.run("ls", {"username": "bob"})
+        self.assertIsNone(self.agent.vaults["bob"].index)
+        self.assertEqual(
+            self.agent.run("ls", {"username": "bob"}), {"entries": []}
+        )
+
+    def test_shared_directory(self) -> None:
+        """Clients don't talk to an agent whose socket others can reach"""
+
+        with mock.patch.dict(os.environ, {"XDG_RUNTIME_DIR": os.getcwd()}):
+            with mock.patch.object(
+                Config, "config", return_value=offline_config()
+            ):
+                server = Agent(agent.socket_path(), 900)
+            self.addCleanup(server.server_close)
+            thread = threading.Thread(
+                target=server.serve_forever, args=(0.01,), daemon=True
+            )
+            thread.start()
+            self.addCleanup(thread.join)
+            self.addCleanup(server.shutdown)
+
+            self.assertEqual(agent.request("ping"), {})
+            os.chmod(os.path.dirname(agent.socket_path()), 0o755)
+            self.assertIsNone(agent.request("ping"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Tests of the password audit carried over between sessions"""
+
+import unittest
+from qpassword_manager.audit import PasswordAudit
+from qpassword_manager.crypto import encode_token
+from qpassword_manager.database.database_handler import DatabaseHandler
+from tests.vault import VaultTestCase, credentials, entries, offline_config
+
+
+class IncrementalAuditTest(VaultTestCase):
+    """Passes over a vault that only fetch the passwords that changed"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.errors = []
+        self.key, self.cipher = credentials("key")
+        self.auth = ("bob", self.key)
+        self.handler = DatabaseHandler(offline_config(), self.errors.append)
+        self.handler.register("bob", "", self.key)
+        for website, username, password in entries(self.cipher, 5):
+            self.handler.add_to_database(website, username, password, self.auth)
+        self.fetched = []
+
+    def fetch(self, entry_id) -> str:
+        """Returns the ciphertext of an entry and records the fetch"""
+
+        self.fetched.append(entry_id)
+        return self.handler.get_entry(entry_id, self.auth)[2]
+
+    def audit_pass(self, with_password) -> PasswordAudit:
+        """Loads the stored audit, updates it in one pass and stores it"""
+
+        audit = PasswordAudit(self.cipher, "audit_bob", self.fetch)
+        audit.load()
+        audit.begin(self.handler.modification_order(self.auth))
+        for batch in self.handler.stream_all(self.auth, 2, with_password):
+            audit.update(batch)
+        audit.end()
+        while audit.step(100):
+            pass
+        audit.save()
+        return audit
+
+    def test_changed_entries(self) -> None:
+        """Only entries updated or added since the last pass are fetched"""
+
+        self.audit_pass(True)
+        self.assertEqual(self.fetched, [])
+
+        ids = self.handler.get_entry_ids(self.auth)
+        password = encode_token(self.cipher.encrypt(b"pw0"))
+        self.handler.update_entry(
+            ids[2], "site2.com", "user2", password, self.auth
+        )
+        self.handler.add_to_database("new.com", "new", password, self.auth)
+        self.handler.remove_from_database(ids[4], self.auth)
+
+        audit = self.audit_pass(False)
+        self.assertEqual(self.fetched, [ids[2], max(ids) + 1])
+        self.assertEqual(len(audit.entries), 5)
+        self.assertEqual(len(audit.report()["reused"]), 1)
+        self.assertEqual(len(audit.report()["reused"][0]), 3)
+
+        self.fetched.clear()
+        self.audit_pass(False)
+        self.assertEqual(self.fetched, [])
+        self.assertEqual(self.errors, [])
+
+    def test_queued_change(self) -> None:
+        """A committed change is audited from its ciphertext and isn't
+        fetched again by a pass over a vault without modification order"""
+
+        audit = self.audit_pass(True)
+        entry_id = self.handler.get_entry_ids(self.auth)[0]
+        password = encode_token(self.cipher.encrypt(b"pw1"))
+        audit.queue(entry_id, "site0.com", "user0", password)
+        audit.step(100)
+        self.assertEqual(audit.reused(entry_id), 1)
+
+        audit.begin({})
+        audit.update(next(self.handler.stream_all(self.auth, 10, False)))
+        audit.end()
+        self.assertFalse(audit.step(100))
+        self.assertEqual(self.fetched, [])
+        self.assertEqual(audit.reused(entry_id), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Tests of the append-only log vault with damaged files"""
+
+import os
+import unittest
+from qpassword_manager.database.database_handler import DatabaseHandler
+from qpassword_manager.database.log_backend import (
+    MAGIC,
+    RECORD_CRC,
+    RECORD_HEADER,
+    VaultLog,
+)
+from tests.vault import VaultTestCase, credentials, entries, offline_config
+
+
+class DamagedLogTest(VaultTestCase):
+    """Opening and verifying logs with corrupt or torn records"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.errors = []
+        self.key, self.cipher = credentials("key")
+        self.auth = ("bob", self.key)
+        handler = self.handler()
+        handler.register("bob", "", self.key)
+        for website, username, password in entries(self.cipher, 10):
+            handler.add_to_database(website, username, password, self.auth)
+        handler.backend.vault("bob").close()
+
+        vault = VaultLog(os.path.abspath("bob.log"))
+        self.records = sorted(vault.index.values())
+        self.size = vault.size
+        vault.close()
+
+    def handler(self) -> DatabaseHandler:
+        """Returns a handler that opens the log again"""
+
+        handler = DatabaseHandler(offline_config("log"), self.errors.append)
+        self.addCleanup(
+            lambda: [vault.close() for vault in handler.backend.vaults.values()]
+        )
+        return handler
+
+    def flip(self, offset) -> None:
+        """Changes one byte of the log"""
+
+        with open("bob.log", "r+b") as file:
+            file.seek(offset)
+            byte = file.read(1)[0]
+            file.seek(offset)
+            file.write(bytes([byte ^ 0xFF]))
+
+    def test_corrupt_record(self) -> None:
+        """A corrupt record in the middle only loses its entry, verify
+        reports it"""
+
+        offset, size = self.records[2]
+        self.flip(offset + size // 2)
+
+        handler = self.handler()
+        with self.assertLogs(level="WARNING") as logs:
+            ids = handler.get_entry_ids(self.auth)
+        self.assertEqual(ids, [1, 2, 4, 5, 6, 7, 8, 9, 10])
+        self.assertIn(f"skipping corrupt record at {offset}", logs.output[0])
+        self.assertEqual(os.path.getsize("bob.log"), self.size)
+
+        result = handler.verify(self.auth, self.cipher)
+        self.assertEqual(result["entries"], 9)
+        self.assertEqual(result["corrupt"], [])
+        self.assertEqual(len(result["storage"]), 1)
+        self.assertIn(f"record at {offset} (entry 3)", result["storage"][0])
+        self.assertIn(f"{size} bytes skipped", result["storage"][0])
+
+        password = entries(self.cipher, 1)[0][2]
+        handler.add_to_database("new", "new", password, self.auth)
+        handler = self.handler()
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(handler.get_entry_ids(self.auth)[-1], 11)
+        self.assertEqual(len(handler.backend.check_storage(self.auth)), 1)
+        self.assertEqual(self.errors, [])
+
+    def test_corrupt_header(self) -> None:
+        """A record whose length is corrupt doesn't cut off the ones after"""
+
+        offset, _ = self.records[4]
+        self.flip(offset + RECORD_HEADER.size - 1)
+
+        handler = self.handler()
+        with self.assertLogs(level="WARNING"):
+            ids = handler.get_entry_ids(self.auth)
+        self.assertEqual(ids, [1, 2, 3, 4, 6, 7, 8, 9, 10])
+        self.assertEqual(os.path.getsize("bob.log"), self.size)
+        self.assertEqual(len(handler.backend.check_storage(self.auth)), 1)
+
+    def test_torn_end(self) -> None:
+        """A torn record at the end is reported and cut off when the vault
+        is opened"""
+
+        offset, size = self.records[-1]
+        os.truncate("bob.log", offset + size - RECORD_CRC.size)
+
+        problems = self.handler().backend.check_storage(self.auth)
+        self.assertEqual(len(problems), 1)
+        self.assertIn("torn record", problems[0])
+
+        handler = self.handler()
+        with self.assertLogs(level="WARNING") as logs:
+            ids = handler.get_entry_ids(self.auth)
+        self.assertEqual(ids, list(range(1, 10)))
+        self.assertIn("dropping", logs.output[0])
+        self.assertEqual(os.path.getsize("bob.log"), offset)
+        self.assertEqual(handler.backend.check_storage(self.auth), [])
+
+    def test_clean(self) -> None:
+        """An undamaged log has no problems"""
+
+        result = self.handler().verify(self.auth, self.cipher)
+        self.assertEqual(result, {"entries": 10, "corrupt": [], "storage": []})
+        self.assertGreater(self.records[0][0], len(MAGIC))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Tests of upgrading offline databases"""
+
+import os
+import sqlite3
+import unittest
+from unittest import mock
+from qpassword_manager.database import migrations
+from tests.vault import VaultTestCase
+
+
+class MigrateTest(VaultTestCase):
+    """Upgrading a database from before schema versions"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        conn = sqlite3.connect("bob.db")
+        cursor = conn.cursor()
+        migrations.create_tables(cursor)
+        cursor.execute(
+            """insert into passwords (website, username, password)
+               values ('Master', 'Key', 'key')"""
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def version(self) -> int:
+        """Returns the schema version of the database"""
+
+        conn = sqlite3.connect("bob.db")
+        cursor = conn.cursor()
+        try:
+            return migrations.schema_version(cursor)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def test_concurrent_migrate(self) -> None:
+        """A process that read the old version before another one migrated
+        the database leaves it as it is"""
+
+        migrations.migrate("bob.db")
+        self.assertEqual(self.version(), migrations.SCHEMA_VERSION)
+        self.assertTrue(os.path.exists("bob.db.v0.bak"))
+
+        stale = [0]
+
+        def schema_version(cursor) -> int:
+            return stale.pop() if stale else read_version(cursor)
+
+        read_version = migrations.schema_version
+        with mock.patch.object(migrations, "schema_version", schema_version):
+            migrations.migrate("bob.db", backup=False)
+        self.assertEqual(stale, [])
+        self.assertEqual(self.version(), migrations.SCHEMA_VERSION)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Tests of the answers of the server the online backend accepts"""
+
+import unittest
+import requests
+from qpassword_manager.database.database_handler import DatabaseHandler
+from tests.server import FakeServer, online_config
+from tests.vault import credentials
+
+
+def refuse(_) -> (int, object):
+    """Answers a write the server doesn't make"""
+
+    return 500, {"error": "disk full"}
+
+
+class OnlineBackendTest(unittest.TestCase):
+    """Requests the server answers with an error status"""
+
+    def setUp(self) -> None:
+        self.server = FakeServer(
+            {
+                "/check_credentials": lambda _: (200, True),
+                "/add_to_database": refuse,
+                "/add_entries": refuse,
+                "/update_entry": refuse,
+                "/remove_from_database": refuse,
+            }
+        )
+        self.addCleanup(self.server.close)
+        self.errors = []
+        self.handler = DatabaseHandler(
+            {**online_config(self.server.url), "retries": 0},
+            self.errors.append,
+        )
+        self.auth = ("bob", "key")
+
+    def test_failed_writes(self) -> None:
+        """Writes the server refuses aren't reported as done"""
+
+        self.assertIsNone(
+            self.handler.add_to_database("site", "user", "pw", self.auth)
+        )
+        self.assertIsNone(
+            self.handler.update_entry(1, "site", "user", "pw", self.auth)
+        )
+        self.assertIsNone(self.handler.remove_from_database(1, self.auth))
+        self.assertEqual(len(self.errors), 3)
+        self.assertTrue(all("500" in error for error in self.errors))
+
+        with self.assertRaises(requests.HTTPError):
+            self.handler.backend.add_entries(
+                [["site", "user", credentials("key")[1].encrypt(b"pw")]],
+                self.auth,
+            )
+
+    def test_refused_credentials(self) -> None:
+        """An error page of the server doesn't log in"""
+
+        self.server.routes["/check_credentials"] = lambda _: (
+            401,
+            {"error": "wrong credentials"},
+        )
+        self.assertFalse(self.handler.check_credentials(*self.auth))
+        self.assertEqual(self.handler.backend.sessions, {})
+
+        self.server.routes["/check_credentials"] = lambda _: (200, True)
+        self.assertTrue(self.handler.check_credentials(*self.auth))
+
+
+if __name__ == "__main__":
+    unittest.main()
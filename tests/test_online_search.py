@@ -0,0 +1,86 @@
+"""Tests of searching online vaults"""
+
+import unittest
+from qpassword_manager.database.database_handler import DatabaseHandler
+from tests.server import FakeServer, online_config
+
+ENTRIES = [
+    [entry_id, f"site{entry_id}.com", f"user{entry_id}", None]
+    for entry_id in range(1, 31)
+]
+
+
+def basic_auth(_) -> (int, object):
+    """Answers /check_credentials of a server without sessions"""
+
+    return 200, True
+
+
+def get_all(_) -> (int, object):
+    """Answers /get_all with websites, usernames and passwords"""
+
+    return 200, [entry[1:] for entry in ENTRIES]
+
+
+def get_entry_ids(_) -> (int, object):
+    """Answers /get_entry_ids"""
+
+    return 200, [entry[0] for entry in ENTRIES]
+
+
+def search(body) -> (int, object):
+    """Answers /search, the cursor is the position after the last entry"""
+
+    query = body["query"].casefold()
+    found = [entry[:3] for entry in ENTRIES if query in entry[1].casefold()]
+    start = int(body["cursor"] or 0)
+    end = start + min(body["limit"], 4)
+    return 200, {
+        "entries": found[start:end],
+        "cursor": str(end) if end < len(found) else None,
+    }
+
+
+class OnlineSearchTest(unittest.TestCase):
+    """Searching with and without /search on the server"""
+
+    def setUp(self) -> None:
+        self.errors = []
+        self.routes = {
+            "/check_credentials": basic_auth,
+            "/get_all": get_all,
+            "/get_entry_ids": get_entry_ids,
+        }
+        self.server = FakeServer(self.routes)
+        self.addCleanup(self.server.close)
+        self.handler = DatabaseHandler(
+            online_config(self.server.url), self.errors.append
+        )
+        self.auth = ("bob", "key")
+
+    def test_without_search(self) -> None:
+        """Servers without /search are searched by listing the vault, the
+        404 is only asked for once"""
+
+        results = self.handler.search("SITE1", self.auth, 5, 2)
+        self.assertEqual([entry[0] for entry in results], [11, 12, 13, 14, 15])
+        self.assertEqual(self.handler.search("user3", self.auth, 5, 0)[0][0], 3)
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self.server.requests.count("/search"), 1)
+
+    def test_unknown_offset(self) -> None:
+        """An offset without a known cursor is reached by paging"""
+
+        self.routes["/search"] = search
+        results = self.handler.search("site", self.auth, 5, 7)
+        self.assertEqual([entry[0] for entry in results], list(range(8, 13)))
+
+        results = self.handler.search("site", self.auth, 5, 12)
+        self.assertEqual([entry[0] for entry in results], list(range(13, 18)))
+        results = self.handler.search("site", self.auth, 100, 28)
+        self.assertEqual([entry[0] for entry in results], [29, 30])
+        self.assertEqual(self.errors, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+"""Tests of changing the master key"""
+
+import sqlite3
+import unittest
+from unittest import mock
+from qpassword_manager.database.database_handler import DatabaseHandler
+from qpassword_manager.database.migrations import create_tables
+from tests.vault import VaultTestCase, credentials, offline_config
+
+
+def legacy_vault(username, master_key, cipher, count) -> None:
+    """Creates a vault the way it was stored before schema versions, with
+    the master key in the first row and Fernet tokens as text"""
+
+    conn = sqlite3.connect(username + ".db")
+    cursor = conn.cursor()
+    create_tables(cursor)
+    cursor.execute(
+        """insert into passwords (website, username, password)
+           values ('Master', 'Key', ?)""",
+        (master_key,),
+    )
+    cursor.executemany(
+        """insert into passwords (website, username, password)
+           values (?, ?, ?)""",
+        [
+            (f"site{i}.com", f"user{i}", cipher.fernet.encrypt(b"pw").decode())
+            for i in range(count)
+        ],
+    )
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+class LegacyRekeyTest(VaultTestCase):
+    """Changing the master key of a vault with Fernet tokens as text"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.errors = []
+        self.handler = DatabaseHandler(offline_config(), self.errors.append)
+        self.old_key, self.old_cipher = credentials("old")
+        self.new_key, self.new_cipher = credentials("new")
+        legacy_vault("bob", self.old_key, self.old_cipher, 5)
+
+    def test_rekey(self) -> None:
+        """Every entry is re-encrypted and only the new key works"""
+
+        self.assertTrue(
+            self.handler.change_master_key(
+                ("bob", self.old_key),
+                self.new_key,
+                self.old_cipher,
+                self.new_cipher,
+            )
+        )
+        self.assertEqual(self.errors, [])
+        self.assertTrue(self.handler.check_credentials("bob", self.new_key))
+        self.assertFalse(self.handler.check_credentials("bob", self.old_key))
+
+        entries = self.handler.get_all(("bob", self.new_key))
+        self.assertEqual(len(entries), 5)
+        for entry in entries:
+            self.assertEqual(self.new_cipher.decrypt(entry[3]), b"pw")
+
+        conn = sqlite3.connect("bob.db")
+        self.assertIsNone(
+            conn.execute(
+                "select value from metadata where (key = 'rekey_master_key')"
+            ).fetchone()
+        )
+        conn.close()
+
+    def test_failed_rekey(self) -> None:
+        """A change that fails keeps the old key and can be tried again"""
+
+        conn = sqlite3.connect("bob.db")
+        conn.execute("update passwords set password = 'corrupt' where id = 3")
+        conn.commit()
+        conn.close()
+
+        self.assertIsNone(
+            self.handler.change_master_key(
+                ("bob", self.old_key),
+                self.new_key,
+                self.old_cipher,
+                self.new_cipher,
+            )
+        )
+        self.assertEqual(len(self.errors), 1)
+        self.assertTrue(self.handler.check_credentials("bob", self.old_key))
+
+        conn = sqlite3.connect("bob.db")
+        self.assertIsNone(
+            conn.execute(
+                "select value from metadata where (key = 'rekey_master_key')"
+            ).fetchone()
+        )
+        conn.close()
+
+    def test_interrupted_rekey(self) -> None:
+        """A change interrupted by a file error keeps its checkpoints and
+        is finished by the next try"""
+
+        with mock.patch.object(
+            self.handler.backend, "finish_rekey", side_effect=OSError("full")
+        ):
+            self.assertIsNone(
+                self.handler.change_master_key(
+                    ("bob", self.old_key),
+                    self.new_key,
+                    self.old_cipher,
+                    self.new_cipher,
+                )
+            )
+        self.assertEqual(self.errors, ["full"])
+
+        conn = sqlite3.connect("bob.db")
+        self.assertEqual(
+            conn.execute(
+                "select value from metadata where (key = 'rekey_master_key')"
+            ).fetchone(),
+            (self.new_key,),
+        )
+        conn.close()
+
+        self.assertTrue(
+            self.handler.change_master_key(
+                ("bob", self.old_key),
+                self.new_key,
+                self.old_cipher,
+                self.new_cipher,
+            )
+        )
+        self.assertTrue(self.handler.check_credentials("bob", self.new_key))
+
+
+if __name__ == "__main__":
+    unittest.main()
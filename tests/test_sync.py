@@ -0,0 +1,157 @@
+"""Tests of merging two vaults of a user"""
+
+import os
+import unittest
+from qpassword_manager.crypto import encode_token
+from qpassword_manager.database.database_handler import DatabaseHandler
+from tests.vault import VaultTestCase, credentials, entries, offline_config
+
+
+class SyncTest(VaultTestCase):
+    """Syncs between an sqlite and a log vault, which keep the state of
+    the last sync like the offline vault and the server do"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.errors = []
+        self.key, self.cipher = credentials("key")
+        self.auth = ("bob", self.key)
+        self.local = DatabaseHandler(offline_config(), self.errors.append)
+        self.remote = DatabaseHandler(offline_config("log"), self.errors.append)
+        self.addCleanup(
+            lambda: [
+                vault.close() for vault in self.remote.backend.vaults.values()
+            ]
+        )
+        for handler in (self.local, self.remote):
+            handler.register("bob", "", self.key)
+        for website, username, password in entries(self.cipher, 5):
+            self.local.add_to_database(website, username, password, self.auth)
+
+        self.assertEqual(self.sync()["pushed"], 5)
+
+    def sync(self, direction="both") -> dict:
+        """Syncs the vaults, returns the result"""
+
+        return self.local.sync_with(
+            self.remote, self.auth, self.cipher, direction
+        )
+
+    def names(self, handler) -> list:
+        """Returns the websites in a vault"""
+
+        return sorted(entry[1] for entry in handler.get_all(self.auth))
+
+    def entry_id(self, handler, website) -> int:
+        """Returns the id of the entry of website"""
+
+        return next(
+            entry[0]
+            for entry in handler.get_all(self.auth)
+            if entry[1] == website
+        )
+
+    def test_delete_then_sync(self) -> None:
+        """An entry deleted in one vault is deleted in the other one and
+        doesn't come back"""
+
+        self.local.remove_from_database(
+            self.entry_id(self.local, "site1.com"), self.auth
+        )
+        result = self.sync()
+        self.assertEqual(result["removed_remote"], 1)
+        self.assertEqual(result["pulled"], 0)
+        self.assertNotIn("site1.com", self.names(self.remote))
+
+        self.remote.remove_from_database(
+            self.entry_id(self.remote, "site2.com"), self.auth
+        )
+        result = self.sync()
+        self.assertEqual(result["removed_local"], 1)
+        self.assertEqual(result["pushed"], 0)
+
+        result = self.sync()
+        self.assertEqual(
+            (result["pushed"], result["pulled"], result["unchanged"]), (0, 0, 3)
+        )
+        expected = ["site0.com", "site3.com", "site4.com"]
+        self.assertEqual(self.names(self.local), expected)
+        self.assertEqual(self.names(self.remote), expected)
+        self.assertEqual(self.errors, [])
+
+    def test_change_one_side(self) -> None:
+        """An entry changed in one vault overwrites the other one without a
+        conflict"""
+
+        password = encode_token(self.cipher.encrypt(b"new"))
+        self.remote.update_entry(
+            self.entry_id(self.remote, "site3.com"),
+            "site3.com",
+            "user3",
+            password,
+            self.auth,
+        )
+        result = self.sync()
+        self.assertEqual(result["resolved"], 1)
+        self.assertEqual(result["conflicts"], [])
+
+        entry = self.local.get_entry(
+            self.entry_id(self.local, "site3.com"), self.auth
+        )
+        self.assertEqual(self.cipher.decrypt(entry[2]), b"new")
+
+    def test_one_direction(self) -> None:
+        """A deletion that can't be written yet is kept for a later sync"""
+
+        self.remote.remove_from_database(
+            self.entry_id(self.remote, "site0.com"), self.auth
+        )
+        result = self.sync("push")
+        self.assertEqual((result["pushed"], result["removed_local"]), (0, 0))
+        self.assertIn("site0.com", self.names(self.local))
+        self.assertNotIn("site0.com", self.names(self.remote))
+
+        self.assertEqual(self.sync()["removed_local"], 1)
+        self.assertNotIn("site0.com", self.names(self.local))
+
+    def test_missing_vault(self) -> None:
+        """A vault the user doesn't have yet is created by the first sync,
+        on either side"""
+
+        for name, handler, other in (
+            ("alice", self.local, self.remote),
+            ("carol", self.remote, self.local),
+        ):
+            auth = (name, self.key)
+            self.assertFalse(os.path.exists(f"{name}.db"))
+            self.assertFalse(os.path.exists(f"{name}.log"))
+            handler.register(name, "", self.key)
+            for website, username, password in entries(self.cipher, 3):
+                handler.add_to_database(website, username, password, auth)
+
+            result = handler.sync_with(other, auth, self.cipher)
+            self.assertEqual(result["pushed"], 3)
+            self.assertEqual(len(other.get_all(auth)), 3)
+            self.assertEqual(
+                other.register(name, "", self.key), "Username already taken"
+            )
+
+        self.assertEqual(self.errors, [])
+        self.assertEqual(
+            [path for path in os.listdir() if path.endswith(".bak")], []
+        )
+
+    def test_wrong_key(self) -> None:
+        """A vault with another master key isn't synced with"""
+
+        key, cipher = credentials("other")
+        self.remote.register("dave", "", key)
+        self.local.register("dave", "", self.key)
+        self.assertIsNone(
+            self.local.sync_with(self.remote, ("dave", self.key), cipher)
+        )
+        self.assertEqual(self.errors, ["Wrong master key for the log vault"])
+
+
+if __name__ == "__main__":
+    unittest.main()
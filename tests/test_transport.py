@@ -0,0 +1,121 @@
+"""Tests of the circuit breaker in front of the server"""
+
+import threading
+import time
+import unittest
+from qpassword_manager.database.database_handler import DatabaseHandler
+from tests.server import FakeServer, online_config
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """Opening the circuit for a server that stops answering and closing
+    it once the server is back"""
+
+    def setUp(self) -> None:
+        self.down = threading.Event()
+        self.overloaded = threading.Event()
+        self.server = FakeServer(
+            {
+                "/check_credentials": lambda _: (200, True),
+                "/get_entry_ids": self.get_entry_ids,
+            }
+        )
+        self.addCleanup(self.server.close)
+        self.addCleanup(self.down.clear)
+
+        self.errors = []
+        self.connect(0, 2)
+        self.auth = ("bob", "key")
+
+    def connect(self, retries, failure_threshold) -> None:
+        """Creates the handler with the retries and threshold given"""
+
+        self.handler = DatabaseHandler(
+            {
+                **online_config(self.server.url),
+                "read_timeout": 0.2,
+                "retries": retries,
+                "failure_threshold": failure_threshold,
+            },
+            self.errors.append,
+        )
+        self.breaker = self.handler.backend.breaker
+        self.breaker.probe_interval = 0.05
+
+    def get_entry_ids(self, _) -> (int, object):
+        """Answers after the read timeout while the server is down"""
+
+        if self.down.is_set():
+            time.sleep(0.5)
+        if self.overloaded.is_set():
+            return 503, {"error": "overloaded"}
+        return 200, [1]
+
+    def wait_half_open(self) -> None:
+        """Waits until a probe half opened the circuit"""
+
+        deadline = time.monotonic() + 5
+        while self.breaker.is_open and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.breaker.is_open)
+        self.assertTrue(self.breaker.half_open)
+
+    def test_half_open(self) -> None:
+        """A failed trial request opens the circuit again at once, one that
+        succeeds closes it"""
+
+        self.assertEqual(self.handler.get_entry_ids(self.auth), [1])
+        self.down.set()
+        for _ in range(2):
+            self.assertIsNone(self.handler.get_entry_ids(self.auth))
+        self.assertTrue(self.breaker.is_open)
+
+        sent = len(self.server.requests)
+        self.assertIsNone(self.handler.get_entry_ids(self.auth))
+        self.assertEqual(self.errors[-1], "Server is unreachable")
+        self.assertEqual(len(self.server.requests), sent)
+
+        self.wait_half_open()
+        self.assertIsNone(self.handler.get_entry_ids(self.auth))
+        self.assertTrue(self.breaker.is_open)
+
+        self.down.clear()
+        self.wait_half_open()
+        self.assertEqual(self.handler.get_entry_ids(self.auth), [1])
+        self.assertFalse(self.breaker.is_open)
+        self.assertFalse(self.breaker.half_open)
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_threshold(self) -> None:
+        """Failures below the threshold leave the circuit closed"""
+
+        self.down.set()
+        self.assertIsNone(self.handler.get_entry_ids(self.auth))
+        self.assertFalse(self.breaker.is_open)
+
+        self.down.clear()
+        self.assertEqual(self.handler.get_entry_ids(self.auth), [1])
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_retries(self) -> None:
+        """Every failed attempt counts, so a call whose retries all time
+        out opens the circuit"""
+
+        self.connect(2, 3)
+        self.down.set()
+        self.assertIsNone(self.handler.get_entry_ids(self.auth))
+        self.assertTrue(self.breaker.is_open)
+
+    def test_retry_status(self) -> None:
+        """A server answering 503 to every attempt opens the circuit"""
+
+        self.connect(1, 4)
+        self.overloaded.set()
+        self.handler.get_entry_ids(self.auth)
+        self.assertEqual(self.breaker.failures, 2)
+        self.handler.get_entry_ids(self.auth)
+        self.assertTrue(self.breaker.is_open)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""Helpers for tests working with offline vaults"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from qpassword_manager.crypto import VaultCipher, derive_key, encode_token
+
+
+def offline_config(backend="sqlite") -> dict:
+    """Returns configuration of an offline backend"""
+
+    return {"url": "", "database_online": False, "database_backend": backend}
+
+
+def credentials(master_key) -> (str, VaultCipher):
+    """Returns hashed master key and cipher of master_key"""
+
+    return (
+        hashlib.sha256(master_key.encode()).hexdigest(),
+        VaultCipher(derive_key(master_key)),
+    )
+
+
+def entries(cipher, count) -> list:
+    """Returns count (website, username, password) to add to a vault"""
+
+    return [
+        (f"site{i}.com", f"user{i}", encode_token(cipher.encrypt(b"pw%d" % i)))
+        for i in range(count)
+    ]
+
+
+class VaultTestCase(unittest.TestCase):
+    """Runs every test in a temporary directory, vaults are kept in the
+    working directory"""
+
+    def setUp(self) -> None:
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory)